@@ -0,0 +1,273 @@
+"""ASGI entry point: the Flask API plus asyncio-native versions of its long-held routes.
+
+Waiting for a recommendation, long-polling a job and streaming its events
+are served by coroutines that sleep until the job publishes something, so
+idle connections don't hold a thread. Calls into the session and job stores
+may block on SQLite and run in the thread pool. Every other route is the Flask app
+mounted through a WSGI adapter. Run with:
+
+    uvicorn api.asgi_app:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from api import backend_api
+from api.backend_api import (
+    REQUEST_TIMEOUT_SECONDS,
+    SSE_KEEPALIVE_SECONDS,
+    admission_rejected_body,
+    format_sse,
+    job_wait_seconds,
+    release_active_request,
+    render_result,
+    server_timing_headers,
+    submit_recommendation_job,
+    user_sessions,
+    wants_profile,
+)
+from services.admission import AdmissionRejected
+from services.jobs import JOB_POLL_SECONDS, Job, job_store
+from utils.log import bind_request_id, resolve_request_id
+from utils.response_encoding import compress, etag_for, record_payload, wants_v2
+
+logger = logging.getLogger(__name__)
+
+# Threads serving the mounted Flask routes, which are all short requests
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "10"))
+
+
+class RequestIdMiddleware:
+    """Correlation id for every request, shared with the mounted Flask routes.
+
+    The resolved id is written back into the request's X-Request-ID header,
+    so Flask's before_request hook picks up the same id instead of making one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = [(name, value) for name, value in scope["headers"] if name != b"x-request-id"]
+        sent_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = resolve_request_id(sent_id)
+        scope = dict(scope, headers=headers + [(b"x-request-id", request_id.encode())])
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                response_headers = list(message.get("headers", []))
+                if not any(name.lower() == b"x-request-id" for name, _ in response_headers):
+                    response_headers.append((b"x-request-id", request_id.encode()))
+                message = dict(message, headers=response_headers)
+            await send(message)
+
+        with bind_request_id(request_id):
+            await self.app(scope, receive, send_with_id)
+
+
+def json_response(request, payload, status_code=200, headers=None, conditional=False, body=None):
+    """JSON response encoded like the Flask routes: same ETags, compression and payload stats"""
+    # Serialized like Flask's jsonify so both servers produce the same ETags
+    raw = json.dumps(payload, separators=(",", ":"), sort_keys=True).encode() + b"\n"
+    headers = dict(headers or {})
+    endpoint = request.scope["endpoint"].__name__
+    response_format = "v2" if wants_v2(request.query_params, body) else "v1"
+    if conditional and status_code == 200:
+        etag = f'W/"{etag_for(raw)}"'
+        headers["ETag"] = etag
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            record_payload(endpoint, response_format, len(raw), 0, not_modified=True)
+            return Response(status_code=304, headers=headers)
+    sent, encoding = compress(raw, request.headers.get("Accept-Encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    headers["Vary"] = "Accept-Encoding"
+    record_payload(endpoint, response_format, len(raw), len(sent), encoding)
+    return Response(sent, status_code=status_code, headers=headers, media_type="application/json")
+
+
+class JobWatcher:
+    """Lets a coroutine sleep until a job publishes an event or finishes.
+
+    Local jobs wake the event loop from the worker thread; jobs owned by
+    another process (shared state) are polled.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self._changed = asyncio.Event()
+        self._remove = None
+        if isinstance(job, Job):
+            loop = asyncio.get_running_loop()
+            self._remove = job.add_listener(lambda: loop.call_soon_threadsafe(self._changed.set))
+
+    def reset(self):
+        """Forget earlier wake-ups, call before checking the job"""
+        self._changed.clear()
+
+    async def wait(self, timeout):
+        """Sleep until the job changes or timeout passes"""
+        if self._remove is None:
+            await asyncio.sleep(min(timeout, JOB_POLL_SECONDS))
+            await run_in_threadpool(self.job.refresh)
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait_finished(self, timeout):
+        """Sleep until the job finishes, returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            self.reset()
+            if self.job.finished:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await self.wait(remaining)
+
+    def close(self):
+        if self._remove is not None:
+            self._remove()
+
+
+async def get_shopping_recommendations(request):
+    """Same contract as the Flask route, waiting for the job on the event loop"""
+    try:
+        data = await request.json()
+        session_id = data.get("session_id")
+
+        if not session_id or not await run_in_threadpool(user_sessions.__contains__, session_id):
+            return json_response(request, {"status": "error", "message": "Invalid session"}, status_code=400)
+
+        try:
+            job, already_running = await run_in_threadpool(
+                submit_recommendation_job, data, profile=wants_profile(request.query_params, data)
+            )
+        except AdmissionRejected as rejection:
+            return json_response(
+                request,
+                admission_rejected_body(rejection),
+                status_code=429,
+                headers={"Retry-After": str(rejection.retry_after)},
+            )
+        if already_running:
+            return json_response(request, {"status": "processing", "message": "Request already being processed"}, status_code=202)
+
+        watcher = JobWatcher(job)
+        try:
+            finished = await watcher.wait_finished(REQUEST_TIMEOUT_SECONDS)
+        finally:
+            watcher.close()
+        if not finished:
+            # Nobody will read the result, give back its worker, scrapes and Gemini quota
+            await run_in_threadpool(job.cancel, "timeout")
+            await run_in_threadpool(release_active_request, job)
+            logger.warning("Request %s for session %s timed out", job.id, session_id)
+            return json_response(request, {"status": "error", "message": "Request processing failed"}, status_code=500)
+
+        return json_response(
+            request,
+            render_result(job.result, request.query_params, data),
+            status_code=job.http_status,
+            headers=server_timing_headers(job),
+            body=data,
+        )
+
+    except Exception as e:
+        logger.exception("Error serving recommendations")
+        return json_response(request, {"status": "error", "message": str(e)}, status_code=500)
+
+
+async def get_recommendation_job(request):
+    """Job status, long-polling on the event loop when ?wait= is given"""
+    job = await run_in_threadpool(job_store.get, request.path_params["job_id"])
+    if job is None:
+        return json_response(request, {"status": "error", "message": "Job not found"}, status_code=404)
+    wait = job_wait_seconds(request.query_params.get("wait"))
+    if wait:
+        watcher = JobWatcher(job)
+        try:
+            await watcher.wait_finished(wait)
+        finally:
+            watcher.close()
+    if not job.finished:
+        return json_response(request, {"status": "processing", "job": job.to_dict()}, status_code=202)
+    data = job.to_dict(include_result=True)
+    data["result"] = render_result(data.get("result"), request.query_params)
+    return json_response(
+        request,
+        {"status": job.status, "job": data},
+        headers=server_timing_headers(job),
+        conditional=True,
+    )
+
+
+async def stream_recommendation_job(request):
+    """Server-sent events for a job, same events and replay rules as the Flask route"""
+    job = await run_in_threadpool(job_store.get, request.path_params["job_id"])
+    if job is None:
+        return json_response(request, {"status": "error", "message": "Job not found"}, status_code=404)
+
+    try:
+        last_id = int(request.headers.get("Last-Event-ID", -1))
+    except ValueError:
+        last_id = -1
+
+    async def generate():
+        nonlocal last_id
+        watcher = JobWatcher(job)
+        last_sent = time.monotonic()
+        try:
+            while True:
+                watcher.reset()
+                events = await run_in_threadpool(job.events_since, last_id, 0)
+                for event_id, event, data in events:
+                    yield format_sse(event_id, event, data)
+                    last_id = event_id
+                if events:
+                    last_sent = time.monotonic()
+                if job.finished and last_id >= await run_in_threadpool(lambda: job.last_event_id):
+                    return
+                if time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+                await watcher.wait(SSE_KEEPALIVE_SECONDS - (time.monotonic() - last_sent))
+        finally:
+            watcher.close()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+app = Starlette(
+    routes=[
+        Route("/api/shopping-recommendations", get_shopping_recommendations, methods=["POST"]),
+        Route("/api/shopping-recommendations/jobs/{job_id}", get_recommendation_job, methods=["GET"]),
+        Route("/api/shopping-recommendations/jobs/{job_id}/events", stream_recommendation_job, methods=["GET"]),
+        Mount("/", app=WSGIMiddleware(backend_api.app, workers=ASGI_WSGI_THREADS)),
+    ],
+    # Replaces Flask-CORS' headers on mounted routes rather than duplicating them
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(RequestIdMiddleware),
+    ],
+)
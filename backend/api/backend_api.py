@@ -1,17 +1,68 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+import io
 import json
+import logging
+import pstats
 import threading
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
 from utils.domain_gen import get_amazon_domain
-from services.amazon_scraper import amazon_category_top_products, scrape_amazon_product
-from services.prompt_builder import build_and_get_categories
-from services.sorting_algorithm import SortingAlgorithm
+from services.amazon_scraper import get_cache_stats as get_scrape_cache_stats, search_cache, search_cache_key
+from services import precompute
+from services.scrape_scheduler import scrape_category, scrape_scheduler
+from services.jobs import job_store
+from services.session_store import session_store
+from services import response_cache
+from services.admission import PRIORITY_CLASSES, AdmissionController, AdmissionRejected
+from utils.cancellation import (
+    CancellationToken,
+    Cancelled,
+    get_cancellation_stats,
+    raise_if_cancelled,
+    time_left,
+)
+from utils.metrics import REQUEST_SECONDS, STAGE_SECONDS, registry as metrics_registry, timed_stage
+from utils.tracing import PROFILING_ENABLED, Trace, profile_path, profiled, use_trace
+from utils.log import (
+    bind_request_id,
+    configure_logging,
+    get_logging_stats,
+    current_request_id,
+    reset_request_id,
+    resolve_request_id,
+    set_request_id,
+)
+from utils.response_encoding import (
+    compress,
+    etag_for,
+    get_payload_stats,
+    record_payload,
+    requested_fields,
+    to_v2,
+    wants_v2,
+)
+from services.prompt_builder import build_and_get_categories, stream_and_get_categories
+from services.sorting_algorithm import (
+    SortingAlgorithm,
+    get_shortlist_stats,
+    recent_ranking_latency,
+)
+from services.local_ranker import local_ranker
+from services.product_index import ProductJoinIndex
+from services.gemini_scheduler import gemini_scheduler
+from services.gemini_client import GeminiError, get_prefix_cache_stats
+from services.improved_categories import CATEGORY_KEYWORDS, clean_category_name
+from services.intent_classifier import intent_classifier
 import re
+import time
+import uuid
 from threading import Lock
 from queue import Queue
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.config['APP_NAME'] = 'Eventually Yours Shopping App'
 CORS(app)  # Enable CORS for all routes
@@ -19,17 +70,100 @@ CORS(app)  # Enable CORS for all routes
 # Load environment variables
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
-# Global variables to store user data and results
-user_sessions = {}
+# User data and results per session, bounded and expired by the store
+user_sessions = session_store
 
 # Global variables for concurrent processing
 request_queue = Queue()
 processing_lock = Lock()
 active_requests = {}
-request_results = {}
 
 # Worker pool for concurrent processing
 worker_pool = ThreadPoolExecutor(max_workers=3)  # Handle 3 concurrent requests
+REQUEST_TIMEOUT_SECONDS = 120
+# Scraping stops this long before the request deadline so the products found so far can be ranked
+DEADLINE_RANKING_RESERVE_SECONDS = float(os.getenv("DEADLINE_RANKING_RESERVE_SECONDS", "10"))
+# Feeds worker_pool in priority order and turns away requests that couldn't finish in time
+admission = AdmissionController(worker_pool)
+
+# Ranking mode: "gemini", "local", or "auto" (local when Gemini ranking is slow)
+RANKING_MODES = ("gemini", "local", "auto")
+RANKING_MODE = os.getenv("RANKING_MODE", "auto")
+GEMINI_SLOW_RANKING_SECONDS = float(os.getenv("GEMINI_SLOW_RANKING_SECONDS", "8"))
+# Re-probe Gemini once the latency sample is this old, so auto mode can recover
+RANKING_LATENCY_MAX_AGE = 120
+
+# Stream Gemini categories and start scraping each one as soon as it arrives
+STREAM_CATEGORIES = os.getenv("GEMINI_STREAM_CATEGORIES", "false").lower() in ("1", "true", "yes")
+MAX_CATEGORIES = 5
+# Products a results page shows when the scraped products are ranked locally
+DISPLAYED_PRODUCTS = 6
+# Products searched per category, kept low to stay conservative with Amazon
+RESULTS_PER_CATEGORY = 1
+# Rank as soon as this many valid in-budget products are scraped and drop the slower categories.
+# Opt-in, it trades products on the results page for latency; 0 waits for every category
+QUORUM_PRODUCTS = int(os.getenv("QUORUM_PRODUCTS", "0"))
+
+# Skip Gemini category generation when the local intent classifier is at least this confident
+LOCAL_CATEGORIES = os.getenv("LOCAL_CATEGORIES", "true").lower() in ("1", "true", "yes")
+LOCAL_CATEGORY_CONFIDENCE = float(os.getenv("LOCAL_CATEGORY_CONFIDENCE", "0.75"))
+
+# Responses that carry an ETag and answer If-None-Match with 304
+CONDITIONAL_ENDPOINTS = {"get_recommendation_job", "export_user_data"}
+
+
+@app.before_request
+def bind_request_context():
+    """Give the request a correlation id, reused from X-Request-ID when the client sent one"""
+    g.request_id = resolve_request_id(request.headers.get("X-Request-ID"))
+    g.request_id_token = set_request_id(g.request_id)
+
+
+@app.teardown_request
+def unbind_request_context(exc=None):
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        reset_request_id(token)
+
+
+@app.after_request
+def encode_response(response):
+    """Add validators to result endpoints, compress JSON bodies and measure their size"""
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    if response.is_streamed or response.direct_passthrough or response.mimetype != "application/json":
+        return response
+    raw = response.get_data()
+    not_modified = False
+    if request.endpoint in CONDITIONAL_ENDPOINTS and response.status_code == 200:
+        response.set_etag(etag_for(raw), weak=True)
+        response = response.make_conditional(request)
+        not_modified = response.status_code == 304
+    encoding = None
+    if not not_modified:
+        body, encoding = compress(raw, request.headers.get("Accept-Encoding"))
+        if encoding:
+            response.set_data(body)
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+    response_format = "v2" if wants_v2(request.args, request.get_json(silent=True) or {}) else "v1"
+    record_payload(
+        request.endpoint, response_format, len(raw),
+        0 if not_modified else response.content_length or 0, encoding, not_modified,
+    )
+    return response
+
+
+# Comment line sent on idle event streams so proxies keep the connection open
+SSE_KEEPALIVE_SECONDS = 15
+
+# Time from the start of category generation to the first scrape, per mode
+category_timing_lock = Lock()
+category_timing_stats = {
+    mode: {"requests": 0, "total_time_to_first_scrape": 0.0, "last_time_to_first_scrape": None}
+    for mode in ("local", "streaming", "blocking")
+}
+
 
 
 @app.route("/api/health", methods=["GET"])
@@ -48,25 +182,21 @@ def init_session():
     try:
         data = request.get_json()
         session_id = data.get("session_id")
-        print(f"Initializing session: {session_id}")
-        
+
         if not session_id:
             return jsonify({"status": "error", "message": "Session ID is required"}), 400
-        
+
         # Initialize session with empty user data
-        user_sessions[session_id] = {"user_data": {}}
-        
-        print(f"Session initialized: {session_id}")
-        print(f"Total sessions now: {len(user_sessions)}")
-        print(f"Session keys: {list(user_sessions.keys())}")
-        
+        user_sessions.create(session_id)
+        logger.info("Session initialized: %s", session_id)
+
         return jsonify({
             "status": "success",
             "message": "Session initialized successfully",
             "session_id": session_id
         })
     except Exception as e:
-        print(f"Error initializing session: {e}")
+        logger.exception("Error initializing session")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
@@ -75,11 +205,9 @@ def store_user_info():
     """Store user information from the frontend"""
     try:
         data = request.get_json()
-        print(f"Received user info data: {data}")
-        
+
         # Check for session ID in headers first, then in data
         session_id = request.headers.get("X-Session-Id") or data.get("session_id")
-        print(f"Session ID from request: {session_id}")
 
         # Extract and format user data
         user_data = {
@@ -98,29 +226,22 @@ def store_user_info():
         }
 
         # If session_id exists and is valid, update it; otherwise create new one
-        if session_id and session_id in user_sessions:
-            user_sessions[session_id]["user_data"] = user_data
-            print(f"Updated existing session: {session_id}")
+        if session_id and user_sessions.update(session_id, user_data=user_data):
+            logger.info("Updated user info for session %s", session_id)
         else:
             # Generate a new session ID if none provided or invalid
-            session_id = f"session_{len(user_sessions) + 1}"
-            user_sessions[session_id] = {"user_data": user_data}
-            print(f"Created new session: {session_id}")
-
-        print(f"User data stored for session {session_id}: {user_data}")
-        print(f"Total sessions after storing user info: {len(user_sessions)}")
-        print(f"Session keys: {list(user_sessions.keys())}")
-
-        # Improved terminal log to reflect all user info fields clearly
-        print("User location:", user_data["user_location"])
-        print("User profile details:")
-        print("Age:", user_data["age"])
-        print("Gender:", user_data["gender"])
-        print("Budget range:", user_data["budget_range"])
-        print(
-            "Favorite product categories:", ", ".join(user_data["favorite_categories"])
+            session_id = f"session_{uuid.uuid4().hex}"
+            user_sessions.create(session_id, user_data)
+            logger.info("Created session %s for user info", session_id)
+
+        # Warm domain, categories and search cache while the user fills in the request
+        precompute.start_precompute(
+            session_id,
+            user_data,
+            is_busy=lambda: len(active_requests) >= worker_pool._max_workers,
         )
-        print("Interests or hobbies:", user_data["interests"])
+
+        logger.debug("User data stored for session %s: %s", session_id, user_data)
 
         return jsonify(
             {
@@ -130,7 +251,7 @@ def store_user_info():
             }
         )
     except Exception as e:
-        print(f"Error storing user info: {e}")
+        logger.exception("Error storing user info")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
@@ -194,78 +315,400 @@ def parse_ai_recommendations(sorted_products_text):
     return ai_recommendations
 
 
+def choose_ranking_mode(requested_mode=None):
+    """Resolve the ranking mode for a request to either "gemini" or "local" """
+    mode = requested_mode if requested_mode in RANKING_MODES else RANKING_MODE
+    if mode == "auto":
+        latency = recent_ranking_latency(max_age=RANKING_LATENCY_MAX_AGE)
+        if latency is not None and latency > GEMINI_SLOW_RANKING_SECONDS:
+            logger.info("Gemini ranking is slow (%.1fs), using local ranking", latency)
+            return "local"
+        return "gemini" if GEMINI_API_KEY else "local"
+    return mode
+
+
+def format_scraped_product(product, index, currency_symbol, category, reasoning):
+    """Format a scraped product for the frontend"""
+    rating = 0
+    try:
+        rating_str = str(product.get("average_rating", "0"))
+        rating_clean = "".join(
+            c for c in rating_str if c.isdigit() or c == "."
+        )
+        if rating_clean:
+            rating = min(max(float(rating_clean), 0), 5)
+    except:
+        pass
+
+    return {
+        "id": str(index + 1),
+        "name": product["title"],
+        "price": product.get("price_value", 0) or 0,
+        "currency": currency_symbol,
+        "image": product.get("image_url", "/placeholder.svg"),
+        "buyUrl": product.get("url", ""),
+        "category": category,
+        "rating": rating,
+        "reasoning": reasoning,
+    }
+
+
+def release_session(session_id):
+    """Stop and forget every piece of background work tied to a session"""
+    gemini_scheduler.forget_session(session_id)
+    precompute.cancel_precompute(session_id)
+    job_store.forget_session(session_id)
+
+
+# Expired and evicted sessions free their work the same way as /api/cleanup-session
+user_sessions.on_evict(release_session)
+
+
+def release_active_request(job):
+    """Mark the session idle again, unless a newer job took its place"""
+    with processing_lock:
+        if active_requests.get(job.session_id) == job.id:
+            del active_requests[job.session_id]
+
+
+def run_recommendation_job(job, deadline, cache_key=None):
+    """Worker pool entry point: run the pipeline for a job and store its outcome.
+
+    The admission controller has already marked the job started.
+    """
+    with bind_request_id(job.request_id or job.id):
+        try:
+            with use_trace(job.trace), profiled():
+                result = process_recommendation_request(job.request_data, deadline, job=job)
+            if isinstance(result, tuple):
+                job.finish(result[0], result[1])
+            else:
+                if cache_key is not None:
+                    response_cache.store_response(cache_key, result)
+                job.finish(result)
+        except Cancelled as e:
+            logger.info("Request %s for session %s cancelled: %s", job.id, job.session_id, e)
+            job.finish({"status": "cancelled", "message": "Request cancelled"}, 409, status="cancelled")
+        except Exception:
+            logger.exception("Error in concurrent processing")
+            job.finish({"status": "error", "message": "Request processing failed"}, 500)
+        finally:
+            release_active_request(job)
+            REQUEST_SECONDS.observe(time.time() - job.created_at, status=job.status)
+            if job.trace is not None and job.trace.profile:
+                try:
+                    job.trace.save_profile()
+                except OSError as e:
+                    logger.warning("Could not save the profile of request %s: %s", job.id, e)
+
+
+def classify_request(shopping_input, user_data):
+    """Intent of the shopping request, used to pick categories without Gemini"""
+    return intent_classifier.classify(
+        shopping_input.get("shoppingInput", "").lower(),
+        favorite_categories=user_data.get("favorite_categories", []),
+        interests=user_data.get("interests", ""),
+        brands=shopping_input.get("brandsPreferred", ""),
+        limit=MAX_CATEGORIES,
+    )
+
+
+def local_categories(intent):
+    """Categories to search without asking Gemini, empty when the classifier isn't confident enough"""
+    if not LOCAL_CATEGORIES or intent.confidence < LOCAL_CATEGORY_CONFIDENCE:
+        return []
+    return [c for c in map(clean_category_name, intent.categories) if c]
+
+
+def request_amazon_domain(session_id, user_data):
+    """Amazon domain of the session, resolved in the background after /api/user-info when possible"""
+    return (
+        precompute.get_precomputed(session_id).get("amazon_domain")
+        or get_amazon_domain(user_data.get("user_location", ""))
+    )
+
+
+def request_priority(data):
+    """Admission priority class of a recommendation request"""
+    requested = data.get("priority")
+    # Clients may lower their priority, only the server decides what is fast
+    if requested in PRIORITY_CLASSES and requested != "fast":
+        return requested
+
+    # Fast only when every category the request will search is already in the
+    # search cache; a warm session asking for something else is a full request
+    session_id = data.get("session_id")
+    user_data = (user_sessions.get(session_id) or {}).get("user_data") or {}
+    categories = local_categories(classify_request(data.get("shopping_input") or {}, user_data))
+    if categories:
+        amazon_domain = request_amazon_domain(session_id, user_data)
+        budget_range = user_data.get("budget_range")
+        if all(
+            search_cache_key(category, amazon_domain, RESULTS_PER_CATEGORY, budget_range) in search_cache
+            for category in categories
+        ):
+            return "fast"
+    return "interactive"
+
+
+def admission_rejected_body(rejection):
+    return {
+        "status": "error",
+        "message": "Server is busy, please retry shortly",
+        "reason": rejection.reason,
+        "retry_after": rejection.retry_after,
+        "estimated_wait_seconds": round(rejection.estimated_wait, 1),
+    }
+
+
+def admission_rejected_response(rejection):
+    response = jsonify(admission_rejected_body(rejection))
+    response.headers["Retry-After"] = str(rejection.retry_after)
+    return response, 429
+
+
+def render_result(result, *sources):
+    """A recommendation response in the format the request asked for, v1 by default"""
+    if wants_v2(*sources):
+        return to_v2(result, requested_fields(*sources))
+    return result
+
+
+def wants_profile(*sources):
+    """True when a request asks for a cProfile with ?profile=1 or "profile": true"""
+    return any(source and str(source.get("profile", "")).lower() in ("1", "true", "yes") for source in sources)
+
+
+def server_timing_headers(job):
+    """Server-Timing header summarizing the spans of a job run by this process"""
+    if job.trace is None:
+        return {}
+    return {"Server-Timing": job.trace.server_timing()}
+
+
+def format_sse(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def job_wait_seconds(value):
+    """Long-poll time requested with ?wait=, capped at the request timeout"""
+    try:
+        return min(max(float(value or 0), 0.0), REQUEST_TIMEOUT_SECONDS)
+    except ValueError:
+        return 0.0
+
+
+def submit_recommendation_job(data, profile=False):
+    """Queue a recommendation job for the session in data.
+
+    Returns (job, already_running); when the session already has a job in
+    progress that job is returned instead of starting a new one. Raises
+    AdmissionRejected when the job couldn't start in time to meet its deadline.
+    profile captures a cProfile of the job when PROFILING_ENABLED is on.
+    """
+    session_id = data.get("session_id")
+
+    # Identical profile and form seen recently: answer without queueing any work
+    session = user_sessions.get(session_id) or {}
+    cache_key = response_cache.response_cache_key(
+        session.get("user_data"), data.get("shopping_input"), data.get("ranking_mode")
+    )
+    cached = response_cache.get_cached_response(cache_key)
+    if cached is not None:
+        job = job_store.create(session_id, data)
+        user_sessions.update(session_id, results=cached)
+        job.finish(cached)
+        return job, False
+
+    with processing_lock:
+        running = job_store.get(active_requests.get(session_id) or "") or job_store.running_elsewhere(session_id)
+        if running is not None and not running.finished:
+            return running, True
+
+        job = job_store.create(session_id, data)
+        job.trace = Trace(job.id, profile=profile)
+        # Logs of the pipeline carry the id of the request that started it
+        job.request_id = current_request_id() or job.id
+        # Mark request as active
+        active_requests[session_id] = job.id
+
+    # Time spent queued for a worker counts against the request deadline
+    deadline = time.monotonic() + REQUEST_TIMEOUT_SECONDS
+    job.deadline = deadline
+    try:
+        admission.submit(
+            job,
+            lambda job: run_recommendation_job(job, deadline, cache_key),
+            priority=request_priority(data),
+            budget=REQUEST_TIMEOUT_SECONDS,
+        )
+    except AdmissionRejected as rejection:
+        logger.warning("Rejected request for session %s: %s", session_id, rejection)
+        release_active_request(job)
+        job_store.discard(job.id)
+        raise
+    except Exception:
+        logger.exception("Error submitting to worker pool")
+        job.finish({"status": "error", "message": "Failed to process request"}, 500)
+        release_active_request(job)
+    return job, False
+
+
 @app.route("/api/shopping-recommendations", methods=["POST"])
 def get_shopping_recommendations():
     """Get product recommendations based on user input and stored user data"""
     try:
         data = request.get_json()
         session_id = data.get("session_id")
-        print(f"Received session_id: {session_id}")
-        print(f"Available sessions: {list(user_sessions.keys())}")
-        print(f"Full request data: {data}")
 
         if not session_id or session_id not in user_sessions:
-            print(f"Session validation failed. session_id: {session_id}, exists: {session_id in user_sessions if session_id else False}")
+            logger.info("Session validation failed for session_id %s", session_id)
             return jsonify({"status": "error", "message": "Invalid session"}), 400
 
-        # Check if request is already being processed
-        with processing_lock:
-            if session_id in active_requests:
-                return jsonify({"status": "processing", "message": "Request already being processed"}), 202
-            
-            # Mark request as active
-            active_requests[session_id] = True
+        try:
+            job, already_running = submit_recommendation_job(data, profile=wants_profile(request.args, data))
+        except AdmissionRejected as rejection:
+            return admission_rejected_response(rejection)
+        if already_running:
+            return jsonify({"status": "processing", "message": "Request already being processed"}), 202
+
+        # Wait for result with timeout
+        if not job.wait(REQUEST_TIMEOUT_SECONDS):
+            # Nobody will read the result, give back its worker, scrapes and Gemini quota
+            job.cancel("timeout")
+            release_active_request(job)
+            logger.warning("Request %s for session %s timed out", job.id, session_id)
+            return jsonify({"status": "error", "message": "Request processing failed"}), 500
+
+        return jsonify(render_result(job.result, request.args, data)), job.http_status, server_timing_headers(job)
+
+    except Exception as e:
+        logger.exception("Error serving recommendations")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route("/api/shopping-recommendations/jobs", methods=["POST"])
+def create_recommendation_job():
+    """Start a recommendation job and return its id without waiting for the result"""
+    try:
+        data = request.get_json()
+        session_id = data.get("session_id")
+
+        if not session_id or session_id not in user_sessions:
+            return jsonify({"status": "error", "message": "Invalid session"}), 400
 
         try:
-            # Submit request to worker pool for concurrent processing
-            future = worker_pool.submit(process_recommendation_request, data)
-            
-            # Wait for result with timeout
-            try:
-                result = future.result(timeout=120)  # 2 minute timeout
-                
-                # Remove from active requests
-                with processing_lock:
-                    if session_id in active_requests:
-                        del active_requests[session_id]
-                
-                # Return result
-                if isinstance(result, tuple):
-                    return jsonify(result[0]), result[1]
-                else:
-                    return jsonify(result)
-                    
-            except Exception as e:
-                # Remove from active requests on error
-                with processing_lock:
-                    if session_id in active_requests:
-                        del active_requests[session_id]
-                
-                print(f"Error in concurrent processing: {e}")
-                return jsonify({"status": "error", "message": "Request processing failed"}), 500
-                
-        except Exception as e:
-            # Remove from active requests on error
-            with processing_lock:
-                if session_id in active_requests:
-                    del active_requests[session_id]
-            
-            print(f"Error submitting to worker pool: {e}")
-            return jsonify({"status": "error", "message": "Failed to process request"}), 500
+            job, already_running = submit_recommendation_job(data, profile=wants_profile(request.args, data))
+        except AdmissionRejected as rejection:
+            return admission_rejected_response(rejection)
+        status_url = f"/api/shopping-recommendations/jobs/{job.id}"
+        response = jsonify({
+            "status": "processing" if already_running else "accepted",
+            "message": "Request already being processed" if already_running else "Request accepted",
+            "job_id": job.id,
+            "status_url": status_url,
+            "job": job.to_dict(),
+        })
+        response.headers["Location"] = status_url
+        return response, 202
 
     except Exception as e:
-        print(f"Main error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route("/api/shopping-recommendations/jobs/<job_id>", methods=["GET"])
+def get_recommendation_job(job_id):
+    """Status of a recommendation job, with the result once it has finished.
+
+    ?wait=<seconds> holds the request until the job finishes or the time is up.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    wait = job_wait_seconds(request.args.get("wait"))
+    if wait:
+        job.wait(wait)
+    if not job.finished:
+        return jsonify({"status": "processing", "job": job.to_dict()}), 202
+    data = job.to_dict(include_result=True)
+    data["result"] = render_result(data.get("result"), request.args)
+    return jsonify({"status": job.status, "job": data}), 200, server_timing_headers(job)
+
+
+@app.route("/api/shopping-recommendations/jobs/<job_id>/trace", methods=["GET"])
+def get_recommendation_trace(job_id):
+    """Spans of a job run by this worker process, with parent ids and timings in ms"""
+    job = job_store.get(job_id)
+    if job is None or job.trace is None:
+        return jsonify({"status": "error", "message": "Trace not found"}), 404
+    return jsonify({"status": "success", "job_status": job.status, "trace": job.trace.to_dict()})
+
+
+@app.route("/api/shopping-recommendations/jobs/<job_id>/profile", methods=["GET"])
+def download_recommendation_profile(job_id):
+    """cProfile of a job submitted with ?profile=1, as a pstats file or ?format=text"""
+    if not PROFILING_ENABLED:
+        return jsonify({"status": "error", "message": "Profiling is disabled"}), 404
+    # Job ids are hex uuids, anything else could name a file outside PROFILE_DIR
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return jsonify({"status": "error", "message": "Profile not found"}), 404
+    path = profile_path(job_id)
+    if not os.path.exists(path):
+        return jsonify({"status": "error", "message": "Profile not found"}), 404
+    if request.args.get("format") == "text":
+        output = io.StringIO()
+        try:
+            stats = pstats.Stats(path, stream=output)
+            stats.sort_stats(request.args.get("sort", "cumulative")).print_stats(int(request.args.get("limit", 50)))
+        except (KeyError, ValueError) as e:
+            return jsonify({"status": "error", "message": f"Invalid sort or limit: {e}"}), 400
+        return Response(output.getvalue(), mimetype="text/plain")
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{job_id}.prof")
+
+
+@app.route("/api/shopping-recommendations/jobs/<job_id>/events", methods=["GET"])
+def stream_recommendation_job(job_id):
+    """Server-sent events for a job: categories, products per category, then the result.
+
+    Events are replayed from the start, or after Last-Event-ID when a client reconnects.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+
+    try:
+        last_id = int(request.headers.get("Last-Event-ID", -1))
+    except ValueError:
+        last_id = -1
+
+    def generate():
+        nonlocal last_id
+        while True:
+            events = job.events_since(last_id, timeout=SSE_KEEPALIVE_SECONDS)
+            for event_id, event, data in events:
+                yield format_sse(event_id, event, data)
+                last_id = event_id
+            if job.finished and last_id >= job.last_event_id:
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/api/export-data/<session_id>", methods=["GET"])
 def export_user_data(session_id):
     """Export user data for download"""
     try:
-        if session_id not in user_sessions:
+        session = user_sessions.get(session_id)
+        if session is None:
             return jsonify({"status": "error", "message": "Invalid session"}), 400
 
-        user_data = user_sessions[session_id]["user_data"]
+        user_data = session["user_data"]
         return jsonify({"status": "success", "data": user_data})
 
     except Exception as e:
@@ -279,9 +722,9 @@ def cleanup_session():
         data = request.get_json()
         session_id = data.get("session_id")
         
-        if session_id and session_id in user_sessions:
-            del user_sessions[session_id]
-            print(f"Session cleaned up: {session_id}")
+        if session_id and user_sessions.delete(session_id):
+            release_session(session_id)
+            logger.info("Session cleaned up: %s", session_id)
             return jsonify({
                 "status": "success",
                 "message": "Session cleaned up successfully"
@@ -300,19 +743,29 @@ def cleanup_session():
 def get_request_status(session_id):
     """Check the status of a recommendation request"""
     try:
+        has_results = "results" in (user_sessions.get(session_id) or {})
+        remote_job = job_store.running_elsewhere(session_id)
         with processing_lock:
-            is_processing = session_id in active_requests
-            has_results = session_id in user_sessions and "results" in user_sessions[session_id]
+            is_processing = session_id in active_requests or remote_job is not None
+            job = job_store.latest_for_session(session_id)
             
             if is_processing:
                 return jsonify({
                     "status": "processing",
-                    "message": "Request is being processed"
+                    "message": "Request is being processed",
+                    "job": job.to_dict() if job else None,
                 })
             elif has_results:
                 return jsonify({
                     "status": "completed",
-                    "message": "Request completed successfully"
+                    "message": "Request completed successfully",
+                    "job": job.to_dict() if job else None,
+                })
+            elif job is not None and job.status == "failed":
+                return jsonify({
+                    "status": "failed",
+                    "message": job.result.get("message", "Request failed"),
+                    "job": job.to_dict(),
                 })
             else:
                 return jsonify({
@@ -329,33 +782,99 @@ def cancel_request(session_id):
     """Cancel an active recommendation request"""
     try:
         with processing_lock:
-            if session_id in active_requests:
-                del active_requests[session_id]
-                return jsonify({
-                    "status": "success",
-                    "message": "Request cancelled successfully"
-                })
-            else:
-                return jsonify({
-                    "status": "error",
-                    "message": "No active request to cancel"
-                }), 404
-                
+            job_id = active_requests.pop(session_id, None)
+        # Without a local request, it may be running in another worker process
+        job = job_store.get(job_id) if job_id is not None else job_store.running_elsewhere(session_id)
+        if job_id is not None or job is not None:
+            if job is not None:
+                job.cancel("cancelled by user")
+            return jsonify({
+                "status": "success",
+                "message": "Request cancelled successfully"
+            })
+        return jsonify({
+            "status": "error",
+            "message": "No active request to cancel"
+        }), 404
+
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+def collect_runtime_metrics():
+    """Queue depths and cache counters read from their owners at scrape time"""
+    admission_stats = admission.get_stats()
+    scrape_stats = scrape_scheduler.get_stats()
+    gemini_stats = gemini_scheduler.get_stats()
+    queue_depth = [
+        ({"queue": "admission"}, admission_stats["queue_depth"]),
+        ({"queue": "scrape"}, scrape_stats["queue_depth"]),
+        ({"queue": "gemini"}, gemini_stats["queue_depth"]),
+    ]
+    running = [
+        ({"queue": "admission"}, admission_stats["running"]),
+        ({"queue": "scrape"}, scrape_stats["running"]),
+    ]
+    scrape_caches = get_scrape_cache_stats()
+    prefix_cache = get_prefix_cache_stats()
+    caches = {
+        "search": scrape_caches["search"],
+        "product": scrape_caches["product"],
+        "response": response_cache.get_stats(),
+        "gemini_prefix": {
+            "hits": prefix_cache["hits"],
+            "misses": prefix_cache["lookups"] - prefix_cache["hits"],
+            "hit_ratio": prefix_cache["hit_ratio"],
+        },
+    }
+    return [
+        ("executor_queue_depth", "gauge", "Work items waiting for a worker", queue_depth),
+        ("executor_running", "gauge", "Work items being run", running),
+        ("active_sessions", "gauge", "Sessions in the session store", [({}, len(user_sessions))]),
+        ("cache_hits_total", "counter", "Cache hits",
+         [({"cache": name}, stats["hits"]) for name, stats in caches.items()]),
+        ("cache_misses_total", "counter", "Cache misses",
+         [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("cache_hit_ratio", "gauge", "Cache hits over lookups since start",
+         [({"cache": name}, stats["hit_ratio"]) for name, stats in caches.items()]),
+    ]
+
+
+metrics_registry.add_collector(collect_runtime_metrics)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Prometheus text exposition of stage latencies, outbound statuses, queues and caches"""
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/api/worker-stats", methods=["GET"])
 def get_worker_stats():
     """Get statistics about the worker pool and active requests"""
     try:
+        session_stats = user_sessions.get_stats()
         with processing_lock:
             stats = {
                 "active_requests": len(active_requests),
                 "active_request_sessions": list(active_requests.keys()),
                 "worker_pool_size": worker_pool._max_workers,
-                "total_sessions": len(user_sessions),
-                "sessions_with_results": len([s for s in user_sessions.values() if "results" in s])
+                "total_sessions": session_stats["sessions"],
+                "sessions_with_results": session_stats["sessions_with_results"],
+                "sessions": session_stats,
+                "ranking_shortlist": get_shortlist_stats(),
+                "category_generation": get_category_timing_stats(),
+                "gemini_scheduler": gemini_scheduler.get_stats(),
+                "gemini_prefix_cache": get_prefix_cache_stats(),
+                "jobs": job_store.get_stats(),
+                "cancellation": get_cancellation_stats(),
+                "scrape_scheduler": scrape_scheduler.get_stats(),
+                "admission": admission.get_stats(),
+                "scrape_cache": get_scrape_cache_stats(),
+                "response_cache": response_cache.get_stats(),
+                "payload": get_payload_stats(),
+                "logging": get_logging_stats(),
+                "precompute": precompute.get_stats(),
             }
             return jsonify({"status": "success", "stats": stats})
                 
@@ -363,19 +882,136 @@ def get_worker_stats():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-def process_recommendation_request(request_data):
-    """Process a single recommendation request concurrently"""
+def detect_primary_category(shopping_request):
+    """Return the CATEGORY_KEYWORDS key that best matches the shopping request, or None"""
+    return intent_classifier.primary_group(shopping_request)
+
+
+def record_time_to_first_scrape(mode, seconds):
+    """Record how long a request waited for categories before its first scrape started"""
+    with category_timing_lock:
+        stats = category_timing_stats[mode]
+        stats["requests"] += 1
+        stats["total_time_to_first_scrape"] += seconds
+        stats["last_time_to_first_scrape"] = round(seconds, 3)
+    logger.info("Time to first scrape (%s): %.2fs", mode, seconds)
+
+
+def get_category_timing_stats():
+    """Average and last time-to-first-scrape for streaming and blocking category generation"""
+    with category_timing_lock:
+        return {
+            mode: {
+                "requests": stats["requests"],
+                "avg_time_to_first_scrape": (
+                    round(stats["total_time_to_first_scrape"] / stats["requests"], 3)
+                    if stats["requests"]
+                    else None
+                ),
+                "last_time_to_first_scrape": stats["last_time_to_first_scrape"],
+            }
+            for mode, stats in category_timing_stats.items()
+        }
+
+
+def stream_and_dispatch_categories(
+    user_input,
+    user_data,
+    primary_keywords,
+    dispatch,
+    started,
+    session_id=None,
+    deadline=None,
+    cancel_token=None,
+):
+    """Dispatch categories for scraping while Gemini is still streaming them.
+
+    Categories matching the primary keywords (or every category when there is
+    no primary category) are dispatched as soon as they arrive. The others
+    wait for the end of the stream and fill the remaining slots in order,
+    which selects the same categories as the blocking path.
+    Returns the dispatched categories.
+    """
+    dispatched = []
+    deferred = []
+
+    def dispatch_category(category):
+        if not dispatched:
+            record_time_to_first_scrape("streaming", time.perf_counter() - started)
+        dispatch(category)
+        dispatched.append(category)
+
+    try:
+        for raw_category in stream_and_get_categories(
+            GEMINI_API_KEY,
+            user_input,
+            user_data["user_location"],
+            user_data,
+            session_id=session_id,
+            deadline=deadline,
+            cancel_token=cancel_token,
+        ):
+            category = clean_category_name(raw_category)
+            if not category or category in dispatched or category in deferred:
+                continue
+            if primary_keywords and not any(k in category.lower() for k in primary_keywords):
+                deferred.append(category)
+                continue
+            dispatch_category(category)
+            if len(dispatched) >= MAX_CATEGORIES:
+                break
+    except Cancelled:
+        raise
+    except Exception as e:
+        logger.warning("Error streaming categories from Gemini: %s", e)
+
+    for category in deferred:
+        if len(dispatched) >= MAX_CATEGORIES:
+            break
+        dispatch_category(category)
+
+    return dispatched
+
+
+def process_recommendation_request(request_data, deadline=None, job=None):
+    """Process a single recommendation request concurrently.
+
+    deadline is the monotonic time the request must finish by. Gemini calls
+    use it to prioritise requests that are running out of time and every
+    fetch, retry and quota wait is fitted into what is left of it. Scraping
+    stops DEADLINE_RANKING_RESERVE_SECONDS before it; categories still
+    pending are abandoned and the products found so far are ranked locally
+    and returned with "partial": true. Progress through the pipeline stages
+    is reported on job when given.
+    """
     session_id = request_data.get("session_id")
     shopping_input = request_data.get("shopping_input", {})
+
+    def report(stage, **progress):
+        if job is not None:
+            job.update(stage, **progress)
+
+    def publish(event, data):
+        if job is not None:
+            job.publish(event, data)
+
+    # Cancelling the job stops scraping, retries and Gemini calls at the next check
+    cancel_token = job.cancel_token if job is not None else None
+    # Stops the remaining scrapes without cancelling the request, e.g. at the deadline
+    scrape_token = cancel_token.child() if cancel_token is not None else CancellationToken()
+    scrape_deadline = deadline - DEADLINE_RANKING_RESERVE_SECONDS if deadline is not None else None
+    partial = False
+    pending_categories = []
     
     try:
-        print(f"Processing recommendation request for session: {session_id}")
+        logger.info("Processing recommendation request for session %s", session_id)
         
-        if session_id not in user_sessions:
+        session = user_sessions.get(session_id)
+        if session is None:
             return {"status": "error", "message": "Invalid session"}, 400
 
         # Get user data from session
-        user_data = user_sessions[session_id].get("user_data", {})
+        user_data = session.get("user_data", {})
         
         if not user_data or not user_data.get("favorite_categories"):
             return {"status": "error", "message": "No user data found. Please complete your profile first."}, 400
@@ -389,152 +1025,240 @@ def process_recommendation_request(request_data):
         Interests or Hobbies: {user_data.get('interests', '')}
         """
 
-        # Get categories from Gemini
-        categories = build_and_get_categories(
-            GEMINI_API_KEY, user_input, user_data["user_location"], user_data
-        )
-        
-        if not categories:
-            return {"status": "error", "message": "Failed to get categories from Gemini API"}, 500
-
         # Filter and prioritize categories based on user request
         shopping_request = shopping_input.get('shoppingInput', '').lower()
-        filtered_categories = []
-        
-        # Define keyword mappings for different types of requests
-        category_keywords = {
-            'music': ['music', 'song', 'album', 'artist', 'band', 'vinyl', 'cd', 'spotify', 'apple music', 'headphones', 'speaker', 'audio'],
-            'gaming': ['game', 'gaming', 'console', 'controller', 'headset', 'pc gaming', 'playstation', 'xbox', 'nintendo'],
-            'sports': ['sport', 'basketball', 'football', 'cricket', 'fitness', 'exercise', 'workout', 'training', 'athletic'],
-            'tech': ['tech', 'technology', 'computer', 'laptop', 'phone', 'tablet', 'accessory', 'gadget', 'electronic'],
-            'fashion': ['clothes', 'fashion', 'clothing', 'shirt', 'dress', 'shoes', 'sneakers', 'outfit', 'style'],
-            'books': ['book', 'reading', 'novel', 'textbook', 'kindle', 'ebook', 'literature', 'author'],
-            'home': ['home', 'kitchen', 'furniture', 'decor', 'appliance', 'garden', 'outdoor', 'household'],
-            'automotive': ['car', 'automotive', 'vehicle', 'accessory', 'maintenance', 'parts', 'tools'],
-            'beauty': ['beauty', 'makeup', 'skincare', 'cosmetic', 'perfume', 'lotion', 'cream'],
-            'food': ['food', 'cooking', 'recipe', 'ingredient', 'snack', 'beverage', 'drink'],
-            'pet': ['pet', 'dog', 'cat', 'animal', 'pet food', 'toy', 'accessory'],
-            'baby': ['baby', 'infant', 'toddler', 'diaper', 'toy', 'clothing'],
-            'office': ['office', 'work', 'desk', 'stationery', 'paper', 'pen', 'notebook'],
-            'travel': ['travel', 'luggage', 'backpack', 'suitcase', 'trip', 'vacation'],
-            'art': ['art', 'craft', 'painting', 'drawing', 'creative', 'diy', 'hobby']
-        }
-        
-        # Determine the primary category based on user request
-        primary_category = None
-        category_scores = {}
-        
-        # Score each category based on keyword matches
-        for category, keywords in category_keywords.items():
-            score = 0
-            for keyword in keywords:
-                if keyword in shopping_request:
-                    score += 1
-            if score > 0:
-                category_scores[category] = score
-        
-        # Get the category with the highest score
-        if category_scores:
-            primary_category = max(category_scores, key=category_scores.get)
-        else:
-            # Try to extract keywords from the request for better matching
-            request_words = shopping_request.split()
-            
-            # Check if any of the user's favorite categories match the request
-            user_categories = user_data.get('favorite_categories', [])
-            for user_cat in user_categories:
-                if user_cat.lower() in shopping_request:
-                    break
-        
-        # If we found a primary category, prioritize those categories
-        if primary_category:
-            primary_keywords = category_keywords[primary_category]
-            primary_categories = [cat for cat in categories if any(keyword in cat.lower() for keyword in primary_keywords)]
-            other_categories = [cat for cat in categories if not any(keyword in cat.lower() for keyword in primary_keywords)]
-            filtered_categories = primary_categories + other_categories
-        else:
-            # If no specific category detected, use original order
-            filtered_categories = categories
+        primary_category = detect_primary_category(shopping_request)
+        primary_keywords = CATEGORY_KEYWORDS[primary_category] if primary_category else []
+        stream_categories = request_data.get("stream_categories", STREAM_CATEGORIES)
 
-        # Limit categories to top 5 for faster processing
-        filtered_categories = filtered_categories[:5]
-        
-        # Clean category names for better scraping
-        cleaned_categories = []
-        for category in filtered_categories:
-            # Remove bullet points and clean the category name
-            clean_cat = category.replace("*", "").replace("  ", " ").strip()
-            # Remove brand examples in parentheses
-            clean_cat = re.sub(r'\s*\([^)]*\)', '', clean_cat)
-            # Remove "e.g." and similar text
-            clean_cat = re.sub(r'\s*e\.g\.,?\s*', '', clean_cat)
-            clean_cat = clean_cat.strip()
-            if clean_cat and len(clean_cat) > 2:
-                cleaned_categories.append(clean_cat)
-        
-        categories = cleaned_categories
+        amazon_domain = request_amazon_domain(session_id, user_data)
 
-        # Get Amazon domain
-        amazon_domain = get_amazon_domain(user_data["user_location"])
+        # Needed to format products as soon as each category is scraped
+        currency_symbol = get_currency_symbol(user_data.get("user_location", ""))
 
         # Dictionary to store category -> products
         category_products = {}
-
-        def fetch_category_products(category):
-            urls = amazon_category_top_products(
+        report("categories")
+
+        budget_range = user_data.get("budget_range")
+
+        def within_budget(product):
+            # Filter products by budget range if price_value is available
+            if budget_range and product.get("price_value") is not None:
+                try:
+                    low, high = (
+                        budget_range.replace("€", "")
+                        .replace("$", "")
+                        .replace("£", "")
+                        .split("-")
+                    )
+                    low = float(low.strip())
+                    high = float(high.strip())
+                    return low <= product["price_value"] <= high
+                except:
+                    # If budget parsing fails, include product anyway
+                    return True
+            # If no price or budget, include product
+            return True
+
+        # Resolved by the scrape workers once QUORUM_PRODUCTS usable products are in
+        quorum_reached = Future()
+        quorum_lock = threading.Lock()
+        usable_products = [0]
+
+        def count_product(category, product):
+            if not (product.get("title") and product.get("url")) or not within_budget(product):
+                return
+            with quorum_lock:
+                usable_products[0] += 1
+                reached = usable_products[0] == QUORUM_PRODUCTS
+            if reached:
+                quorum_reached.set_result(category)
+
+        # Categories are searched and scraped on the shared scrape scheduler,
+        # round-robin with every other session's work
+        category_futures = {}  # Future -> category
+
+        def dispatch(category):
+            future = scrape_category(
+                scrape_scheduler,
                 category,
                 amazon_domain,
-                num_results=1,  # Reduced from 2 to 1 for more conservative approach
-                budget_range=user_data.get("budget_range"),
+                num_results=RESULTS_PER_CATEGORY,
+                budget_range=budget_range,
+                session_id=session_id,
+                cancel_token=scrape_token,
+                deadline=scrape_deadline,
+                on_product=count_product if QUORUM_PRODUCTS > 0 else None,
             )
-            products = []
-            if not urls:
-                return category, products
-
-            # Increased max_workers for faster concurrent scraping
-            with ThreadPoolExecutor(max_workers=5) as executor:  # Reduced from 10 to 5
-                futures = {
-                    executor.submit(scrape_amazon_product, url): url for url in urls
-                }
-                for future in as_completed(futures):
-                    url = futures[future]
-                    try:
-                        product = future.result()
-                        if product:
-                            # Filter products by budget range if price_value is available
-                            budget_range = user_data.get("budget_range")
-                            if budget_range and product.get("price_value") is not None:
-                                try:
-                                    low, high = (
-                                        budget_range.replace("€", "")
-                                        .replace("$", "")
-                                        .replace("£", "")
-                                        .split("-")
-                                    )
-                                    low = float(low.strip())
-                                    high = float(high.strip())
-                                    if low <= product["price_value"] <= high:
-                                        products.append(product)
-                                except:
-                                    # If budget parsing fails, include product anyway
-                                    products.append(product)
-                            else:
-                                # If no price or budget, include product
-                                products.append(product)
-                    except Exception as e:
-                        print(f"Exception occurred while scraping URL {url}: {e}")
-
-            return category, products
-
-        # Scrape products for each category with increased concurrency
-        with ThreadPoolExecutor(max_workers=3) as category_executor:  # Reduced from 7 to 3
-            category_futures = [
-                category_executor.submit(fetch_category_products, category)
-                for category in categories
+            category_futures[future] = category
+            publish("category", {"category": category})
+            report(
+                "scraping",
+                categories_dispatched=len(category_futures),
+                categories_completed=len(category_products),
+            )
+
+        categories_started = time.perf_counter()
+        category_source = "gemini"
+
+        intent = classify_request(shopping_input, user_data)
+        categories = local_categories(intent)
+        if categories:
+            # Clear request, no need to ask Gemini for categories
+            logger.info("Using local categories (confidence %.2f): %s", intent.confidence, categories)
+            category_source = "local"
+            record_time_to_first_scrape("local", time.perf_counter() - categories_started)
+            for category in categories:
+                dispatch(category)
+
+        if not categories and stream_categories:
+            # Scraping starts while Gemini is still generating categories
+            with timed_stage("category_llm"):
+                categories = stream_and_dispatch_categories(
+                    user_input,
+                    user_data,
+                    primary_keywords,
+                    dispatch,
+                    categories_started,
+                    session_id=session_id,
+                    deadline=deadline,
+                    cancel_token=cancel_token,
+                )
+
+        if not categories:
+            # Get categories from Gemini
+            try:
+                with timed_stage("category_llm"):
+                    categories = build_and_get_categories(
+                        GEMINI_API_KEY,
+                        user_input,
+                        user_data["user_location"],
+                        user_data,
+                        session_id=session_id,
+                        deadline=deadline,
+                        cancel_token=cancel_token,
+                    )
+            except GeminiError as e:
+                # Cancelled is left to propagate, the request was stopped on purpose
+                logger.warning("Gemini category generation failed for session %s: %s", session_id, e)
+                categories = []
+
+            if not categories and intent.categories:
+                # Gemini failed or ran out of time, the classifier's guess beats no answer
+                categories = intent.categories
+                category_source = "local_fallback"
+
+            if not categories:
+                return {"status": "error", "message": "Failed to get categories from Gemini API"}, 500
+
+            # If we found a primary category, prioritize those categories
+            if primary_keywords:
+                primary_categories = [cat for cat in categories if any(keyword in cat.lower() for keyword in primary_keywords)]
+                other_categories = [cat for cat in categories if not any(keyword in cat.lower() for keyword in primary_keywords)]
+                filtered_categories = primary_categories + other_categories
+            else:
+                # If no specific category detected, use original order
+                filtered_categories = categories
+
+            # Limit categories to top 5 for faster processing, and clean names for better scraping
+            categories = [
+                clean_cat
+                for clean_cat in map(clean_category_name, filtered_categories[:MAX_CATEGORIES])
+                if clean_cat
             ]
-            for future in as_completed(category_futures):
-                category, products = future.result()
+            if categories:
+                record_time_to_first_scrape("blocking", time.perf_counter() - categories_started)
+            for category in categories:
+                dispatch(category)
+
+        publish("categories", {"categories": categories, "source": category_source})
+
+        def stop_scraping(reason):
+            # Cancel the scrapes still running, keep the products they found
+            # and return the categories that were cut short
+            scrape_token.cancel(reason)
+            cut_short = []
+            for future, category in category_futures.items():
+                if category in category_products:
+                    continue
+                if not future.done():
+                    cut_short.append(category)
+                products = [p for p in list(future.scraped_so_far) if within_budget(p)]
+                for product in products:
+                    product["category"] = category
                 category_products[category] = products
+            return cut_short
+
+        streamed_products = 0
+        finished_categories = 0
+        scrape_wait = time_left(scrape_deadline)
+        try:
+            # quorum_reached only wakes the loop, categories are counted to know when all are in
+            waiting = [*category_futures, quorum_reached] if category_futures else []
+            for future in as_completed(
+                waiting, timeout=max(scrape_wait, 0) if scrape_wait is not None else None
+            ):
+                if future is quorum_reached:
+                    skipped = stop_scraping("product quorum reached")
+                    logger.info(
+                        "%d products scraped for session %s, ranking without %d slower categories: %s",
+                        QUORUM_PRODUCTS,
+                        session_id,
+                        len(skipped),
+                        skipped,
+                    )
+                    break
+                raise_if_cancelled(cancel_token)
+                category, scraped = future.result()
+                products = []
+                for product in scraped:
+                    product["category"] = category
+                    if within_budget(product):
+                        products.append(product)
+                category_products[category] = products
+                # Unranked products of this category, the ranked list follows in the result event
+                publish("products", {
+                    "category": category,
+                    "products": [
+                        format_scraped_product(
+                            product,
+                            streamed_products + i,
+                            currency_symbol,
+                            category,
+                            "Found for your request, ranking in progress",
+                        )
+                        for i, product in enumerate(products)
+                        if product.get("title") and product.get("url")
+                    ],
+                })
+                streamed_products += len(products)
+                report(
+                    "scraping",
+                    categories_completed=len(category_products),
+                    products_found=sum(len(p) for p in category_products.values()),
+                )
+                finished_categories += 1
+                if finished_categories == len(category_futures):
+                    break
+        except FuturesTimeoutError:
+            # Out of scraping time, rank what came back and drop the rest
+            partial = True
+            pending_categories = stop_scraping("request deadline")
+            logger.warning(
+                "Scraping deadline reached for session %s, %d categories pending: %s",
+                session_id,
+                len(pending_categories),
+                pending_categories,
+            )
+
+        raise_if_cancelled(cancel_token)
+
+        def mark_partial(response):
+            # Partial responses are never cached, see response_cache.cacheable
+            if partial:
+                response["partial"] = True
+                response["pending_categories"] = pending_categories
 
         # Gather all products
         all_products = []
@@ -545,7 +1269,7 @@ def process_recommendation_request(request_data):
         valid_products = [p for p in all_products if p and p.get("title") and p.get("url")]
         
         if not valid_products:
-            print(f"No valid products found for session {session_id}, using fallback products")
+            logger.warning("No valid products found for session %s, using fallback products", session_id)
             # Fallback to sample products based on the detected category
             fallback_products = generate_fallback_products(shopping_request, user_data)
             if fallback_products:
@@ -567,126 +1291,109 @@ def process_recommendation_request(request_data):
                 response_data = {
                     "status": "success",
                     "categories": categories,
+                    "category_source": category_source,
                     "products": formatted_products,
                     "ai_recommendations": json.dumps([]),
                     "note": "Using sample products due to temporary scraping issues"
                 }
+                mark_partial(response_data)
                 
-                user_sessions[session_id]["results"] = response_data
+                user_sessions.update(session_id, results=response_data)
                 return response_data
             else:
                 return {"status": "error", "message": "Unable to fetch product recommendations at this time. Please try again later."}, 503
 
-        # Get currency symbol
-        currency_symbol = get_currency_symbol(user_data.get("user_location", ""))
-
-        # Now sort these products using the SortingAlgorithm
-        sorting_algo = SortingAlgorithm(
-            "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent",
-            GEMINI_API_KEY,
+        # Local ranking arguments, also used when the Gemini path fails
+        ranking_query = shopping_input.get("shoppingInput", "")
+        ranking_mode = choose_ranking_mode(
+            request_data.get("ranking_mode") or shopping_input.get("rankingMode")
         )
+        if partial:
+            # The ranking reserve is too short for a Gemini round trip
+            ranking_mode = "local"
+
+        products_by_url = {p["url"]: p for p in valid_products}
+        report("ranking", candidates=len(valid_products), mode=ranking_mode)
+
+        def rank_locally(limit=None):
+            with timed_stage("ranking_local"):
+                return local_ranker.rank(
+                    ranking_query,
+                    user_data,
+                    valid_products,
+                    priority_keywords=primary_keywords,
+                    category_order=categories,
+                    limit=limit,
+                )
 
         try:
-            # Get AI sorted recommendations
-            sorted_products_text = sorting_algo.get_sorted_products(
-                user_input, user_data, valid_products
-            )
+            if ranking_mode == "local":
+                ai_recommendations = rank_locally()
+            else:
+                # Sort these products using the SortingAlgorithm
+                sorting_algo = SortingAlgorithm(GEMINI_API_KEY)
+
+                # Get AI sorted recommendations
+                with timed_stage("ranking_llm"):
+                    sorted_products_text = sorting_algo.get_sorted_products(
+                        user_input,
+                        user_data,
+                        valid_products,
+                        session_id=session_id,
+                        deadline=deadline,
+                        cancel_token=cancel_token,
+                    )
 
-            # Parse AI recommendations
-            ai_recommendations = parse_ai_recommendations(sorted_products_text)
+                    # Parse AI recommendations
+                    ai_recommendations = parse_ai_recommendations(sorted_products_text)
 
             # Format products for frontend
+            format_started = time.perf_counter()
             formatted_products = []
 
-            # Create a mapping of scraped products by title for easy lookup
-            scraped_products_map = {}
-            for product in valid_products:
-                if product and product.get("title"):
-                    title_key = product["title"].strip().lower()
-                    scraped_products_map[title_key] = product
+            # Index scraped products once so every ranked result joins by ASIN, URL or title
+            join_index = ProductJoinIndex(valid_products)
+            joined = set()
 
             # Process AI recommendations and match with scraped data
             for i, ai_product in enumerate(ai_recommendations):
-                ai_title = ai_product.get("title", "").strip()
-                if not ai_title:
+                if not ai_product.get("title", "").strip() and not ai_product.get("url"):
                     continue
 
-                # Try to find matching scraped product
-                scraped_product = None
-                ai_title_key = ai_title.lower()
-
-                # Exact match first
-                if ai_title_key in scraped_products_map:
-                    scraped_product = scraped_products_map[ai_title_key]
-                else:
-                    # Partial match
-                    for scraped_title_key, product in scraped_products_map.items():
-                        if (
-                            ai_title_key in scraped_title_key
-                            or scraped_title_key in ai_title_key
-                        ):
-                            scraped_product = product
-                            break
-
-                # Only add products that have real scraped data
-                if scraped_product:
+                scraped_product = join_index.lookup(ai_product)
+
+                # Only add products that have real scraped data, each one once
+                if scraped_product and id(scraped_product) not in joined:
+                    joined.add(id(scraped_product))
                     # Use scraped data as primary source
-                    product_data = {
-                        "id": str(i + 1),
-                        "name": scraped_product["title"],
-                        "price": scraped_product.get("price_value", 0),
-                        "currency": currency_symbol,
-                        "image": scraped_product.get("image_url", "/placeholder.svg"),
-                        "buyUrl": scraped_product.get("url", ""),
-                        "category": "Recommended",
-                        "rating": 0,
-                        "reasoning": ai_product.get("reasoning", "AI recommended product"),
-                    }
-
-                    # Parse rating from scraped data
-                    if scraped_product.get("average_rating"):
-                        try:
-                            rating_str = str(scraped_product["average_rating"])
-                            rating_clean = "".join(
-                                c for c in rating_str if c.isdigit() or c == "."
-                            )
-                            if rating_clean:
-                                scraped_rating = float(rating_clean)
-                                product_data["rating"] = min(max(scraped_rating, 0), 5)
-                        except:
-                            pass
-
-                    formatted_products.append(product_data)
-
-            # If no AI recommendations matched with scraped data, use scraped products directly
-            if not formatted_products and valid_products:
-                # Limit to top 6 products for faster processing
-                for i, product in enumerate(valid_products[:6]):
-                    rating = 0
-                    try:
-                        rating_str = str(product.get("average_rating", "0"))
-                        rating_clean = "".join(
-                            c for c in rating_str if c.isdigit() or c == "."
+                    formatted_products.append(
+                        format_scraped_product(
+                            scraped_product,
+                            i,
+                            currency_symbol,
+                            "Recommended",
+                            ai_product.get("reasoning", "AI recommended product"),
                         )
-                        if rating_clean:
-                            rating = min(max(float(rating_clean), 0), 5)
-                    except:
-                        pass
+                    )
+
+            logger.debug("Joined ranked results to scraped products: %s", dict(join_index.stats))
 
+            # If no AI recommendations matched with scraped data, rank scraped products locally
+            if not formatted_products and valid_products:
+                ranking_mode = "local_fallback"
+                for i, ranked in enumerate(rank_locally(limit=DISPLAYED_PRODUCTS)):
                     formatted_products.append(
-                        {
-                            "id": str(i + 1),
-                            "name": product["title"],
-                            "price": product.get("price_value", 0) or 0,
-                            "currency": currency_symbol,
-                            "image": product.get("image_url", "/placeholder.svg"),
-                            "buyUrl": product.get("url", ""),
-                            "category": "General",
-                            "rating": rating,
-                            "reasoning": "Product recommendation based on your preferences",
-                        }
+                        format_scraped_product(
+                            products_by_url[ranked["url"]],
+                            i,
+                            currency_symbol,
+                            "General",
+                            ranked["reasoning"],
+                        )
                     )
 
+            STAGE_SECONDS.observe(time.perf_counter() - format_started, stage="format")
+
             # Only return response if we have real products
             if not formatted_products:
                 return {"status": "error", "message": "Unable to fetch product recommendations at this time. Please try again later."}, 503
@@ -695,61 +1402,55 @@ def process_recommendation_request(request_data):
             response_data = {
                 "status": "success",
                 "categories": categories,
+                "category_source": category_source,
                 "products": formatted_products,
                 "ai_recommendations": json.dumps(ai_recommendations),
+                "ranking": ranking_mode,
             }
+            mark_partial(response_data)
 
-            user_sessions[session_id]["results"] = response_data
+            user_sessions.update(session_id, results=response_data)
             return response_data
 
+        except Cancelled:
+            raise
         except Exception as e:
-            print(f"Error in AI processing: {e}")
+            logger.warning("Error in AI processing: %s", e)
 
             # Only use scraped products if they exist and are valid
             if valid_products:
                 fallback_products = []
-                # Limit to top 6 products for faster processing
-                for i, product in enumerate(valid_products[:6]):
-                    rating = 0
-                    try:
-                        rating_str = str(product.get("average_rating", "0"))
-                        rating_clean = "".join(
-                            c for c in rating_str if c.isdigit() or c == "."
-                        )
-                        if rating_clean:
-                            rating = min(max(float(rating_clean), 0), 5)
-                    except:
-                        pass
-
+                for i, ranked in enumerate(rank_locally(limit=DISPLAYED_PRODUCTS)):
                     fallback_products.append(
-                        {
-                            "id": str(i + 1),
-                            "name": product["title"],
-                            "price": product.get("price_value", 0) or 0,
-                            "currency": currency_symbol,
-                            "image": product.get("image_url", "/placeholder.svg"),
-                            "buyUrl": product.get("url", ""),
-                            "category": "General",
-                            "rating": rating,
-                            "reasoning": "Product recommendation based on your preferences",
-                        }
+                        format_scraped_product(
+                            products_by_url[ranked["url"]],
+                            i,
+                            currency_symbol,
+                            "General",
+                            ranked["reasoning"],
+                        )
                     )
 
                 response_data = {
                     "status": "success",
                     "categories": categories,
+                    "category_source": category_source,
                     "products": fallback_products,
                     "ai_recommendations": json.dumps([]),
+                    "ranking": "local_fallback",
                 }
+                mark_partial(response_data)
 
-                user_sessions[session_id]["results"] = response_data
+                user_sessions.update(session_id, results=response_data)
                 return response_data
             else:
                 # No valid products available
                 return {"status": "error", "message": "Unable to fetch product recommendations at this time. Please try again later."}, 503
 
+    except Cancelled:
+        raise
     except Exception as e:
-        print(f"Error processing recommendation request: {e}")
+        logger.exception("Error processing recommendation request")
         return {"status": "error", "message": str(e)}, 500
 
 
@@ -868,13 +1569,13 @@ def generate_fallback_products(shopping_request, user_data):
             # Default to tech if no specific category detected
             return sample_products.get('tech', [])
             
-    except Exception as e:
-        print(f"Error generating fallback products: {e}")
+    except Exception:
+        logger.exception("Error generating fallback products")
         return []
 
 
 if __name__ == "__main__":
-    print("Starting Shopping Recommendation API...")
-    print("API will be available at: https://eventually-yours-shopping-app.onrender.com/")
-    print("Health check: https://eventually-yours-shopping-app.onrender.com/api/health")
+    logger.info("Starting Shopping Recommendation API...")
+    logger.info("API will be available at: https://eventually-yours-shopping-app.onrender.com/")
+    logger.info("Health check: https://eventually-yours-shopping-app.onrender.com/api/health")
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,462 @@
+"""
+Drive the whole backend with concurrent user flows and report latency, throughput, errors and resource use.
+
+Each flow is one simulated visitor: /api/init-session, /api/user-info with a
+profile drawn from a weighted mix, then /api/shopping-recommendations. Flows
+run closed-loop at each concurrency level in turn.
+
+Usage (from the backend directory):
+    # Start mock Amazon and Gemini in this process and the backend as a child process
+    python benchmarks/load_test.py --spawn --concurrency 1,4,16 --flows 40
+
+    # Or point it at a backend that is already running against the mocks
+    python tools/mock_amazon_server.py --port 8082 &
+    python tools/mock_gemini_server.py --port 8081 &
+    AMAZON_BASE_URL=http://127.0.0.1:8082 GEMINI_API_BASE=http://127.0.0.1:8081/v1beta python main.py &
+    python benchmarks/load_test.py --base-url http://127.0.0.1:5000 --server-pid <pid>
+
+Resource usage (CPU, peak RSS, threads) is read from /proc and needs the
+backend's pid, which --spawn knows. --json writes the full report to a file.
+
+--spawn turns the backend's Gemini quota limits off so the run measures the
+backend rather than the quota; --gemini-rpm sets a limit instead. Requests
+that waited for Gemini quota are reported separately from the others.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from tools import mock_amazon_server, mock_gemini_server  # noqa: E402
+
+ENDPOINTS = ("init-session", "user-info", "shopping-recommendations")
+# A request whose Gemini quota wait took at least this long counts as throttled
+THROTTLED_WAIT_MS = 50
+
+# (weight, profile, shopping inputs); budgets are drawn per flow so most flows miss the response cache
+PROFILE_MIX = [
+    (
+        4,
+        {"age": "24", "gender": "female", "location": "India", "interests": "music, travel",
+         "categories": ["Electronics", "Travel"]},
+        ["wireless headphones for long flights", "a speaker for beach trips", "gift for a music lover"],
+    ),
+    (
+        3,
+        {"age": "31", "gender": "male", "location": "United States", "interests": "gaming, streaming",
+         "categories": ["Video Games", "Computers"]},
+        ["upgrade my gaming setup", "quiet mechanical keyboard", "headset for late night gaming"],
+    ),
+    (
+        2,
+        {"age": "42", "gender": "female", "location": "United Kingdom", "interests": "running, yoga",
+         "categories": ["Sports", "Health"]},
+        ["training for my first marathon", "home yoga essentials"],
+    ),
+    (
+        1,
+        {"age": "58", "gender": "male", "location": "Germany", "interests": "reading, coffee",
+         "categories": ["Books", "Kitchen"]},
+        ["birthday present for my wife", "something for a cozy reading corner"],
+    ),
+]
+BUDGETS = [(10, 100), (20, 200), (50, 300), (100, 400)]
+
+
+class Recorder:
+    """Latency samples and outcomes per endpoint for one concurrency level"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.outcomes = {endpoint: {} for endpoint in ENDPOINTS}
+        # (latency seconds, quota wait seconds) of the requests that waited for Gemini quota
+        self.throttled = {endpoint: [] for endpoint in ENDPOINTS}
+        self.flags = {"cached": 0, "fallback": 0}
+
+    def record(self, endpoint, seconds, outcome, quota_wait=0.0):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.outcomes[endpoint][outcome] = self.outcomes[endpoint].get(outcome, 0) + 1
+            if quota_wait * 1000 >= THROTTLED_WAIT_MS:
+                self.throttled[endpoint].append((seconds, quota_wait))
+
+    def flag(self, name):
+        with self.lock:
+            self.flags[name] += 1
+
+
+class ProcessSampler:
+    """Samples CPU time, RSS and thread count of a process from /proc"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._cpu_start = None
+        self._started = None
+
+    def available(self):
+        return self.pid is not None and os.path.exists(f"/proc/{self.pid}/stat")
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime, fields 14 and 15 of the full line
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def status(self):
+        values = {}
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                values[key] = value.strip()
+        return int(values.get("VmRSS", "0 kB").split()[0]) * 1024, int(values.get("Threads", "0"))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                rss, threads = self.status()
+            except OSError:
+                return
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_threads = max(self.peak_threads, threads)
+
+    def start(self):
+        if not self.available():
+            return
+        self._cpu_start = self.cpu_seconds()
+        self._started = time.monotonic()
+        self.peak_rss, self.peak_threads = self.status()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        elapsed = time.monotonic() - self._started
+        return {
+            "cpu_percent": round((self.cpu_seconds() - self._cpu_start) / elapsed * 100, 1),
+            "peak_rss_mb": round(self.peak_rss / 2**20, 1),
+            "peak_threads": self.peak_threads,
+        }
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def quota_wait(response):
+    """Seconds the request spent waiting for Gemini quota, from its Server-Timing header"""
+    total = 0.0
+    for entry in response.headers.get("Server-Timing", "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if name != "gemini_quota_wait":
+            continue
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                total += float(value) / 1000
+    return total
+
+
+def gemini_quota_stats(base_url, timeout=5):
+    """The backend's Gemini scheduler counters, or None when /api/worker-stats doesn't answer"""
+    try:
+        return requests.get(f"{base_url}/api/worker-stats", timeout=timeout).json()["stats"]["gemini_scheduler"]
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+        return None
+
+
+def timed_post(session, recorder, endpoint, url, payload, timeout):
+    """POST and record the latency and outcome, returns the JSON body or None"""
+    started = time.perf_counter()
+    try:
+        response = session.post(url, json=payload, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        recorder.record(endpoint, time.perf_counter() - started, type(e).__name__)
+        return None
+    elapsed = time.perf_counter() - started
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    ok = response.status_code == 200 and body.get("status") == "success"
+    recorder.record(endpoint, elapsed, "ok" if ok else str(response.status_code), quota_wait(response))
+    return body if ok else None
+
+
+def run_flow(base_url, recorder, rng, timeout):
+    weights = [weight for weight, _, _ in PROFILE_MIX]
+    _, profile, inputs = rng.choices(PROFILE_MIX, weights=weights)[0]
+    budget_min, budget_max = rng.choice(BUDGETS)
+    session_id = f"load_{uuid.uuid4().hex}"
+
+    with requests.Session() as session:
+        if timed_post(session, recorder, "init-session", f"{base_url}/api/init-session",
+                      {"session_id": session_id}, timeout) is None:
+            return
+        info = dict(profile, session_id=session_id, budgetMin=budget_min, budgetMax=budget_max)
+        if timed_post(session, recorder, "user-info", f"{base_url}/api/user-info", info, timeout) is None:
+            return
+        result = timed_post(
+            session,
+            recorder,
+            "shopping-recommendations",
+            f"{base_url}/api/shopping-recommendations",
+            {
+                "session_id": session_id,
+                "shopping_input": {"shoppingInput": rng.choice(inputs), "occasion": "", "brandsPreferred": ""},
+            },
+            timeout,
+        )
+        if result is not None:
+            if result.get("cached"):
+                recorder.flag("cached")
+            if result.get("ranking") == "fallback" or result.get("note"):
+                recorder.flag("fallback")
+        session.post(f"{base_url}/api/cleanup-session", json={"session_id": session_id}, timeout=timeout)
+
+
+def run_level(base_url, concurrency, flows, timeout, server_pid, seed):
+    recorder = Recorder()
+    sampler = ProcessSampler(server_pid)
+    rng = random.Random(seed)
+    seeds = [rng.random() for _ in range(flows)]
+    quota_before = gemini_quota_stats(base_url)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for flow_seed in seeds:
+            pool.submit(run_flow, base_url, recorder, random.Random(flow_seed), timeout)
+    elapsed = time.perf_counter() - started
+    resources = sampler.stop()
+    quota_after = gemini_quota_stats(base_url)
+
+    report = {
+        "concurrency": concurrency,
+        "flows": flows,
+        "seconds": round(elapsed, 2),
+        "flows_per_second": round(flows / elapsed, 3),
+        "requests_per_second": round(sum(len(v) for v in recorder.latencies.values()) / elapsed, 2),
+        "cached_responses": recorder.flags["cached"],
+        "fallback_responses": recorder.flags["fallback"],
+        "resources": resources,
+        "gemini_quota": None,
+        "endpoints": {},
+    }
+    if quota_before and quota_after:
+        report["gemini_quota"] = {
+            "rpm_limit": quota_after["rpm_limit"],
+            "tpm_limit": quota_after["tpm_limit"],
+            "granted": quota_after["granted"] - quota_before["granted"],
+            "timed_out": quota_after["timed_out"] - quota_before["timed_out"],
+        }
+    for endpoint in ENDPOINTS:
+        ordered = sorted(recorder.latencies[endpoint])
+        throttled = recorder.throttled[endpoint]
+        # Latencies of the requests that didn't wait for quota, the backend's own speed
+        unthrottled = sorted(recorder.latencies[endpoint])
+        for seconds, _ in throttled:
+            unthrottled.remove(seconds)
+        waits = sorted(wait for _, wait in throttled)
+        outcomes = recorder.outcomes[endpoint]
+        total = sum(outcomes.values())
+        report["endpoints"][endpoint] = {
+            "requests": total,
+            "error_rate": round(1 - outcomes.get("ok", 0) / total, 3) if total else None,
+            "errors": {outcome: n for outcome, n in outcomes.items() if outcome != "ok"},
+            **{
+                name: round(value * 1000, 1) if value is not None else None
+                for name, value in (
+                    ("p50_ms", percentile(ordered, 0.50)),
+                    ("p95_ms", percentile(ordered, 0.95)),
+                    ("p99_ms", percentile(ordered, 0.99)),
+                    ("unthrottled_p95_ms", percentile(unthrottled, 0.95)),
+                    ("quota_wait_p50_ms", percentile(waits, 0.50)),
+                    ("quota_wait_p95_ms", percentile(waits, 0.95)),
+                )
+            },
+            "throttled": len(throttled),
+        }
+    return report
+
+
+def print_report(report):
+    resources = report["resources"]
+    print(
+        f"\nconcurrency={report['concurrency']} flows={report['flows']} in {report['seconds']}s: "
+        f"{report['flows_per_second']} flows/s, {report['requests_per_second']} req/s, "
+        f"{report['cached_responses']} cached, {report['fallback_responses']} fallback"
+    )
+    if resources:
+        print(
+            f"  server: {resources['cpu_percent']}% CPU, peak RSS {resources['peak_rss_mb']} MB, "
+            f"peak threads {resources['peak_threads']}"
+        )
+    quota = report["gemini_quota"]
+    if quota:
+        print(
+            f"  gemini quota (rpm {quota['rpm_limit'] or 'off'}, tpm {quota['tpm_limit'] or 'off'}): "
+            f"{quota['granted']} calls, {quota['timed_out']} timed out waiting"
+        )
+    print(f"  {'endpoint':<26}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}  detail")
+    for endpoint, stats in report["endpoints"].items():
+        if not stats["requests"]:
+            continue
+        print(
+            f"  {endpoint:<26}{stats['requests']:>6}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+            f"{stats['p99_ms']:>10}{stats['error_rate']:>8.1%}  {stats['errors'] or ''}"
+        )
+        if stats["throttled"]:
+            print(
+                f"    {stats['throttled']} throttled: quota wait p50 {stats['quota_wait_p50_ms']} ms, "
+                f"p95 {stats['quota_wait_p95_ms']} ms; p95 without them {stats['unthrottled_p95_ms']} ms"
+            )
+
+
+def serve_in_thread(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def wait_until_healthy(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def free_port():
+    """A port nothing is listening on, for the spawned backend"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_stack(args):
+    """Start mock Amazon and Gemini in threads and the backend as a child process.
+
+    Ports default to free ones picked by the OS, so several runs can share a host.
+    """
+    amazon = serve_in_thread(mock_amazon_server.make_server(
+        port=args.amazon_port, latency=args.amazon_latency, jitter=args.amazon_latency / 3,
+        error_rate=args.amazon_error_rate, page_kb=args.page_kb,
+    ))
+    gemini = serve_in_thread(mock_gemini_server.make_server(
+        port=args.gemini_port, latency=args.gemini_latency, jitter=args.gemini_latency / 3,
+        error_rate=args.gemini_error_rate,
+    ))
+    env = dict(
+        os.environ,
+        AMAZON_BASE_URL=f"http://127.0.0.1:{amazon.server_address[1]}",
+        GEMINI_API_BASE=f"http://127.0.0.1:{gemini.server_address[1]}/v1beta",
+        GEMINI_API_KEY=os.getenv("GEMINI_API_KEY", "load-test"),
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    if args.gemini_rpm is not None:
+        env["GEMINI_RPM_LIMIT"] = str(args.gemini_rpm)
+    else:
+        # 0 turns a limit off: measure the backend, not the quota
+        env.update(GEMINI_RPM_LIMIT="0", GEMINI_TPM_LIMIT="0")
+    if args.base_url is None:
+        args.base_url = f"http://127.0.0.1:{free_port()}"
+    port = urlparse(args.base_url).port or 80
+    if args.server_mode == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "api.asgi_app:app", "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "api.backend_api", "run", "--port", str(port), "--with-threads"]
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    backend = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if not wait_until_healthy(f"{args.base_url}/api/health"):
+        backend.terminate()
+        raise SystemExit("Backend did not become healthy")
+    return backend, amazon, gemini
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--base-url", help="backend to load, default http://127.0.0.1:5000 or a free port with --spawn"
+    )
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--flows", type=int, default=40, help="user flows per concurrency level")
+    parser.add_argument("--timeout", type=float, default=180, help="per request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server-pid", type=int, help="backend pid, for CPU and memory figures")
+    parser.add_argument("--json", help="write the report to this file")
+    spawn = parser.add_argument_group("--spawn: run the backend against local mocks")
+    spawn.add_argument("--spawn", action="store_true")
+    spawn.add_argument("--server-mode", choices=("flask", "asgi"), default="flask")
+    spawn.add_argument("--server-log", help="write the backend's output to this file")
+    spawn.add_argument("--amazon-port", type=int, default=0, help="0 picks a free port")
+    spawn.add_argument("--amazon-latency", type=float, default=0.3)
+    spawn.add_argument("--amazon-error-rate", type=float, default=0.05)
+    spawn.add_argument("--page-kb", type=int, default=150)
+    spawn.add_argument("--gemini-port", type=int, default=0, help="0 picks a free port")
+    spawn.add_argument("--gemini-latency", type=float, default=0.8)
+    spawn.add_argument("--gemini-error-rate", type=float, default=0.02)
+    spawn.add_argument(
+        "--gemini-rpm", type=int, help="Gemini requests per minute the backend allows, default no limit"
+    )
+    args = parser.parse_args()
+    if args.base_url is not None:
+        args.base_url = args.base_url.rstrip("/")
+
+    backend = None
+    mocks = ()
+    if args.spawn:
+        backend, *mocks = spawn_stack(args)
+        args.server_pid = backend.pid
+    else:
+        args.base_url = args.base_url or "http://127.0.0.1:5000"
+        if not wait_until_healthy(f"{args.base_url}/api/health", timeout=5):
+            raise SystemExit(f"No backend answering at {args.base_url}")
+
+    reports = []
+    try:
+        for level in [int(value) for value in args.concurrency.split(",") if value.strip()]:
+            report = run_level(args.base_url, level, args.flows, args.timeout, args.server_pid, args.seed + level)
+            print_report(report)
+            reports.append(report)
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait(timeout=10)
+        for server in mocks:
+            server.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"base_url": args.base_url, "levels": reports}, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
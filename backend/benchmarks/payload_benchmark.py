@@ -0,0 +1,87 @@
+"""
+Compare the size of a recommendation response in the v1 and v2 formats, with and without compression.
+
+Usage (from the backend directory):
+    python benchmarks/payload_benchmark.py [--products 6]
+
+Sizes are for the JSON body as Flask sends it. The sample response is built
+from the Gemini ranking output in fixtures/gemini_ranking_response.txt, so
+ai_recommendations has the pipeline's shape: a JSON-encoded string of the
+parsed ranked entries. The brotli row is only printed when the brotli package
+is installed.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.backend_api import format_scraped_product, parse_ai_recommendations  # noqa: E402
+from utils.response_encoding import BROTLI_QUALITY, GZIP_LEVEL, brotli, to_v2  # noqa: E402
+
+# Ranking text as Gemini returns it, parsed the same way the pipeline parses it
+RANKING_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "gemini_ranking_response.txt")
+CATEGORIES = ["Wireless earbuds", "Portable speakers", "Travel backpacks", "Power banks", "E-readers"]
+
+
+def ranked_entries():
+    with open(RANKING_FIXTURE, encoding="utf-8") as f:
+        return parse_ai_recommendations(f.read())
+
+
+def sample_response(count):
+    ai_recommendations = ranked_entries()[:count]
+    products = []
+    for i, entry in enumerate(ai_recommendations):
+        scraped = {
+            "title": entry["title"],
+            "url": entry["url"],
+            "price_value": entry["price"],
+            "average_rating": f"{entry['rating']} out of 5 stars",
+            "image_url": entry["image_url"],
+        }
+        products.append(format_scraped_product(scraped, i, "₹", "Recommended", entry["reasoning"]))
+    return {
+        "status": "success",
+        "categories": CATEGORIES,
+        "category_source": "gemini",
+        "products": products,
+        "ai_recommendations": json.dumps(ai_recommendations),
+        "ranking": "gemini",
+    }
+
+
+def encoded(payload):
+    # Same serialization as Flask's jsonify outside debug mode
+    return json.dumps(payload, separators=(",", ":"), sort_keys=True).encode() + b"\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=6)
+    args = parser.parse_args()
+    available = len(ranked_entries())
+    if not 1 <= args.products <= available:
+        parser.error(f"--products must be between 1 and {available}, the entries in the ranking fixture")
+
+    response = sample_response(args.products)
+    bodies = {
+        "v1": encoded(response),
+        "v2": encoded(to_v2(response)),
+        "v2 fields=name,price,buyUrl": encoded(to_v2(response, ["id", "name", "price", "buyUrl"])),
+    }
+    baseline = len(bodies["v1"])
+    print(f"{'format':<30}{'encoding':<10}{'bytes':>8}{'vs v1':>9}")
+    for name, body in bodies.items():
+        rows = [("identity", body), ("gzip", gzip.compress(body, compresslevel=GZIP_LEVEL))]
+        if brotli is not None:
+            rows.append(("br", brotli.compress(body, quality=BROTLI_QUALITY)))
+        for encoding, data in rows:
+            print(f"{name:<30}{encoding:<10}{len(data):>8}{len(data) / baseline:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
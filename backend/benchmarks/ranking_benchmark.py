@@ -0,0 +1,136 @@
+"""
+Compare the latency of the local ranking engine with the Gemini ranking call.
+
+Usage (from the backend directory):
+    python benchmarks/ranking_benchmark.py [--products 15] [--iterations 2000] [--gemini-calls 3]
+
+The Gemini path is only measured when GEMINI_API_KEY is set.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.local_ranker import local_ranker  # noqa: E402
+
+SAMPLE_TITLES = [
+    "Wireless Bluetooth Headphones with Noise Cancelling",
+    "Portable Bluetooth Speaker Waterproof",
+    "Mechanical Gaming Keyboard RGB Backlit",
+    "Gaming Mouse with Adjustable DPI",
+    "Running Shoes Lightweight Breathable",
+    "Yoga Mat Non-Slip Extra Thick",
+    "Kindle Paperwhite E-reader 16GB",
+    "Stainless Steel Insulated Water Bottle",
+    "Smart Fitness Tracker Watch with Heart Rate Monitor",
+    "Studio Monitor Headphones for Music Production",
+    "Acoustic Guitar Starter Kit",
+    "Vinyl Record Player with Built-in Speakers",
+    "Travel Backpack Carry-On Size",
+    "Ceramic Pour Over Coffee Maker",
+    "LED Desk Lamp with USB Charging Port",
+]
+
+USER_INPUT = "headphones for listening to music while travelling"
+USER_PROFILE = {
+    "age": "28",
+    "gender": "female",
+    "budget_range": "20-150",
+    "favorite_categories": ["Audio & Headphones", "Travel"],
+    "interests": "music, travel, running",
+    "user_location": "United States",
+}
+CATEGORIES = ["Wireless Headphones", "Bluetooth Speakers", "Travel Accessories"]
+PRIORITY_KEYWORDS = ["music", "headphones", "speaker", "audio"]
+
+
+def make_products(count, seed=42):
+    """Synthetic scraped products shaped like scrape_amazon_product output"""
+    rng = random.Random(seed)
+    products = []
+    for i in range(count):
+        title = SAMPLE_TITLES[i % len(SAMPLE_TITLES)]
+        price = round(rng.uniform(10, 250), 2)
+        products.append(
+            {
+                "title": f"{title} #{i + 1}" if i >= len(SAMPLE_TITLES) else title,
+                "url": f"https://www.amazon.com/dp/B{i:09d}",
+                "price": f"${price}",
+                "price_value": price,
+                "average_rating": round(rng.uniform(3.0, 5.0), 1),
+                "image_url": "/placeholder.svg",
+                "category": CATEGORIES[i % len(CATEGORIES)],
+            }
+        )
+    return products
+
+
+def summarize(name, samples, unit, scale):
+    """Print median, p95 and max of the samples in the given unit"""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{name:<8} n={len(samples):<6} "
+        f"median={statistics.median(ordered) * scale:.1f}{unit} "
+        f"p95={p95 * scale:.1f}{unit} max={ordered[-1] * scale:.1f}{unit}"
+    )
+
+
+def bench_local(products, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        local_ranker.rank(
+            USER_INPUT,
+            USER_PROFILE,
+            products,
+            priority_keywords=PRIORITY_KEYWORDS,
+            category_order=CATEGORIES,
+        )
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_gemini(products, calls, api_key):
+    from services.sorting_algorithm import SortingAlgorithm
+
+    sorting_algo = SortingAlgorithm(api_key)
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        sorting_algo.get_sorted_products(USER_INPUT, USER_PROFILE, products)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=15)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--gemini-calls", type=int, default=3)
+    args = parser.parse_args()
+
+    products = make_products(args.products)
+    print(f"Ranking {len(products)} products\n")
+
+    local_samples = bench_local(products, args.iterations)
+    summarize("local", local_samples, "us", 1e6)
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key or args.gemini_calls <= 0:
+        print("gemini   skipped (set GEMINI_API_KEY to measure the LLM path)")
+        return
+
+    gemini_samples = bench_gemini(products, args.gemini_calls, api_key)
+    summarize("gemini", gemini_samples, "ms", 1e3)
+    speedup = statistics.median(gemini_samples) / statistics.median(local_samples)
+    print(f"\nLocal ranking is ~{speedup:,.0f}x faster than the Gemini ranking call")
+
+
+if __name__ == "__main__":
+    main()
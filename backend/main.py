@@ -7,6 +7,9 @@ load_dotenv()
 
 from api.backend_api import app
 
+# "flask" runs the threaded development server, "asgi" serves api.asgi_app with uvicorn
+SERVER_MODE = os.getenv("SERVER_MODE", "flask").lower()
+
 if __name__ == "__main__":
     print(f"Starting {app.config.get('APP_NAME', 'Eventually Yours Shopping App')} Backend...")
     
@@ -15,4 +18,9 @@ if __name__ == "__main__":
         print("Warning: GEMINI_API_KEY environment variable not set!")
         print("Please create a .env file with your API key or set the environment variable.")
     
-    app.run(debug=True, host="0.0.0.0", port=5000) 
\ No newline at end of file
+    if SERVER_MODE == "asgi":
+        import uvicorn
+
+        uvicorn.run("api.asgi_app:app", host="0.0.0.0", port=5000)
+    else:
+        app.run(debug=True, host="0.0.0.0", port=5000) 
\ No newline at end of file
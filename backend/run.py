@@ -1,10 +1,10 @@
 import sys
 import sys
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 from utils.domain_gen import get_amazon_domain
-from services.amazon_scraper import amazon_category_top_products, scrape_amazon_product
 from services.prompt_builder import build_and_get_categories
+from services.scrape_scheduler import scrape_category, scrape_scheduler
 
 
 def get_user_details():
@@ -65,61 +65,43 @@ def main():
     # Dictionary to hold category and its products
     category_products = {}
 
-    def fetch_category_products(category):
-        urls = amazon_category_top_products(
+    def within_budget(product):
+        # Filter products by budget range if price_value is available
+        budget_range = profile_details.get("budget_range")
+        if budget_range and product.get("price_value") is not None:
+            try:
+                low, high = budget_range.replace("€", "").replace("$", "").split("-")
+                low = float(low.strip())
+                high = float(high.strip())
+                return low <= product["price_value"] <= high
+            except Exception:
+                # If parsing fails, include product anyway
+                return True
+        return True
+
+    # Same shared scrape scheduler as the API, so outbound concurrency stays bounded
+    category_futures = [
+        scrape_category(
+            scrape_scheduler,
             category,
             amazon_domain,
             num_results=3,
             budget_range=profile_details.get("budget_range"),
         )
-        products = []
-        if not urls:
-            return category, products
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = {executor.submit(scrape_amazon_product, url): url for url in urls}
-            for future in as_completed(futures):
-                url = futures[future]
-                try:
-                    product = future.result()
-                    if product:
-                        # Filter products by budget range if price_value is available
-                        budget_range = profile_details.get("budget_range")
-                        if budget_range and product.get("price_value") is not None:
-                            try:
-                                low, high = (
-                                    budget_range.replace("€", "")
-                                    .replace("$", "")
-                                    .split("-")
-                                )
-                                low = float(low.strip())
-                                high = float(high.strip())
-                                if low <= product["price_value"] <= high:
-                                    products.append(product)
-                            except Exception:
-                                # If parsing fails, include product anyway
-                                products.append(product)
-                        else:
-                            products.append(product)
-                except Exception as e:
-                    print(f"Exception occurred while scraping URL {url}: {e}")
-        return category, products
-
-    with ThreadPoolExecutor(max_workers=len(categories)) as category_executor:
-        category_futures = [
-            category_executor.submit(fetch_category_products, category)
-            for category in categories
-        ]
-        for future in as_completed(category_futures):
+        for category in categories
+    ]
+    for future in as_completed(category_futures):
+        try:
             category, products = future.result()
-            category_products[category] = products
+        except Exception as e:
+            print(f"Exception occurred while scraping a category: {e}")
+            continue
+        category_products[category] = [p for p in products if within_budget(p)]
 
     # Integrate sorting algorithm to get ordered product recommendations
-    from sorting_algorithm import SortingAlgorithm
+    from services.sorting_algorithm import SortingAlgorithm
 
-    sorting_algo = SortingAlgorithm(
-        "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent",
-        api_key,
-    )
+    sorting_algo = SortingAlgorithm(api_key)
     all_products = []
     for products in category_products.values():
         all_products.extend(products)
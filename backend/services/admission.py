@@ -0,0 +1,152 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from utils.metrics import QUEUE_WAIT_SECONDS
+
+# Requests waiting for a worker beyond this are turned away
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "20"))
+# Service time assumed until enough requests have finished
+DEFAULT_SERVICE_SECONDS = float(os.getenv("ADMISSION_DEFAULT_SERVICE_SECONDS", "20"))
+SERVICE_SAMPLES = 50
+
+# Lower runs first: cache-warm requests are cheap, background work can wait
+PRIORITY_CLASSES = {"fast": 0, "interactive": 1, "background": 2}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be served within its deadline"""
+
+    def __init__(self, reason, retry_after, estimated_wait):
+        super().__init__(f"Request rejected ({reason}), estimated wait {estimated_wait:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+        self.estimated_wait = estimated_wait
+
+
+class AdmissionController:
+    """Admits recommendation jobs to the worker pool in priority order.
+
+    At most executor._max_workers jobs are handed to the executor at a time;
+    the rest wait in a bounded priority queue. A job whose estimated queue
+    wait plus typical service time would overrun its budget is rejected up
+    front instead of timing out after it finally starts.
+    """
+
+    def __init__(self, executor, max_queue=ADMISSION_MAX_QUEUE):
+        self.executor = executor
+        self.workers = executor._max_workers
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._queue = []  # heap of (priority, seq, job, runner, enqueued_at)
+        self._seq = itertools.count()
+        self._running = 0
+        self._service_times = deque(maxlen=SERVICE_SAMPLES)
+        self._queue_waits = deque(maxlen=SERVICE_SAMPLES)
+        self._stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_deadline": 0,
+            "max_queue_depth": 0,
+            "admitted_by_priority": {name: 0 for name in PRIORITY_CLASSES},
+        }
+
+    def _service_time(self):
+        if not self._service_times:
+            return DEFAULT_SERVICE_SECONDS
+        return sum(self._service_times) / len(self._service_times)
+
+    def _estimate_wait(self, priority):
+        """Seconds until a new job of this priority would start"""
+        ahead = sum(1 for entry in self._queue if entry[0] <= priority)
+        busy = self._running + ahead
+        if busy < self.workers:
+            return 0.0
+        # Each round of `workers` jobs ahead takes about one service time
+        return (busy - self.workers + 1) / self.workers * self._service_time()
+
+    def estimate_wait(self, priority=PRIORITY_CLASSES["interactive"]):
+        with self._lock:
+            return self._estimate_wait(priority)
+
+    def submit(self, job, runner, priority="interactive", budget=None):
+        """Queue runner(job) to run on the executor, or raise AdmissionRejected.
+
+        budget is the number of seconds the job has to finish in.
+        """
+        level = PRIORITY_CLASSES.get(priority, PRIORITY_CLASSES["interactive"])
+        with self._lock:
+            estimate = self._estimate_wait(level)
+            service = self._service_time()
+            retry_after = max(1, math.ceil(estimate))
+            if self._running >= self.workers and len(self._queue) >= self.max_queue:
+                self._stats["rejected_queue_full"] += 1
+                raise AdmissionRejected("queue full", retry_after, estimate)
+            if budget is not None and estimate > 0 and estimate + service > budget:
+                self._stats["rejected_deadline"] += 1
+                raise AdmissionRejected("deadline", retry_after, estimate)
+
+            self._stats["admitted"] += 1
+            self._stats["admitted_by_priority"][priority if priority in PRIORITY_CLASSES else "interactive"] += 1
+            heapq.heappush(self._queue, (level, next(self._seq), job, runner, time.monotonic()))
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._queue))
+        self._dispatch()
+        return estimate
+
+    def _dispatch(self):
+        """Start queued jobs while workers are free"""
+        while True:
+            with self._lock:
+                if self._running >= self.workers or not self._queue:
+                    return
+                _, _, job, runner, enqueued_at = heapq.heappop(self._queue)
+                if job.finished:
+                    # Cancelled while queued
+                    continue
+                self._running += 1
+            if not job.start():
+                # Cancelled between leaving the queue and starting
+                with self._lock:
+                    self._running -= 1
+                job.finish({"status": "cancelled", "message": "Request cancelled"}, 409, status="cancelled")
+                continue
+            wait = time.monotonic() - enqueued_at
+            with self._lock:
+                self._queue_waits.append(wait)
+            QUEUE_WAIT_SECONDS.observe(wait, queue="admission")
+
+            started = time.monotonic()
+            try:
+                job.future = self.executor.submit(runner, job)
+            except Exception:
+                with self._lock:
+                    self._running -= 1
+                raise
+            job.future.add_done_callback(lambda _, started=started: self._finished(started))
+
+    def _finished(self, started):
+        with self._lock:
+            self._running -= 1
+            self._service_times.append(time.monotonic() - started)
+        self._dispatch()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["admitted_by_priority"] = dict(self._stats["admitted_by_priority"])
+            stats.update({
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queue_depth": len(self._queue),
+                "avg_service_seconds": round(self._service_time(), 3),
+                "avg_queue_wait_seconds": (
+                    round(sum(self._queue_waits) / len(self._queue_waits), 3) if self._queue_waits else 0.0
+                ),
+                "estimated_wait_seconds": round(self._estimate_wait(PRIORITY_CLASSES["interactive"]), 3),
+            })
+        return stats
@@ -1,3 +1,4 @@
+import logging
 import random
 import time
 import httpx
@@ -8,6 +9,34 @@ import json
 import re
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
+import os
+from utils.state_store import make_cache
+from utils.cancellation import (
+    Cancelled,
+    DeadlineExceeded,
+    cancellable_sleep,
+    raise_if_cancelled,
+    record_reclaimed,
+    stage_timeout,
+)
+from utils.metrics import STAGE_SECONDS, record_http_status, timed_stage
+
+logger = logging.getLogger(__name__)
+
+# Caches for search results and scraped products, shared by all requests
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "1800"))
+PRODUCT_CACHE_TTL = int(os.getenv("PRODUCT_CACHE_TTL_SECONDS", "3600"))
+search_cache = make_cache("search", max_entries=2048, ttl=SEARCH_CACHE_TTL)
+product_cache = make_cache("product", max_entries=4096, ttl=PRODUCT_CACHE_TTL)
+
+
+def search_cache_key(category, amazon_domain, num_results, budget_range):
+    return (category.strip().lower(), amazon_domain, num_results, budget_range or "")
+
+
+def get_cache_stats():
+    return {"search": search_cache.get_stats(), "product": product_cache.get_stats()}
+
 
 # Global session pool for better connection reuse
 session_pool = {}
@@ -75,12 +104,59 @@ def get_realistic_headers():
     }
 
 
-def amazon_category_top_products(category, amazon_domain, num_results=3, budget_range=None):
+def fetch_page(url, headers, timeout, cancel_token=None, stage="fetch", deadline=None):
+    """GET a page and return (response, body).
+
+    The body is downloaded in chunks so a cancelled token closes the
+    connection mid-download instead of waiting for the whole page.
+    Each attempt is timed under stage and its status counted per domain.
+    The timeout is capped to what is left before deadline.
+    """
+    raise_if_cancelled(cancel_token)
+    timeout = stage_timeout(timeout, deadline)
+    with timed_stage(stage) as attempt:
+        try:
+            response = requests.get(url, headers=headers, timeout=timeout, stream=True)
+        except requests.exceptions.RequestException:
+            record_http_status(url, "error")
+            raise
+        record_http_status(url, response.status_code)
+        if attempt is not None:
+            attempt.attrs["status"] = response.status_code
+        unregister = cancel_token.on_cancel(response.close) if cancel_token else (lambda: None)
+        try:
+            chunks = []
+            for chunk in response.iter_content(chunk_size=16384):
+                raise_if_cancelled(cancel_token)
+                chunks.append(chunk)
+            return response, b"".join(chunks)
+        except Exception:
+            if cancel_token is not None and cancel_token.cancelled:
+                record_reclaimed("http_aborted")
+                raise Cancelled(cancel_token.reason)
+            raise
+        finally:
+            unregister()
+            response.close()
+
+
+def amazon_category_top_products(
+    category, amazon_domain, num_results=3, budget_range=None, cancel_token=None, deadline=None
+):
     """
     Get top products from Amazon category search with improved concurrency and better error handling
+
+    cancel_token stops retries and aborts the download when the request is cancelled.
+    Fetches and retries are fitted into the time left before the monotonic deadline.
     """
+    cache_key = search_cache_key(category, amazon_domain, num_results, budget_range)
+    cached_urls = search_cache.get(cache_key)
+    if cached_urls is not None:
+        logger.debug("Search cache hit for category: %s", category, extra={"sample": "search_cache_hit"})
+        return list(cached_urls)
+
     try:
-        print(f"Searching for category: {category} on {amazon_domain}")
+        logger.info("Searching for category: %s on %s", category, amazon_domain)
         
         # Use realistic headers to avoid detection
         headers = get_realistic_headers()
@@ -99,36 +175,45 @@ def amazon_category_top_products(category, amazon_domain, num_results=3, budget_
             except:
                 pass  # Continue without budget filter if parsing fails
         
-        print(f"Search URL: {search_url}")
+        logger.debug("Search URL: %s", search_url)
         
         # Make request with realistic headers and retry logic
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                response = requests.get(search_url, headers=headers, timeout=15)
+                response, content = fetch_page(
+                    search_url, headers, 15, cancel_token, stage="search_fetch", deadline=deadline
+                )
                 
                 if response.status_code == 503:
-                    print(f"503 error on attempt {attempt + 1} for {category}, retrying...")
+                    logger.warning(
+                        "503 error on attempt %d for %s, retrying...", attempt + 1, category,
+                        extra={"sample": "amazon_503"},
+                    )
                     if attempt < max_retries - 1:
-                        time.sleep(random.uniform(2, 5))  # Random delay
+                        cancellable_sleep(random.uniform(2, 5), cancel_token, deadline)  # Random delay
                         continue
                     else:
-                        print(f"Max retries reached for {category}, returning empty list")
+                        logger.warning("Max retries reached for %s, returning empty list", category)
                         return []
                 
                 response.raise_for_status()
                 break
                 
             except requests.exceptions.RequestException as e:
-                print(f"Request error on attempt {attempt + 1} for {category}: {e}")
+                logger.warning(
+                    "Request error on attempt %d for %s: %s", attempt + 1, category, e,
+                    extra={"sample": "amazon_request_error"},
+                )
                 if attempt < max_retries - 1:
-                    time.sleep(random.uniform(1, 3))
+                    cancellable_sleep(random.uniform(1, 3), cancel_token, deadline)
                     continue
                 else:
-                    print(f"Max retries reached for {category}, returning empty list")
+                    logger.warning("Max retries reached for %s, returning empty list", category)
                     return []
         
-        soup = BeautifulSoup(response.content, 'html.parser')
+        parse_started = time.perf_counter()
+        soup = BeautifulSoup(content, 'html.parser')
         
         # Multiple selectors for product links with better fallbacks
         product_selectors = [
@@ -173,7 +258,7 @@ def amazon_category_top_products(category, amazon_domain, num_results=3, budget_
         
         # If no products found with selectors, try alternative approach
         if not product_urls:
-            print(f"No products found with selectors for {category}, trying alternative approach")
+            logger.debug("No products found with selectors for %s, trying alternative approach", category)
             # Look for any links containing product IDs
             all_links = soup.find_all('a', href=True)
             for link in all_links:
@@ -189,15 +274,24 @@ def amazon_category_top_products(category, amazon_domain, num_results=3, budget_
                             if len(product_urls) >= num_results:
                                 break
         
-        print(f"Found {len(product_urls)} product URLs for category: {category}")
+        STAGE_SECONDS.observe(time.perf_counter() - parse_started, stage="search_parse")
+        logger.info("Found %d product URLs for category: %s", len(product_urls), category)
         
+        if product_urls:
+            search_cache.set(cache_key, product_urls[:num_results])
+
         # Add small delay to avoid rate limiting
-        time.sleep(random.uniform(0.5, 1.5))
+        cancellable_sleep(random.uniform(0.5, 1.5), cancel_token, deadline)
         
         return product_urls[:num_results]
         
+    except Cancelled:
+        raise
+    except DeadlineExceeded as e:
+        logger.info("Search for %s stopped at the request deadline (%s)", category, e)
+        return []
     except Exception as e:
-        print(f"Error in amazon_category_top_products for {category}: {e}")
+        logger.warning("Error in amazon_category_top_products for %s: %s", category, e)
         return []
 
 
@@ -229,12 +323,20 @@ def parse_price_to_float(price_str):
     return None
 
 
-def scrape_amazon_product(url):
+def scrape_amazon_product(url, cancel_token=None, deadline=None):
     """
     Scrape individual Amazon product page with improved concurrency and error handling
+
+    cancel_token stops retries and aborts the download when the request is cancelled.
+    Fetches and retries are fitted into the time left before the monotonic deadline.
     """
+    cached_product = product_cache.get(url)
+    if cached_product is not None:
+        # Callers annotate the product, so hand out a copy
+        return dict(cached_product)
+
     try:
-        print(f"Scraping product: {url}")
+        logger.debug("Scraping product: %s", url, extra={"sample": "scraping_product"})
         
         # Use realistic headers to avoid detection
         headers = get_realistic_headers()
@@ -243,30 +345,39 @@ def scrape_amazon_product(url):
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                response = requests.get(url, headers=headers, timeout=10)
+                response, content = fetch_page(
+                    url, headers, 10, cancel_token, stage="product_fetch", deadline=deadline
+                )
                 
                 if response.status_code == 503:
-                    print(f"503 error on attempt {attempt + 1} for {url}, retrying...")
+                    logger.warning(
+                        "503 error on attempt %d for %s, retrying...", attempt + 1, url,
+                        extra={"sample": "amazon_503"},
+                    )
                     if attempt < max_retries - 1:
-                        time.sleep(random.uniform(2, 4))  # Random delay
+                        cancellable_sleep(random.uniform(2, 4), cancel_token, deadline)  # Random delay
                         continue
                     else:
-                        print(f"Max retries reached for {url}, returning None")
+                        logger.warning("Max retries reached for %s, returning None", url)
                         return None
                 
                 response.raise_for_status()
                 break
                 
             except requests.exceptions.RequestException as e:
-                print(f"Request error on attempt {attempt + 1} for {url}: {e}")
+                logger.warning(
+                    "Request error on attempt %d for %s: %s", attempt + 1, url, e,
+                    extra={"sample": "amazon_request_error"},
+                )
                 if attempt < max_retries - 1:
-                    time.sleep(random.uniform(1, 3))
+                    cancellable_sleep(random.uniform(1, 3), cancel_token, deadline)
                     continue
                 else:
-                    print(f"Max retries reached for {url}, returning None")
+                    logger.warning("Max retries reached for %s, returning None", url)
                     return None
         
-        soup = BeautifulSoup(response.content, 'html.parser')
+        parse_started = time.perf_counter()
+        soup = BeautifulSoup(content, 'html.parser')
         
         # Extract product information with multiple selectors
         product_data = {}
@@ -357,21 +468,28 @@ def scrape_amazon_product(url):
         
         # Add URL to product data
         product_data['url'] = url
+        STAGE_SECONDS.observe(time.perf_counter() - parse_started, stage="product_parse")
         
         # Validate that we have at least a title
         if not product_data.get('title'):
-            print(f"No title found for product: {url}")
+            logger.info("No title found for product: %s", url, extra={"sample": "product_no_title"})
             return None
         
-        print(f"Successfully scraped product: {product_data.get('title', 'Unknown')}")
+        logger.info("Scraped product: %s", product_data["title"], extra={"sample": "product_scraped"})
+        product_cache.set(url, dict(product_data))
         
         # Add small delay to avoid rate limiting
-        time.sleep(random.uniform(0.2, 0.8))
+        cancellable_sleep(random.uniform(0.2, 0.8), cancel_token, deadline)
         
         return product_data
         
+    except Cancelled:
+        raise
+    except DeadlineExceeded as e:
+        logger.info("Scrape of %s stopped at the request deadline (%s)", url, e)
+        return None
     except Exception as e:
-        print(f"Error scraping product {url}: {e}")
+        logger.warning("Error scraping product %s: %s", url, e)
         return None
 
 
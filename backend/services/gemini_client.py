@@ -0,0 +1,464 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.gemini_scheduler import QuotaWaitTimeout, estimate_tokens, gemini_scheduler
+from utils.cancellation import Cancelled, cancellable_sleep, record_reclaimed
+from utils.metrics import record_http_status
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Point GEMINI_API_BASE at tools/mock_gemini_server.py to run the pipeline offline
+GEMINI_API_BASE = os.getenv(
+    "GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta"
+).rstrip("/")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "10"))
+CONNECT_TIMEOUT_SECONDS = 5
+
+# Register static instruction prefixes as Gemini cached content and send only the variable suffix
+GEMINI_PREFIX_CACHE = os.getenv("GEMINI_PREFIX_CACHE", "true").lower() in ("1", "true", "yes")
+GEMINI_PREFIX_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_PREFIX_CACHE_TTL_SECONDS", "3600"))
+# Smaller prefixes are always sent inline. The default admits the category and ranking
+# instructions (~300-400 tokens); a model with a higher minimum refuses them, which is backed off
+GEMINI_PREFIX_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_PREFIX_CACHE_MIN_TOKENS", "256"))
+# Re-register a prefix this long before Gemini expires it
+PREFIX_REFRESH_MARGIN_SECONDS = 60
+# Registrations run in the background; one that can't finish in this time is abandoned
+PREFIX_REGISTER_TIMEOUT_SECONDS = 10
+# A prefix Gemini refused to cache (e.g. below the minimum size) is sent inline for this long
+PREFIX_RETRY_AFTER_SECONDS = 600
+# Errors meaning a cached content name is no longer valid
+STALE_CACHE_STATUS_CODES = {400, 403, 404}
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    """Raised when a Gemini call fails after all retries or runs out of time"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def prefix_hash(model, text):
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()[:16]
+
+
+# Prefix registrations, off the request path
+_register_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-prefix")
+
+
+class PrefixCache:
+    """Static instruction prefixes registered with Gemini's cachedContents API.
+
+    Each distinct prefix is registered once per TTL and later calls refer to
+    it by name. Registration runs in the background under the quota
+    scheduler; until it succeeds, and for prefixes below Gemini's minimum
+    cache size or that Gemini refused, the prefix is sent as
+    systemInstruction, so requests never wait for or fail because of the cache.
+    """
+
+    def __init__(
+        self,
+        client,
+        ttl=GEMINI_PREFIX_CACHE_TTL_SECONDS,
+        enabled=GEMINI_PREFIX_CACHE,
+        min_tokens=GEMINI_PREFIX_CACHE_MIN_TOKENS,
+    ):
+        self.client = client
+        self.ttl = ttl
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self._entries = {}  # prefix hash -> {"name", "expires_at"} or {"name": None, "retry_at"}
+        self._registering = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "registrations": 0,
+            "registration_failures": 0,
+            "inline": 0,
+            "below_minimum": 0,
+            "invalidations": 0,
+            "prefix_chars_saved": 0,
+        }
+
+    def resolve(self, prefix):
+        """Cached content name to use for prefix, or None to send it inline.
+
+        Never blocks on Gemini: a prefix not registered yet is queued for
+        registration and sent inline this time.
+        """
+        key = prefix_hash(self.client.model, prefix)
+        now = time.monotonic()
+        with self._lock:
+            self._stats["lookups"] += 1
+            if self.enabled and len(prefix) // 4 < self.min_tokens:
+                # Gemini would refuse it, don't spend a call finding out
+                self._stats["below_minimum"] += 1
+                self._stats["inline"] += 1
+                return None
+            entry = self._entries.get(key)
+            if entry and entry["name"] and entry["expires_at"] - PREFIX_REFRESH_MARGIN_SECONDS > now:
+                self._stats["hits"] += 1
+                self._stats["prefix_chars_saved"] += len(prefix)
+                return entry["name"]
+            self._stats["inline"] += 1
+            refused = entry and entry["name"] is None and entry["retry_at"] > now
+            # Only one registration per prefix at a time
+            if not self.enabled or refused or key in self._registering:
+                return None
+            self._registering.add(key)
+        return self._submit(key, prefix)
+
+    def _submit(self, key, prefix):
+        try:
+            _register_pool.submit(self._register_in_background, key, prefix)
+        except RuntimeError:
+            # Interpreter shutting down
+            with self._lock:
+                self._registering.discard(key)
+        return None
+
+    def _register_in_background(self, key, prefix):
+        try:
+            name = self._register(prefix)
+        finally:
+            with self._lock:
+                self._registering.discard(key)
+        now = time.monotonic()
+        with self._lock:
+            if name:
+                self._entries[key] = {"name": name, "expires_at": now + self.ttl}
+                self._stats["registrations"] += 1
+            else:
+                self._entries[key] = {"name": None, "retry_at": now + PREFIX_RETRY_AFTER_SECONDS}
+                self._stats["registration_failures"] += 1
+
+    def _register(self, prefix):
+        # Through post() so the call takes a quota slot and is bounded like any other
+        try:
+            response, _ = self.client.post(
+                f"{self.client.base_url}/cachedContents",
+                {
+                    "model": f"models/{self.client.model}",
+                    "systemInstruction": {"parts": [{"text": prefix}]},
+                    "ttl": f"{self.ttl}s",
+                },
+                timeout=PREFIX_REGISTER_TIMEOUT_SECONDS,
+                session_id="gemini-prefix-cache",
+            )
+            return response.json().get("name")
+        except GeminiError as e:
+            logger.info("Gemini did not cache prompt prefix (%s), sending it inline", e.status_code or e)
+        except ValueError as e:
+            logger.warning("Could not register prompt prefix with Gemini: %s", e)
+        return None
+
+    def invalidate(self, name):
+        """Forget a cached content name Gemini no longer accepts"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry["name"] == name:
+                    del self._entries[key]
+                    self._stats["invalidations"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_prefixes"] = sum(1 for entry in self._entries.values() if entry["name"])
+        stats["enabled"] = self.enabled
+        stats["hit_ratio"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else None
+        return stats
+
+
+class GeminiClient:
+    """Gemini HTTP client shared by all requests.
+
+    Keeps a pooled keep-alive session, bounds every call by a deadline and
+    retries 429/5xx responses and connection errors with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url=GEMINI_API_BASE,
+        model=GEMINI_MODEL,
+        timeout=GEMINI_TIMEOUT_SECONDS,
+        max_retries=GEMINI_MAX_RETRIES,
+        pool_size=GEMINI_POOL_SIZE,
+        backoff=0.5,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.prefix_cache = PrefixCache(self)
+
+    def model_url(self, method):
+        return f"{self.base_url}/models/{self.model}:{method}"
+
+    def retry_delay(self, attempt, response=None):
+        """Backoff before the next attempt, honouring Retry-After when Gemini sends it"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        return self.backoff * (2 ** attempt) * random.uniform(0.8, 1.2)
+
+    def post(
+        self,
+        url,
+        payload,
+        timeout=None,
+        params=None,
+        stream=False,
+        session_id=None,
+        deadline=None,
+        cancel_token=None,
+    ):
+        """POST with retries, the whole call including backoff fits in timeout seconds.
+
+        Every attempt first takes a slot from the shared quota scheduler.
+        deadline is the monotonic time the calling request must finish by;
+        a cancelled cancel_token stops waiting, retrying and sending.
+        Returns the response and its QuotaTicket.
+        """
+        call_deadline = time.monotonic() + (timeout or self.timeout)
+        if deadline is not None:
+            call_deadline = min(call_deadline, deadline)
+        query = {"key": self.api_key}
+        if params:
+            query.update(params)
+        tokens = estimate_tokens(json.dumps(payload))
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = call_deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            response = None
+            if cancel_token is not None and cancel_token.cancelled:
+                record_reclaimed("gemini_calls_skipped")
+                raise Cancelled(cancel_token.reason)
+            try:
+                with span("gemini_quota_wait"):
+                    ticket = gemini_scheduler.acquire(
+                        session_id, tokens, deadline=deadline, timeout=remaining, cancel_token=cancel_token
+                    )
+                # The quota wait may have used up the call's time, don't send what can't be answered
+                remaining = call_deadline - time.monotonic()
+                if remaining <= 0:
+                    last_error = GeminiError(
+                        f"Gemini API request timed out after waiting {ticket.waited:.1f}s for quota"
+                    )
+                    break
+                # Streamed calls end when the headers arrive, reading the body is the caller's span
+                with span("gemini_call", attempt=attempt) as call:
+                    response = self.session.post(
+                        url,
+                        params=query,
+                        json=payload,
+                        stream=stream,
+                        timeout=(min(CONNECT_TIMEOUT_SECONDS, remaining), remaining),
+                    )
+                    if call is not None:
+                        call.attrs["status"] = response.status_code
+                record_http_status(url, response.status_code)
+                if response.status_code == 200:
+                    return response, ticket
+                last_error = GeminiError(
+                    f"Gemini API request failed with status code {response.status_code}: {response.text}",
+                    status_code=response.status_code,
+                )
+                response.close()
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise last_error
+            except QuotaWaitTimeout as e:
+                last_error = GeminiError(str(e), status_code=429)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                record_http_status(url, "error")
+                last_error = GeminiError(f"Gemini API request failed: {e}")
+
+            delay = self.retry_delay(attempt, response)
+            if response is not None and response.status_code == 429:
+                # Our accounting disagrees with Gemini, hold every caller back
+                gemini_scheduler.cooldown(delay)
+            if attempt < self.max_retries:
+                if time.monotonic() + delay >= call_deadline:
+                    break
+                logger.warning("Gemini call failed (%s), retrying in %.1fs", last_error, delay)
+                cancellable_sleep(delay, cancel_token)
+
+        raise last_error or GeminiError("Gemini API request timed out")
+
+    def build_payload(self, prompt, system_instruction=None, use_cache=True):
+        """Request body for prompt, with the static system_instruction cached when possible.
+
+        Returns the payload and the cached content name it refers to, if any.
+        """
+        data = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        if not system_instruction:
+            return data, None
+        cached_name = self.prefix_cache.resolve(system_instruction) if use_cache else None
+        if cached_name:
+            data["cachedContent"] = cached_name
+        else:
+            data["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        return data, cached_name
+
+    def post_prompt(self, method, prompt, system_instruction=None, **kwargs):
+        """post() a prompt, resending the prefix inline if Gemini dropped its cached copy"""
+        data, cached_name = self.build_payload(prompt, system_instruction)
+        try:
+            return self.post(self.model_url(method), data, **kwargs)
+        except GeminiError as e:
+            if not cached_name or e.status_code not in STALE_CACHE_STATUS_CODES:
+                raise
+            logger.info("Cached prompt prefix %s rejected, sending it inline", cached_name)
+            self.prefix_cache.invalidate(cached_name)
+            data, _ = self.build_payload(prompt, system_instruction, use_cache=False)
+            return self.post(self.model_url(method), data, **kwargs)
+
+    def generate_content(
+        self, prompt, timeout=None, session_id=None, deadline=None, system_instruction=None, cancel_token=None
+    ):
+        """Call generateContent and return the raw response JSON.
+
+        system_instruction is the static part of the prompt, registered with
+        Gemini once so later calls only send prompt.
+        """
+        response, ticket = self.post_prompt(
+            "generateContent",
+            prompt,
+            system_instruction,
+            timeout=timeout,
+            session_id=session_id,
+            deadline=deadline,
+            cancel_token=cancel_token,
+        )
+        result = response.json()
+        total_tokens = result.get("usageMetadata", {}).get("totalTokenCount")
+        if total_tokens:
+            gemini_scheduler.record_usage(ticket, total_tokens)
+        return result
+
+    def generate_text(
+        self, prompt, timeout=None, session_id=None, deadline=None, system_instruction=None, cancel_token=None
+    ):
+        """Call generateContent and return the text of the first candidate"""
+        return extract_text(
+            self.generate_content(
+                prompt,
+                timeout=timeout,
+                session_id=session_id,
+                deadline=deadline,
+                system_instruction=system_instruction,
+                cancel_token=cancel_token,
+            )
+        )
+
+    def stream_text(
+        self, prompt, timeout=None, session_id=None, deadline=None, system_instruction=None, cancel_token=None
+    ):
+        """Yield text chunks from streamGenerateContent as they arrive, closing the stream on cancel"""
+        response, _ = self.post_prompt(
+            "streamGenerateContent",
+            prompt,
+            system_instruction,
+            timeout=timeout,
+            params={"alt": "sse"},
+            stream=True,
+            session_id=session_id,
+            deadline=deadline,
+            cancel_token=cancel_token,
+        )
+        unregister = cancel_token.on_cancel(response.close) if cancel_token else (lambda: None)
+        try:
+            with response:
+                # chunk_size=None hands over each network chunk as soon as it arrives
+                for raw_line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if cancel_token is not None and cancel_token.cancelled:
+                        break
+                    if not raw_line or not raw_line.startswith("data:"):
+                        continue
+                    text = extract_text(json.loads(raw_line[len("data:"):].strip()))
+                    if text:
+                        yield text
+        except Exception:
+            if cancel_token is None or not cancel_token.cancelled:
+                raise
+        finally:
+            unregister()
+        if cancel_token is not None and cancel_token.cancelled:
+            record_reclaimed("http_aborted")
+            raise Cancelled(cancel_token.reason)
+
+
+def extract_text(response_json):
+    """Concatenated text parts of the first candidate of a Gemini response"""
+    candidates = response_json.get("candidates", [])
+    if candidates and "content" in candidates[0]:
+        parts = candidates[0]["content"].get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+    return ""
+
+
+# One client per API key, shared across threads so connections are reused
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_gemini_client(api_key=None):
+    """Return the shared GeminiClient for an API key (defaults to GEMINI_API_KEY)"""
+    api_key = api_key or os.getenv("GEMINI_API_KEY")
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = GeminiClient(api_key)
+            _clients[api_key] = client
+        return client
+
+
+def get_prefix_cache_stats():
+    """Prefix cache counters summed over every client"""
+    with _clients_lock:
+        clients = list(_clients.values())
+    # Zeroed so readers see the counters before the first client exists
+    totals = {"lookups": 0, "hits": 0}
+    for client in clients:
+        for key, value in client.prefix_cache.get_stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                totals[key] = value
+            else:
+                totals[key] = totals.get(key, 0) + value
+    totals["enabled"] = GEMINI_PREFIX_CACHE
+    totals["hit_ratio"] = round(totals["hits"] / totals["lookups"], 3) if totals["lookups"] else None
+    return totals
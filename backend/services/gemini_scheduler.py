@@ -0,0 +1,324 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from utils.cancellation import raise_if_cancelled
+from utils.state_store import shared_store
+
+logger = logging.getLogger(__name__)
+
+# Quotas for the Gemini project, every backend thread shares them; 0 turns a limit off.
+# Set them to the project's tier, a 429 from Gemini still pauses all calls either way
+GEMINI_RPM_LIMIT = int(os.getenv("GEMINI_RPM_LIMIT", "0"))
+GEMINI_TPM_LIMIT = int(os.getenv("GEMINI_TPM_LIMIT", "1000000"))
+# Calls whose request deadline is closer than this jump ahead of fair ordering
+URGENT_SLACK_SECONDS = float(os.getenv("GEMINI_URGENT_SLACK_SECONDS", "20"))
+QUOTA_WINDOW_SECONDS = 60.0
+# Rough response size added to the prompt estimate
+OUTPUT_TOKEN_ESTIMATE = 256
+
+
+def estimate_tokens(text):
+    """Rough Gemini token estimate, about 4 characters per token"""
+    return len(text or "") // 4 + OUTPUT_TOKEN_ESTIMATE
+
+
+class QuotaWaitTimeout(TimeoutError):
+    """Raised when a call could not get a quota slot before its deadline"""
+
+
+class QuotaTicket:
+    """A granted slot in the quota window, its token count can be corrected afterwards"""
+
+    def __init__(self, granted_at, tokens, waited, slot=None):
+        self.granted_at = granted_at
+        self.tokens = tokens
+        self.waited = waited
+        # The window's handle for the grant, used to correct its token count
+        self.slot = slot
+
+
+class _LocalWindow:
+    """Calls granted in the last minute by this process"""
+
+    def __init__(self):
+        self._slots = deque()  # [granted_at, tokens], oldest first
+        self._cooldown_until = 0.0
+
+    def _expire(self, now):
+        while self._slots and now - self._slots[0][0] >= QUOTA_WINDOW_SECONDS:
+            self._slots.popleft()
+
+    def try_grant(self, tokens, rpm_limit, tpm_limit):
+        """Record a call and return its slot when it fits the quotas, otherwise None"""
+        now = time.monotonic()
+        self._expire(now)
+        if now < self._cooldown_until or (rpm_limit and len(self._slots) >= rpm_limit):
+            return None
+        used = sum(slot[1] for slot in self._slots)
+        # A call bigger than the whole quota still runs once the window is empty
+        if tpm_limit and self._slots and used + tokens > tpm_limit:
+            return None
+        slot = [now, tokens]
+        self._slots.append(slot)
+        return slot
+
+    def set_tokens(self, slot, tokens):
+        slot[1] = tokens
+
+    def retry_in(self):
+        """Seconds until the window may have room again"""
+        now = time.monotonic()
+        if now < self._cooldown_until:
+            return self._cooldown_until - now
+        self._expire(now)
+        if self._slots:
+            return max(0.01, QUOTA_WINDOW_SECONDS - (now - self._slots[0][0]))
+        return 0.05
+
+    def cooldown(self, seconds):
+        self._cooldown_until = max(self._cooldown_until, time.monotonic() + seconds)
+
+    def usage(self):
+        """(requests, tokens, cooldown seconds left) of the current window"""
+        now = time.monotonic()
+        self._expire(now)
+        return len(self._slots), sum(slot[1] for slot in self._slots), max(0.0, self._cooldown_until - now)
+
+
+class _SharedWindow:
+    """Calls granted in the last minute by every process using the SQLiteStore.
+
+    The check and the grant run in one write transaction, so worker
+    processes can't overrun the project quota together.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def try_grant(self, tokens, rpm_limit, tpm_limit):
+        now = time.time()
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM gemini_quota WHERE granted_at <= ?", (now - QUOTA_WINDOW_SECONDS,))
+            row = conn.execute("SELECT until FROM gemini_cooldown WHERE id = 0").fetchone()
+            if row is not None and now < row[0]:
+                return None
+            count, used = conn.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM gemini_quota").fetchone()
+            if (rpm_limit and count >= rpm_limit) or (tpm_limit and count and used + tokens > tpm_limit):
+                return None
+            return conn.execute(
+                "INSERT INTO gemini_quota (granted_at, tokens) VALUES (?, ?)", (now, tokens)
+            ).lastrowid
+
+    def set_tokens(self, slot, tokens):
+        with self.store.transaction() as conn:
+            conn.execute("UPDATE gemini_quota SET tokens = ? WHERE id = ?", (tokens, slot))
+
+    def retry_in(self):
+        now = time.time()
+        row = self.store.query("SELECT until FROM gemini_cooldown WHERE id = 0")
+        if row and now < row[0][0]:
+            return row[0][0] - now
+        (oldest,) = self.store.query(
+            "SELECT MIN(granted_at) FROM gemini_quota WHERE granted_at > ?", (now - QUOTA_WINDOW_SECONDS,)
+        )[0]
+        if oldest is not None:
+            return max(0.01, QUOTA_WINDOW_SECONDS - (now - oldest))
+        return 0.05
+
+    def cooldown(self, seconds):
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT INTO gemini_cooldown (id, until) VALUES (0, ?) "
+                "ON CONFLICT (id) DO UPDATE SET until = MAX(until, excluded.until)",
+                (time.time() + seconds,),
+            )
+
+    def usage(self):
+        now = time.time()
+        count, used = self.store.query(
+            "SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM gemini_quota WHERE granted_at > ?",
+            (now - QUOTA_WINDOW_SECONDS,),
+        )[0]
+        row = self.store.query("SELECT until FROM gemini_cooldown WHERE id = 0")
+        return count, used, max(0.0, row[0][0] - now) if row else 0.0
+
+
+class _Waiter:
+    def __init__(self, seq, session_id, tokens, deadline, enqueued_at):
+        self.seq = seq
+        self.session_id = session_id
+        self.tokens = tokens
+        self.deadline = deadline
+        self.enqueued_at = enqueued_at
+
+
+class GeminiScheduler:
+    """Admits Gemini calls against requests-per-minute and tokens-per-minute quotas.
+
+    Calls that don't fit the current window queue up. Calls whose request is
+    close to its deadline go first (earliest deadline first); the rest are
+    served round-robin across sessions so one busy session can't take the
+    whole quota. With a SQLiteStore as state the quota window is shared by
+    every worker process on the host; queueing and fairness stay per process.
+    """
+
+    def __init__(
+        self,
+        rpm_limit=GEMINI_RPM_LIMIT,
+        tpm_limit=GEMINI_TPM_LIMIT,
+        urgent_slack=URGENT_SLACK_SECONDS,
+        state=None,
+    ):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.urgent_slack = urgent_slack
+
+        self._condition = threading.Condition()
+        self._window = _SharedWindow(state) if state is not None else _LocalWindow()
+        self._shared = state is not None
+        # Bumped on every change a waiter may be waiting for, so a wake-up
+        # between its grant attempt and its wait isn't lost
+        self._changes = 0
+        self._waiters = []
+        self._last_served = {}  # session_id -> monotonic time of its last grant
+        self._seq = itertools.count()
+
+        self._granted = 0
+        self._timed_out = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._max_queue_depth = 0
+
+    def _call_window(self, method, *args):
+        """Call a window method; the shared window's transactions run without the lock held.
+
+        A write transaction can wait on other processes, holding the lock
+        through it would stall every waiter, release and stats call here.
+        """
+        if self._shared:
+            return getattr(self._window, method)(*args)
+        with self._condition:
+            return getattr(self._window, method)(*args)
+
+    def _notify(self):
+        with self._condition:
+            self._changes += 1
+            self._condition.notify_all()
+
+    def _next_waiter(self, now):
+        urgent = [
+            w for w in self._waiters
+            if w.deadline is not None and w.deadline - now <= self.urgent_slack
+        ]
+        if urgent:
+            return min(urgent, key=lambda w: (w.deadline, w.seq))
+        return min(
+            self._waiters,
+            key=lambda w: (self._last_served.get(w.session_id, 0.0), w.seq),
+        )
+
+    def acquire(self, session_id=None, tokens=OUTPUT_TOKEN_ESTIMATE, deadline=None, timeout=None, cancel_token=None):
+        """Block until the call may be sent, returns a QuotaTicket.
+
+        deadline is the monotonic time by which the whole request must finish
+        and is used for prioritising; timeout bounds how long this call waits.
+        A cancelled cancel_token gives up the place in the queue.
+        """
+        enqueued_at = time.monotonic()
+        give_up_at = enqueued_at + timeout if timeout is not None else None
+        if deadline is not None:
+            give_up_at = deadline if give_up_at is None else min(give_up_at, deadline)
+
+        with self._condition:
+            waiter = _Waiter(next(self._seq), session_id, tokens, deadline, enqueued_at)
+            self._waiters.append(waiter)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._waiters))
+        try:
+            while True:
+                raise_if_cancelled(cancel_token)
+                with self._condition:
+                    changes = self._changes
+                    is_next = self._next_waiter(time.monotonic()) is waiter
+                if is_next:
+                    slot = self._call_window("try_grant", tokens, self.rpm_limit, self.tpm_limit)
+                    if slot is not None:
+                        break
+                now = time.monotonic()
+                if give_up_at is not None and now >= give_up_at:
+                    with self._condition:
+                        self._timed_out += 1
+                    raise QuotaWaitTimeout(
+                        f"No Gemini quota available within {now - enqueued_at:.1f}s"
+                    )
+                # Wake up at least every second so deadlines turning urgent, and
+                # grants released by other processes, are noticed
+                wait = min(self._call_window("retry_in"), 1.0)
+                with self._condition:
+                    if give_up_at is not None:
+                        wait = min(wait, give_up_at - time.monotonic())
+                    if self._changes == changes and wait > 0:
+                        self._condition.wait(wait)
+        finally:
+            with self._condition:
+                self._waiters.remove(waiter)
+            # Let the next waiter re-check now that the head of the queue changed
+            self._notify()
+
+        now = time.monotonic()
+        with self._condition:
+            waited = now - enqueued_at
+            ticket = QuotaTicket(now, tokens, waited, slot)
+            self._last_served[session_id] = now
+            if len(self._last_served) > 1024:
+                # Sessions not served within the window are equivalent to new ones
+                self._last_served = {
+                    sid: served for sid, served in self._last_served.items()
+                    if now - served < QUOTA_WINDOW_SECONDS
+                }
+            self._granted += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            if waited > 0.5:
+                logger.info("Gemini call for session %s waited %.1fs for quota", session_id, waited)
+            return ticket
+
+    def record_usage(self, ticket, tokens):
+        """Replace the estimate of a granted call with the token count Gemini reported"""
+        ticket.tokens = tokens
+        self._call_window("set_tokens", ticket.slot, tokens)
+        self._notify()
+
+    def cooldown(self, seconds):
+        """Pause all grants, used when Gemini answers 429 despite the local accounting"""
+        self._call_window("cooldown", seconds)
+
+    def forget_session(self, session_id):
+        """Drop fairness bookkeeping for a session that was cleaned up"""
+        with self._condition:
+            self._last_served.pop(session_id, None)
+
+    def get_stats(self):
+        requests, tokens, cooldown = self._call_window("usage")
+        with self._condition:
+            return {
+                "rpm_limit": self.rpm_limit,
+                "tpm_limit": self.tpm_limit,
+                "shared": self._shared,
+                "requests_last_minute": requests,
+                "tokens_last_minute": tokens,
+                "queue_depth": len(self._waiters),
+                "max_queue_depth": self._max_queue_depth,
+                "granted": self._granted,
+                "timed_out": self._timed_out,
+                "avg_wait_seconds": round(self._total_wait / self._granted, 3) if self._granted else 0.0,
+                "max_wait_seconds": round(self._max_wait, 3),
+                "cooldown_remaining_seconds": round(cooldown, 3),
+            }
+
+
+# Shared by every Gemini call in the process, and its quota by every worker with STATE_BACKEND=sqlite
+gemini_scheduler = GeminiScheduler(state=shared_store())
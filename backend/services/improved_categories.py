@@ -1,3 +1,5 @@
+import re
+
 PRODUCT_CATEGORIES = [
     # Technology & Electronics
     "Smartphones & Accessories",
@@ -58,6 +60,92 @@ PRODUCT_CATEGORIES = [
     "Pet Care & Health",
 ]
 
+# PRODUCT_CATEGORIES behind each favorite category id the profile form sends, most likely first
+FAVORITE_CATEGORY_IDS = {
+    "art-decor": ["Home Decor", "Art Supplies"],
+    "automotive": ["DIY Tools"],
+    "baby-maternity": [],
+    "bags-accessories": ["Bags & Accessories"],
+    "beauty": ["Beauty & Skincare", "Personal Care"],
+    "books-stationery": ["Books & E-readers"],
+    "cleaning": ["Home Organization"],
+    "diy-crafts": ["Craft Materials", "DIY Tools"],
+    "eco-friendly": ["Natural & Organic"],
+    "electronics": ["Smartphones & Accessories", "Laptops & Computing", "Audio & Headphones"],
+    "fashion": ["Women's Fashion", "Men's Fashion"],
+    "footwear": ["Athletic Wear"],
+    "gaming": ["Gaming & Consoles", "Video Games"],
+    "garden-outdoor": ["Outdoor Gear", "Camping & Hiking"],
+    "grocery": ["Gourmet Foods", "Coffee & Tea", "Specialty Foods"],
+    "health-wellness": ["Wellness Products", "Vitamins & Supplements", "Fitness Equipment"],
+    "home-kitchen": ["Kitchen & Dining", "Home Decor", "Furniture"],
+    "jewelry-watches": ["Watches & Jewelry"],
+    "luxury": ["Luxury Fashion"],
+    "music-instruments": ["Music & Instruments", "Musical Instruments"],
+    "office": ["Laptops & Computing", "Home Organization"],
+    "pet-supplies": ["Dog Supplies", "Cat Supplies", "Pet Care & Health"],
+    "smart-home": ["Smart Home Devices", "Smart Home Appliances"],
+    "sports-fitness": ["Sports Equipment", "Fitness Equipment", "Athletic Wear"],
+    "sustainable": ["Natural & Organic"],
+    "tech-accessories": ["Smartphones & Accessories", "Audio & Headphones"],
+    "tools-improvement": ["DIY Tools"],
+    "toys-kids": ["Board Games & Puzzles"],
+    "travel-luggage": ["Bags & Accessories", "Camping & Hiking"],
+    "vintage-collectibles": ["Collectibles"],
+}
+
+# Keyword mappings for different types of requests
+CATEGORY_KEYWORDS = {
+    'music': ['music', 'song', 'album', 'artist', 'band', 'vinyl', 'cd', 'spotify', 'apple music', 'headphones', 'speaker', 'audio'],
+    'gaming': ['game', 'gaming', 'console', 'controller', 'headset', 'pc gaming', 'playstation', 'xbox', 'nintendo'],
+    'sports': ['sport', 'basketball', 'football', 'cricket', 'fitness', 'exercise', 'workout', 'training', 'athletic'],
+    'tech': ['tech', 'technology', 'computer', 'laptop', 'phone', 'tablet', 'accessory', 'gadget', 'electronic'],
+    'fashion': ['clothes', 'fashion', 'clothing', 'shirt', 'dress', 'shoes', 'sneakers', 'outfit', 'style'],
+    'books': ['book', 'reading', 'novel', 'textbook', 'kindle', 'ebook', 'literature', 'author'],
+    'home': ['home', 'kitchen', 'furniture', 'decor', 'appliance', 'garden', 'outdoor', 'household'],
+    'automotive': ['car', 'automotive', 'vehicle', 'accessory', 'maintenance', 'parts', 'tools'],
+    'beauty': ['beauty', 'makeup', 'skincare', 'cosmetic', 'perfume', 'lotion', 'cream'],
+    'food': ['food', 'cooking', 'recipe', 'ingredient', 'snack', 'beverage', 'drink'],
+    'pet': ['pet', 'dog', 'cat', 'animal', 'pet food', 'toy', 'accessory'],
+    'baby': ['baby', 'infant', 'toddler', 'diaper', 'toy', 'clothing'],
+    'office': ['office', 'work', 'desk', 'stationery', 'paper', 'pen', 'notebook'],
+    'travel': ['travel', 'luggage', 'backpack', 'suitcase', 'trip', 'vacation'],
+    'art': ['art', 'craft', 'painting', 'drawing', 'creative', 'diy', 'hobby']
+}
+
+# PRODUCT_CATEGORIES that each CATEGORY_KEYWORDS group points to
+KEYWORD_GROUP_CATEGORIES = {
+    "music": ["Audio & Headphones", "Music & Instruments", "Musical Instruments"],
+    "gaming": ["Gaming & Consoles", "Video Games"],
+    "sports": ["Sports Equipment", "Fitness Equipment", "Athletic Wear", "Outdoor Gear"],
+    "tech": ["Laptops & Computing", "Smartphones & Accessories", "Smart Home Devices", "Audio & Headphones"],
+    "fashion": ["Men's Fashion", "Women's Fashion", "Athletic Wear", "Bags & Accessories"],
+    "books": ["Books & E-readers"],
+    "home": ["Home Decor", "Furniture", "Kitchen & Dining", "Home Organization"],
+    "automotive": ["DIY Tools"],
+    "beauty": ["Beauty & Skincare", "Personal Care"],
+    "food": ["Gourmet Foods", "Specialty Foods", "Coffee & Tea"],
+    "pet": ["Dog Supplies", "Cat Supplies", "Pet Care & Health"],
+    "baby": [],
+    "office": ["Laptops & Computing", "Home Organization"],
+    "travel": ["Bags & Accessories", "Outdoor Gear", "Camping & Hiking"],
+    "art": ["Art Supplies", "Craft Materials", "DIY Tools"],
+}
+
+def clean_category_name(category):
+    """Clean a Gemini category name for scraping, returns None if nothing usable is left"""
+    # Remove bullet points and clean the category name
+    clean_cat = category.replace("*", "").replace("  ", " ").strip()
+    # Remove brand examples in parentheses
+    clean_cat = re.sub(r'\s*\([^)]*\)', '', clean_cat)
+    # Remove "e.g." and similar text
+    clean_cat = re.sub(r'\s*e\.g\.,?\s*', '', clean_cat)
+    clean_cat = clean_cat.strip()
+    if clean_cat and len(clean_cat) > 2:
+        return clean_cat
+    return None
+
+
 # Shopping Input Fields
 SHOPPING_INPUT_FIELDS = {
     "occasion": [
@@ -0,0 +1,290 @@
+import re
+from collections import deque
+
+from services.improved_categories import (
+    CATEGORY_KEYWORDS,
+    FAVORITE_CATEGORY_IDS,
+    KEYWORD_GROUP_CATEGORIES,
+    PRODUCT_CATEGORIES,
+)
+from services.local_ranker import STOPWORDS
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Words in PRODUCT_CATEGORIES names that say little about what the user wants
+GENERIC_TERMS = {
+    "and", "accessories", "products", "equipment", "supplies", "care", "health",
+    "materials", "natural", "organic", "specialty", "personal", "home", "shows",
+    "tv", "smart", "men", "s", "women", "luxury",
+}
+
+# Words in a shopping request that describe the recipient or occasion, not the product
+FILLER_WORDS = {
+    "brother", "sister", "mum", "mom", "dad", "father", "mother", "friend", "wife",
+    "husband", "girlfriend", "boyfriend", "son", "daughter", "kids", "kid", "child",
+    "boss", "colleague", "who", "he", "she", "her", "him", "his", "them", "their",
+    "our", "we", "us", "loves", "love", "likes", "enjoys", "into", "nice", "good",
+    "great", "cool", "cheap", "present", "presents", "birthday", "christmas",
+    "anniversary", "wants", "under", "around", "budget", "about", "really", "very",
+}
+
+# Evidence weights by where a keyword was found; favorites and interests
+# only order categories the request gives equal evidence for
+REQUEST_WEIGHT = 1.0
+FAVORITE_WEIGHT = 0.3
+INTERESTS_WEIGHT = 0.2
+# Keyword groups spread their evidence over several PRODUCT_CATEGORIES
+GROUP_WEIGHT = 0.6
+GENERIC_WEIGHT = 0.3
+
+
+def normalize(text):
+    """Lowercase words separated by single spaces, padded so every word has a space on each side"""
+    return " " + " ".join(_WORD_RE.findall(str(text or "").lower())) + " "
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton matching whole-word keywords in a single pass over the text.
+
+    Built once from {keyword: payload}; search() yields (keyword, payload)
+    for every occurrence, regardless of how many keywords there are.
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for keyword, payload in keywords.items():
+            # Surrounding spaces restrict matches to whole words
+            self._insert(normalize(keyword), (keyword, payload))
+        self._build_failure_links()
+
+    def _insert(self, pattern, match):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(match)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def search(self, text):
+        node = 0
+        for char in normalize(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            yield from self._output[node]
+
+
+class IntentResult:
+    def __init__(self, categories, confidence, primary_group, matches):
+        self.categories = categories
+        self.confidence = confidence
+        self.primary_group = primary_group
+        self.matches = matches
+
+    def to_dict(self):
+        return {
+            "categories": self.categories,
+            "confidence": round(self.confidence, 3),
+            "primary_group": self.primary_group,
+            "matches": self.matches,
+        }
+
+
+def _keyword_variants(keyword):
+    """The keyword plus its simple singular/plural form"""
+    variants = {keyword}
+    if keyword.endswith("s") and len(keyword) > 3:
+        variants.add(keyword[:-1])
+    else:
+        variants.add(keyword + "s")
+    return variants
+
+
+def build_keyword_table():
+    """Map every keyword to the groups and PRODUCT_CATEGORIES it is evidence for"""
+    table = {}
+
+    def add(keyword, evidence):
+        for variant in _keyword_variants(keyword):
+            table.setdefault(variant, []).append(evidence)
+
+    for group, keywords in CATEGORY_KEYWORDS.items():
+        for keyword in keywords:
+            add(keyword, ("group", group, GROUP_WEIGHT))
+
+    # A word shared by several category names ("foods") says less than one
+    # naming a single category ("cat"), its evidence is split between them
+    term_categories = {}
+    for category in PRODUCT_CATEGORIES:
+        for term in set(_WORD_RE.findall(category.lower())):
+            term_categories.setdefault(term, []).append(category)
+    for term, categories in term_categories.items():
+        weight = GENERIC_WEIGHT if term in GENERIC_TERMS else 1.0
+        for category in categories:
+            add(term, ("category", category, weight / len(categories)))
+    return table
+
+
+class IntentClassifier:
+    """Maps shopping input and profile to PRODUCT_CATEGORIES without calling Gemini.
+
+    Keywords from CATEGORY_KEYWORDS and the words of PRODUCT_CATEGORIES are
+    compiled into one automaton. Categories are ranked by the evidence in
+    the shopping request; favorite categories and interests only break ties
+    between them, and fill the list only when the request matched nothing.
+    Confidence is high only when the request's evidence falls on one
+    keyword group, so requests mixing groups ("cat food") go to Gemini.
+    """
+
+    def __init__(self):
+        self.automaton = KeywordAutomaton(build_keyword_table())
+
+    def _collect(self, text, source_weight, scores, group_hits, matches):
+        for keyword, evidence in self.automaton.search(text):
+            matches.append(keyword)
+            for kind, target, weight in evidence:
+                if kind == "group":
+                    if group_hits is not None:
+                        group_hits.setdefault(target, set()).add(keyword)
+                    categories = KEYWORD_GROUP_CATEGORIES.get(target, [])
+                    for category in categories:
+                        scores[category] = scores.get(category, 0.0) + source_weight * weight / len(categories)
+                else:
+                    scores[target] = scores.get(target, 0.0) + source_weight * weight
+
+    def resolve_favorites(self, favorite_categories):
+        """PRODUCT_CATEGORIES for the profile's favorite categories, first choice of each favorite first.
+
+        The profile form sends ids ("pet-supplies"); names already in
+        PRODUCT_CATEGORIES are kept and other text goes to its best match.
+        """
+        choices = []
+        for favorite in favorite_categories or []:
+            if favorite in FAVORITE_CATEGORY_IDS:
+                choices.append(FAVORITE_CATEGORY_IDS[favorite])
+            elif favorite in PRODUCT_CATEGORIES:
+                choices.append([favorite])
+            else:
+                scores = {}
+                self._collect(favorite, REQUEST_WEIGHT, scores, None, [])
+                if scores:
+                    choices.append([max(scores, key=lambda c: (scores[c], -PRODUCT_CATEGORIES.index(c)))])
+        # Round-robin, so every favorite is represented before any gets a second category
+        resolved = []
+        for depth in range(max((len(c) for c in choices), default=0)):
+            resolved += [c[depth] for c in choices if depth < len(c)]
+        return list(dict.fromkeys(resolved))
+
+    def primary_group(self, shopping_request):
+        """CATEGORY_KEYWORDS group with the most distinct keyword hits in the request, or None"""
+        group_hits = {}
+        self._collect(shopping_request, REQUEST_WEIGHT, {}, group_hits, [])
+        return self._best_group(group_hits)
+
+    @staticmethod
+    def _best_group(group_hits):
+        if not group_hits:
+            return None
+        # Ties go to the group listed first, like the keyword scan this replaces
+        order = {group: i for i, group in enumerate(CATEGORY_KEYWORDS)}
+        return max(group_hits, key=lambda group: (len(group_hits[group]), -order[group]))
+
+    def classify(self, shopping_request, favorite_categories=(), interests="", brands="", limit=5):
+        request_scores = {}
+        group_hits = {}
+        matches = []
+        self._collect(shopping_request, REQUEST_WEIGHT, request_scores, group_hits, matches)
+
+        profile_scores = {}
+        for category in self.resolve_favorites(favorite_categories):
+            profile_scores[category] = profile_scores.get(category, 0.0) + FAVORITE_WEIGHT
+        self._collect(interests, INTERESTS_WEIGHT, profile_scores, None, [])
+
+        primary_group = self._best_group(group_hits)
+        if any(score > 0 for score in request_scores.values()):
+            # The request decides what to search: the profile only orders the
+            # categories it or its primary keyword group supports, it never adds
+            # unrelated favorites to a list Gemini may not get to check
+            supported = set(KEYWORD_GROUP_CATEGORIES.get(primary_group, []))
+            candidates = [
+                category for category in set(request_scores) | supported
+                if request_scores.get(category, 0.0) > 0 or category in supported
+            ]
+        else:
+            candidates = [category for category, score in profile_scores.items() if score > 0]
+        ranked = sorted(
+            candidates,
+            key=lambda category: (
+                # Rounded so float noise in the request evidence doesn't hide a tie
+                -round(request_scores.get(category, 0.0), 6),
+                -profile_scores.get(category, 0.0),
+                PRODUCT_CATEGORIES.index(category),
+            ),
+        )[:limit]
+
+        # Product words of the request; ones no keyword explains (e.g. "keyboard")
+        # are detail that only Gemini can turn into good categories
+        content_words = [
+            word for word in _WORD_RE.findall(str(shopping_request or "").lower())
+            if word not in STOPWORDS and word not in FILLER_WORDS
+        ]
+        matched_words = {word for keyword in matches for word in _WORD_RE.findall(keyword)}
+        coverage = (
+            sum(1 for word in content_words if word in matched_words) / len(content_words)
+            if content_words
+            else 0.0
+        )
+
+        # Share of the request evidence on the top category and the primary
+        # keyword group, scaled down when other groups matched too, when the
+        # request only had weak (generic or group) matches, or has words no
+        # keyword explains
+        total_request = sum(request_scores.values())
+        if total_request and ranked and request_scores.get(ranked[0], 0.0) > 0:
+            cluster = set(KEYWORD_GROUP_CATEGORIES.get(primary_group, [])) | {ranked[0]}
+            explained = sum(request_scores.get(category, 0.0) for category in cluster)
+            strength = min(1.0, max(request_scores.values()))
+            group_share = (
+                len(group_hits[primary_group]) / sum(len(hits) for hits in group_hits.values())
+                if primary_group
+                else 1.0
+            )
+            confidence = explained / total_request * strength * group_share * coverage ** 0.5
+        else:
+            confidence = 0.0
+
+        # The request's own product words make the most specific search
+        categories = list(ranked)
+        request_query = " ".join(dict.fromkeys(content_words))
+        if request_query and request_query not in (c.lower() for c in categories):
+            categories = [request_query] + categories[: limit - 1]
+        brand = (brands or "").split(",")[0].strip()
+        if brand and categories:
+            categories[0] = f"{brand} {categories[0]}"
+
+        return IntentResult(categories, confidence, primary_group, matches)
+
+
+# Compiled once at import, classification is read-only and thread safe
+intent_classifier = IntentClassifier()
@@ -0,0 +1,431 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from utils.cancellation import CancellationToken, record_reclaimed
+from utils.state_store import shared_store
+
+# Finished jobs are kept this long so clients can fetch their result
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "900"))
+MAX_JOBS = int(os.getenv("MAX_JOBS", "1000"))
+# A job another process stopped updating for this long is treated as failed (its worker died)
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+# How often waiters poll the shared store for jobs owned by another process
+JOB_POLL_SECONDS = 0.25
+
+# Pipeline stages in order, progress is reported against this list
+JOB_STAGES = ("queued", "categories", "scraping", "ranking", "completed")
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class Job:
+    """One shopping recommendation request and its progress through the pipeline"""
+
+    def __init__(self, session_id, request_data):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.request_data = request_data
+        self.status = "queued"
+        self.stage = "queued"
+        self.progress = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.http_status = None
+        self.future = None
+        self.deadline = None
+        # Spans of the pipeline run, set when the job is submitted
+        self.trace = None
+        # Correlation id its log records carry, the id of the HTTP request that started it
+        self.request_id = None
+        self.cancel_token = CancellationToken()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        # (id, event, data) in publish order, replayed to every stream subscriber
+        self._events = []
+        self._events_changed = threading.Condition()
+        # Set by a JobStore with shared state: on_change(job), on_event(job, event_id, event, data)
+        self.on_change = None
+        self.on_event = None
+        # Called from the publishing thread after every event, e.g. to wake an event loop
+        self._listeners = []
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def start(self):
+        """Mark the job running, returns False if it was cancelled or finished before it could start"""
+        with self._lock:
+            if self.status in FINISHED_STATUSES or self.cancel_token.cancelled:
+                return False
+            self.status = "running"
+            self.started_at = time.time()
+        self._changed()
+        return True
+
+    def publish(self, event, data):
+        """Append an event for stream subscribers"""
+        with self._events_changed:
+            event_id = len(self._events)
+            self._events.append((event_id, event, data))
+            self._events_changed.notify_all()
+        if self.on_event is not None:
+            self.on_event(self, event_id, event, data)
+        self._notify_listeners()
+
+    def add_listener(self, callback):
+        """Call callback() after every event and when the job finishes, returns a function that removes it"""
+        with self._lock:
+            self._listeners.append(callback)
+
+        def remove():
+            with self._lock:
+                if callback in self._listeners:
+                    self._listeners.remove(callback)
+
+        return remove
+
+    def _notify_listeners(self):
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    def events_since(self, last_id, timeout=None):
+        """Events after last_id, waiting up to timeout for new ones"""
+        with self._events_changed:
+            if len(self._events) <= last_id + 1 and not self._done.is_set():
+                self._events_changed.wait(timeout)
+            return self._events[last_id + 1:]
+
+    @property
+    def last_event_id(self):
+        with self._events_changed:
+            return len(self._events) - 1
+
+    def update(self, stage, **progress):
+        """Move the job to a pipeline stage, progress holds stage specific counters"""
+        with self._lock:
+            if self.status in FINISHED_STATUSES:
+                return
+            if stage != self.stage:
+                self.progress = {}
+            self.stage = stage
+            self.progress.update(progress)
+            snapshot = {"stage": stage, "progress": dict(self.progress)}
+        self._changed()
+        self.publish("progress", snapshot)
+
+    def finish(self, result, http_status=200, status=None):
+        with self._lock:
+            if self.status in FINISHED_STATUSES:
+                return
+            self.result = result
+            self.http_status = http_status
+            self.status = status or ("completed" if http_status < 400 else "failed")
+            self.stage = "completed" if self.status == "completed" else self.stage
+            self.finished_at = time.time()
+        self._changed()
+        self.publish("result", {"status": self.status, "http_status": http_status, "result": result})
+        self._done.set()
+        with self._events_changed:
+            self._events_changed.notify_all()
+        self._notify_listeners()
+
+    def cancel(self, reason="cancelled"):
+        """Stop the job: drop it from the queue or tell the running pipeline to stop.
+
+        Returns False if the job had already finished.
+        """
+        if self.finished or not self.cancel_token.cancel(reason):
+            return False
+        record_reclaimed("cancelled_requests")
+        if self.deadline is not None:
+            record_reclaimed("budget_seconds_reclaimed", max(0.0, self.deadline - time.monotonic()))
+        if self.future is None or self.future.cancel():
+            # Never started, nothing else will finish it
+            record_reclaimed("futures_dropped")
+            self.finish({"status": "cancelled", "message": "Request cancelled"}, 409, status="cancelled")
+        return True
+
+    def wait(self, timeout=None):
+        """Block until the job finishes, returns False on timeout"""
+        return self._done.wait(timeout)
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def to_dict(self, include_result=False):
+        with self._lock:
+            now = time.time()
+            data = {
+                "job_id": self.id,
+                "session_id": self.session_id,
+                "status": self.status,
+                "stage": self.stage,
+                "stage_index": JOB_STAGES.index(self.stage) if self.stage in JOB_STAGES else None,
+                "stages": list(JOB_STAGES),
+                "progress": dict(self.progress),
+                "elapsed_seconds": round((self.finished_at or now) - self.created_at, 3),
+            }
+            if self.started_at:
+                data["queued_seconds"] = round(self.started_at - self.created_at, 3)
+            if include_result and self.finished_at:
+                data["result"] = self.result
+            return data
+
+
+class RemoteJob:
+    """Read-only view of a job running in another worker process, loaded from the shared store.
+
+    Waiting and streaming poll the store; cancel() flags the job and its
+    owner stops it at the next progress update.
+    """
+
+    def __init__(self, state, row):
+        self.state = state
+        self.id, self.session_id, status, data, self.updated_at = row
+        self._data = json.loads(data)
+        self.status = status
+        self.result = self._data.pop("result", None)
+        self.http_status = self._data.pop("http_status", None)
+        self.future = None
+        self.deadline = None
+        # Traces stay in the worker process that ran the job
+        self.trace = None
+        if status not in FINISHED_STATUSES and time.time() - self.updated_at > JOB_STALE_SECONDS:
+            self.status = self._data["status"] = "failed"
+            self.result = {"status": "error", "message": "Request processing failed"}
+            self.http_status = 500
+
+    @classmethod
+    def load(cls, state, job_id):
+        rows = state.query(
+            "SELECT id, session_id, status, data, updated_at FROM jobs WHERE id = ?", (job_id,)
+        )
+        return cls(state, rows[0]) if rows else None
+
+    @property
+    def stage(self):
+        return self._data.get("stage")
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def refresh(self):
+        """Reload the job from the store"""
+        fresh = RemoteJob.load(self.state, self.id)
+        if fresh is not None:
+            self.__dict__.update(fresh.__dict__)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.finished:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(JOB_POLL_SECONDS)
+            self.refresh()
+        return True
+
+    def _events_after(self, last_id):
+        rows = self.state.query(
+            "SELECT event_id, event, data FROM job_events WHERE job_id = ? AND event_id > ? ORDER BY event_id",
+            (self.id, last_id),
+        )
+        return [(event_id, event, json.loads(data)) for event_id, event, data in rows]
+
+    def events_since(self, last_id, timeout=None):
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            events = self._events_after(last_id)
+            if events or self.finished or time.monotonic() >= deadline:
+                return events
+            time.sleep(JOB_POLL_SECONDS)
+            self.refresh()
+
+    @property
+    def last_event_id(self):
+        rows = self.state.query("SELECT MAX(event_id) FROM job_events WHERE job_id = ?", (self.id,))
+        return rows[0][0] if rows[0][0] is not None else -1
+
+    def cancel(self, reason="cancelled"):
+        if self.finished:
+            return False
+        with self.state.transaction() as conn:
+            flagged = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND finished_at IS NULL", (self.id,)
+            ).rowcount
+        return bool(flagged)
+
+    def to_dict(self, include_result=False):
+        data = dict(self._data)
+        data["status"] = self.status
+        if include_result and self.finished:
+            data["result"] = self.result
+        return data
+
+
+class JobStore:
+    """Jobs by id and the latest job of each session, finished jobs expire after ttl.
+
+    With shared state every job is mirrored to the store, so any worker
+    process can report on, stream or cancel it.
+    """
+
+    def __init__(self, ttl=JOB_TTL_SECONDS, max_jobs=MAX_JOBS, state=None):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.state = state
+        self._jobs = {}
+        self._latest = {}  # session_id -> job id
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _save(self, job):
+        """Mirror a job to the shared store and pick up cancellation requested by other processes"""
+        data = job.to_dict(include_result=True)
+        data["http_status"] = job.http_status
+        now = time.time()
+        with self.state.transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, session_id, status, data, created_at, updated_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                "status = excluded.status, data = excluded.data, "
+                "updated_at = excluded.updated_at, finished_at = excluded.finished_at",
+                (job.id, job.session_id, job.status, json.dumps(data, default=str),
+                 job.created_at, now, job.finished_at),
+            )
+            (cancel_requested,) = conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job.id,)
+            ).fetchone()
+        if cancel_requested and not job.finished:
+            job.cancel("cancelled from another worker")
+
+    def _save_event(self, job, event_id, event, data):
+        with self.state.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_events (job_id, event_id, event, data) VALUES (?, ?, ?, ?)",
+                (job.id, event_id, event, json.dumps(data, default=str)),
+            )
+
+    def _prune_state(self, now):
+        with self.state.transaction() as conn:
+            expired = "SELECT id FROM jobs WHERE COALESCE(finished_at, updated_at) < ?"
+            conn.execute(f"DELETE FROM job_events WHERE job_id IN ({expired})", (now - self.ttl,))
+            conn.execute(f"DELETE FROM jobs WHERE id IN ({expired})", (now - self.ttl,))
+
+    def _prune(self, now):
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and now - job.finished_at > self.ttl
+        ]
+        # Over the cap: drop the oldest finished jobs first
+        if len(self._jobs) - len(expired) > self.max_jobs:
+            finished = sorted(
+                (job for job in self._jobs.values() if job.finished_at and job.id not in expired),
+                key=lambda job: job.finished_at,
+            )
+            expired += [job.id for job in finished[: len(self._jobs) - len(expired) - self.max_jobs]]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._latest.get(job.session_id) == job_id:
+                del self._latest[job.session_id]
+
+    def create(self, session_id, request_data):
+        job = Job(session_id, request_data)
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._jobs[job.id] = job
+            self._latest[session_id] = job.id
+            self._created += 1
+        if self.state is not None:
+            self._prune_state(now)
+            job.on_change = self._save
+            job.on_event = self._save_event
+            self._save(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.state is not None and job_id:
+            job = RemoteJob.load(self.state, job_id)
+        return job
+
+    def _latest_remote(self, session_id):
+        rows = self.state.query(
+            "SELECT id, session_id, status, data, updated_at FROM jobs "
+            "WHERE session_id = ? ORDER BY created_at DESC LIMIT 1",
+            (session_id,),
+        )
+        return RemoteJob(self.state, rows[0]) if rows else None
+
+    def latest_for_session(self, session_id):
+        if self.state is not None:
+            latest = self._latest_remote(session_id)
+            if latest is None:
+                return None
+            with self._lock:
+                return self._jobs.get(latest.id, latest)
+        with self._lock:
+            job_id = self._latest.get(session_id)
+            return self._jobs.get(job_id) if job_id else None
+
+    def running_elsewhere(self, session_id):
+        """Unfinished job of the session owned by another worker process, or None"""
+        if self.state is None:
+            return None
+        latest = self._latest_remote(session_id)
+        with self._lock:
+            if latest is None or latest.finished or latest.id in self._jobs:
+                return None
+        return latest
+
+    def discard(self, job_id):
+        """Forget a job that was never started"""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is not None and self._latest.get(job.session_id) == job_id:
+                del self._latest[job.session_id]
+        if self.state is not None:
+            with self.state.transaction() as conn:
+                conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def forget_session(self, session_id):
+        """Drop the session's jobs, cancelling any that are still running"""
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if j.session_id == session_id]
+            for job in jobs:
+                del self._jobs[job.id]
+            self._latest.pop(session_id, None)
+        for job in jobs:
+            job.cancel("session cleaned up")
+        if self.state is not None:
+            # Detached from the session and flagged, so owners in other processes stop them too
+            with self.state.transaction() as conn:
+                conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1, session_id = NULL WHERE session_id = ?",
+                    (session_id,),
+                )
+
+    def get_stats(self):
+        with self._lock:
+            by_status = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            stats = {"created": self._created, "stored": len(self._jobs), "by_status": by_status}
+        if self.state is not None:
+            stats["shared"] = dict(self.state.query("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return stats
+
+
+# Shared by every request handler in the process
+job_store = JobStore(state=shared_store())
@@ -0,0 +1,254 @@
+import math
+import re
+from collections import Counter
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words that carry no signal when matching product titles against shopping input
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "as", "at", "be", "best", "buy", "by",
+    "for", "from", "get", "gift", "i", "in", "is", "it", "like", "looking",
+    "me", "my", "need", "new", "of", "on", "or", "some", "something", "that",
+    "the", "this", "to", "want", "with", "would", "you", "your",
+}
+
+
+def tokenize(text):
+    """Lowercase word tokens of a text with stopwords removed"""
+    if not text:
+        return []
+    return [t for t in _TOKEN_RE.findall(str(text).lower()) if t not in STOPWORDS]
+
+
+def parse_budget_range(budget_range):
+    """Parse a 'low-high' budget string into a (low, high) tuple, or None if it can't be parsed"""
+    if not budget_range:
+        return None
+    try:
+        low, high = (
+            str(budget_range)
+            .replace("€", "")
+            .replace("$", "")
+            .replace("£", "")
+            .split("-")
+        )
+        low = float(low.strip())
+        high = float(high.strip())
+    except (ValueError, TypeError):
+        return None
+    if low > high:
+        low, high = high, low
+    return low, high
+
+
+def budget_fit(price, budget):
+    """Score in [0, 1] for how well a price fits a (low, high) budget"""
+    if budget is None or price is None:
+        return 0.5
+    low, high = budget
+    if low <= price <= high:
+        return 1.0
+    # Decay smoothly with the distance outside the range, relative to its width
+    width = max(high - low, 1.0)
+    distance = low - price if price < low else price - high
+    return math.exp(-distance / width)
+
+
+def rating_value(product):
+    """Numeric rating of a scraped product clamped to [0, 5], or None"""
+    rating = product.get("average_rating", product.get("rating"))
+    if rating is None:
+        return None
+    try:
+        rating_clean = "".join(c for c in str(rating) if c.isdigit() or c == ".")
+        return min(max(float(rating_clean), 0.0), 5.0) if rating_clean else None
+    except ValueError:
+        return None
+
+
+def shortlist_candidates(products, query, budget_range=None, k=10, min_rating=3.5):
+    """Keep the k most promising products using a cheap local score.
+
+    The score is the share of query tokens found in the title, plus a bonus
+    for prices inside the budget and ratings at or above min_rating. The
+    original order is kept for the products that survive.
+    """
+    if k is None or len(products) <= k:
+        return list(products)
+
+    query_tokens = set(tokenize(query))
+    budget = parse_budget_range(budget_range)
+    scored = []
+    for index, product in enumerate(products):
+        title_tokens = set(tokenize(product.get("title", "")))
+        overlap = len(query_tokens & title_tokens) / len(query_tokens) if query_tokens else 0.0
+
+        price = product.get("price_value")
+        in_budget = budget is None or price is None or budget[0] <= price <= budget[1]
+
+        rating = rating_value(product)
+        rated_ok = rating is None or rating >= min_rating
+
+        score = overlap + (0.5 if in_budget else 0.0) + (0.25 if rated_ok else 0.0)
+        scored.append((score, index))
+
+    keep = sorted(scored, key=lambda item: (-item[0], item[1]))[:k]
+    return [products[index] for index in sorted(index for _, index in keep)]
+
+
+class LocalRanker:
+    """Deterministic product ranker used as a fast path next to the Gemini ranking call.
+
+    The score is a weighted sum of BM25 title relevance against the shopping
+    input and interests, budget fit, rating and category priority.
+    """
+
+    DEFAULT_WEIGHTS = {"text": 0.45, "budget": 0.25, "rating": 0.15, "category": 0.15}
+    # Title relevance (BM25 relative to the best title) needed for each wording of the reasoning
+    STRONG_MATCH = 0.6
+    PARTIAL_MATCH = 0.25
+
+    def __init__(self, k1=1.2, b=0.75, weights=None):
+        self.k1 = k1
+        self.b = b
+        self.weights = dict(self.DEFAULT_WEIGHTS)
+        if weights:
+            self.weights.update(weights)
+
+    def bm25_scores(self, query_tokens, documents):
+        """BM25 score of each tokenized document against the query tokens"""
+        n_docs = len(documents)
+        if not n_docs or not query_tokens:
+            return [0.0] * n_docs
+
+        avg_len = sum(len(doc) for doc in documents) / n_docs or 1.0
+        doc_freq = Counter()
+        for doc in documents:
+            doc_freq.update(set(doc))
+
+        query_counts = Counter(query_tokens)
+        scores = []
+        for doc in documents:
+            term_freq = Counter(doc)
+            norm = self.k1 * (1 - self.b + self.b * len(doc) / avg_len)
+            score = 0.0
+            for term, query_weight in query_counts.items():
+                tf = term_freq.get(term)
+                if not tf:
+                    continue
+                df = doc_freq[term]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                score += query_weight * idf * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def score_products(
+        self,
+        user_input,
+        user_profile_details,
+        products,
+        priority_keywords=None,
+        category_order=None,
+    ):
+        """Return (score, product) pairs for every product, highest score first.
+
+        priority_keywords are the keywords of the detected primary category;
+        category_order lists the searched categories in priority order.
+        """
+        scored = self._score(user_input, user_profile_details, products, priority_keywords, category_order)
+        return [(score, product) for score, _, product in scored]
+
+    def _score(self, user_input, user_profile_details, products, priority_keywords, category_order):
+        # (score, title relevance, product) triples, highest score first
+        profile = user_profile_details or {}
+        query_tokens = tokenize(user_input) + tokenize(profile.get("interests", ""))
+        documents = [tokenize(p.get("title", "")) for p in products]
+        text_scores = self.bm25_scores(query_tokens, documents)
+        max_text = max(text_scores) if text_scores else 0.0
+
+        budget = parse_budget_range(profile.get("budget_range"))
+        keywords = [k.lower() for k in (priority_keywords or [])]
+        category_rank = {c: i for i, c in enumerate(category_order or [])}
+
+        scored = []
+        for index, product in enumerate(products):
+            text = text_scores[index] / max_text if max_text > 0 else 0.0
+
+            rating = rating_value(product)
+            rating_score = rating / 5.0 if rating is not None else 0.4
+
+            category_score = 0.0
+            title_lower = product.get("title", "").lower()
+            if keywords and any(k in title_lower for k in keywords):
+                category_score = 1.0
+            elif product.get("category") in category_rank:
+                position = category_rank[product["category"]]
+                category_score = 0.5 / (1 + position)
+
+            score = (
+                self.weights["text"] * text
+                + self.weights["budget"] * budget_fit(product.get("price_value"), budget)
+                + self.weights["rating"] * rating_score
+                + self.weights["category"] * category_score
+            )
+            scored.append((score, index, text, product))
+
+        # Ties keep the scrape order so the ranking is deterministic
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, text, product) for score, _, text, product in scored]
+
+    def rank(
+        self,
+        user_input,
+        user_profile_details,
+        products,
+        priority_keywords=None,
+        category_order=None,
+        limit=None,
+    ):
+        """Rank products and return them in the same shape as parse_ai_recommendations"""
+        scored = self._score(user_input, user_profile_details, products, priority_keywords, category_order)
+        if limit is not None:
+            scored = scored[:limit]
+
+        budget = parse_budget_range((user_profile_details or {}).get("budget_range"))
+        recommendations = []
+        for score, relevance, product in scored:
+            recommendations.append(
+                {
+                    "title": product.get("title", ""),
+                    "url": product.get("url", ""),
+                    "price": product.get("price_value") or 0.0,
+                    "rating": rating_value(product) or 0.0,
+                    "image_url": product.get("image_url", ""),
+                    "reasoning": self.explain(product, budget, relevance),
+                    "score": round(score, 4),
+                }
+            )
+        return recommendations
+
+    def explain(self, product, budget, relevance=0.0):
+        """Short human readable reasoning for a locally ranked product.
+
+        Only claims a match with the request when the title relevance
+        (0 to 1, relative to the best title) earns it.
+        """
+        reasons = []
+        if relevance >= self.STRONG_MATCH:
+            reasons.append("strong match for your request")
+        elif relevance >= self.PARTIAL_MATCH:
+            reasons.append("related to your request")
+        price = product.get("price_value")
+        if budget is not None and price is not None and budget[0] <= price <= budget[1]:
+            reasons.append("within your budget")
+        rating = rating_value(product)
+        if rating is not None and rating >= 4.0:
+            reasons.append(f"highly rated ({rating:.1f}/5)")
+        if not reasons:
+            reasons.append("from a category you searched")
+        text = ", ".join(reasons)
+        return text[0].upper() + text[1:] + "."
+
+
+# Shared instance, the ranker holds no per-request state
+local_ranker = LocalRanker()
@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+
+from services.improved_categories import PRODUCT_CATEGORIES, clean_category_name
+from services.intent_classifier import intent_classifier
+from services.scrape_scheduler import scrape_category, scrape_scheduler
+from utils.cancellation import CancellationToken, Cancelled
+from utils.domain_gen import get_amazon_domain
+
+logger = logging.getLogger(__name__)
+
+# Warm-up after /api/user-info, its scrapes run on the scrape scheduler's background queue
+# so they never compete with live requests
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "true").lower() in ("1", "true", "yes")
+PRECOMPUTE_CATEGORIES = int(os.getenv("PRECOMPUTE_CATEGORIES", "3"))
+# Same page size fetch_category_products asks for, so the warmed search cache entries get hit
+WARM_RESULTS_PER_CATEGORY = 1
+
+_jobs = {}  # session_id -> CancellationToken of its warm-up
+_results = {}  # session_id -> precomputed values
+_lock = threading.Lock()
+_stats = {"started": 0, "completed": 0, "cancelled": 0, "skipped_busy": 0, "failed": 0, "warmed_products": 0}
+
+
+def _count(key, amount=1):
+    with _lock:
+        _stats[key] += amount
+
+
+def candidate_categories(user_data, limit=PRECOMPUTE_CATEGORIES):
+    """Categories the user is likely to search for, from favorite categories and interests.
+
+    These are PRODUCT_CATEGORIES names cleaned like the live pipeline's, the
+    same strings a request classified locally searches for, so the warmed
+    search cache entries can be hit. The profile's favorite category ids
+    are never searched as such.
+    """
+    favorites = user_data.get("favorite_categories") or []
+    categories = intent_classifier.resolve_favorites(favorites)
+    if user_data.get("interests"):
+        categories += [
+            category
+            for category in intent_classifier.classify(user_data["interests"], favorite_categories=favorites).categories
+            # The first entry is the interests text itself, no request will search that
+            if category in PRODUCT_CATEGORIES
+        ]
+    return list(dict.fromkeys(c for c in map(clean_category_name, categories) if c))[:limit]
+
+
+def _finish(session_id, token):
+    with _lock:
+        if _jobs.get(session_id) is token:
+            del _jobs[session_id]
+
+
+def _warm_next(session_id, user_data, result, token, is_busy, started):
+    """Queue the search of the next unwarmed category, chained from the previous one's callback"""
+    index = len(result["warmed_categories"])
+    if token.cancelled:
+        _count("cancelled")
+        _finish(session_id, token)
+        return
+    if index == len(result["categories"]):
+        _count("completed")
+        _finish(session_id, token)
+        logger.info(
+            "Precomputed session %s in %.1fs: %s",
+            session_id, time.monotonic() - started, result["warmed_categories"],
+        )
+        return
+    # Live requests come first, give up the warm-up rather than slow them down
+    if is_busy is not None and is_busy():
+        _count("skipped_busy")
+        _finish(session_id, token)
+        return
+    category = result["categories"][index]
+
+    def on_done(future):
+        try:
+            _, products = future.result()
+        except Cancelled:
+            _count("cancelled")
+            _finish(session_id, token)
+            return
+        except Exception as e:
+            _count("failed")
+            _finish(session_id, token)
+            logger.warning("Precompute failed for session %s: %s", session_id, e)
+            return
+        _count("warmed_products", len(products))
+        result["warmed_categories"].append(category)
+        _warm_next(session_id, user_data, result, token, is_busy, started)
+
+    scrape_category(
+        scrape_scheduler,
+        category,
+        result["amazon_domain"],
+        num_results=WARM_RESULTS_PER_CATEGORY,
+        budget_range=user_data.get("budget_range"),
+        session_id=session_id,
+        cancel_token=token,
+        background=True,
+    ).add_done_callback(on_done)
+
+
+def start_precompute(session_id, user_data, is_busy=None):
+    """Start warming caches for a session, replacing any warm-up already running for it.
+
+    Categories are searched one after another as background scrapes;
+    is_busy is polled between them and when it returns True the warm-up stops.
+    """
+    if not PRECOMPUTE_ENABLED:
+        return
+    cancel_precompute(session_id)
+    token = CancellationToken()
+    with _lock:
+        _stats["started"] += 1
+        _jobs[session_id] = token
+    try:
+        result = {
+            "amazon_domain": get_amazon_domain(user_data.get("user_location", "")),
+            "categories": candidate_categories(user_data),
+            "warmed_categories": [],
+        }
+    except Exception as e:
+        _count("failed")
+        _finish(session_id, token)
+        logger.warning("Precompute failed for session %s: %s", session_id, e)
+        return
+    with _lock:
+        if _jobs.get(session_id) is not token:
+            return
+        _results[session_id] = result
+    _warm_next(session_id, user_data, result, token, is_busy, time.monotonic())
+
+
+def get_precomputed(session_id):
+    """Values computed for the session so far, or an empty dict"""
+    with _lock:
+        return dict(_results.get(session_id, {}))
+
+
+def cancel_precompute(session_id):
+    """Stop the session's warm-up and drop what it computed"""
+    with _lock:
+        job = _jobs.pop(session_id, None)
+        _results.pop(session_id, None)
+    if job is not None:
+        # Queued scrapes are dropped, the running one stops at its next check
+        job.cancel("precompute cancelled")
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats, running=len(_jobs), sessions=len(_results))
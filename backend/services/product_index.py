@@ -0,0 +1,142 @@
+import math
+import re
+from collections import Counter
+from urllib.parse import urlsplit
+
+from services.local_ranker import tokenize
+
+_ASIN_RE = re.compile(r"/(?:dp|gp/product)/([A-Z0-9]{10})", re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# A fuzzy match must cover this weighted share of both titles
+FUZZY_MIN_SIMILARITY = 0.7
+# Fuzzy matches must share at least this many tokens, short titles mis-join too easily
+FUZZY_MIN_TOKENS = 2
+# Truncated titles ("Acme Pro Wireless Headphones with...") match a product whose
+# title contains this weighted share of theirs, if they have enough tokens
+CONTAINMENT_MIN_SIMILARITY = 0.9
+CONTAINMENT_MIN_TOKENS = 3
+_ELLIPSIS_RE = re.compile(r"(\.\.\.|…)\s*$")
+
+
+def extract_asin(url):
+    """Amazon product id from a /dp/ or /gp/product/ URL, or None"""
+    match = _ASIN_RE.search(url or "")
+    return match.group(1).upper() if match else None
+
+
+def normalize_url(url):
+    """URL without scheme, query, fragment or trailing slash, lowercased host"""
+    if not url:
+        return None
+    try:
+        parts = urlsplit(url if "://" in url else f"//{url}")
+    except ValueError:
+        # Placeholders like "[Product URL]" from the ranking output
+        return None
+    return f"{parts.netloc.lower()}{parts.path.rstrip('/')}" or None
+
+
+def title_key(title):
+    return " ".join(_WORD_RE.findall(str(title or "").lower())) or None
+
+
+class ProductJoinIndex:
+    """Resolves ranked results (title, url) back to the scraped products of a request.
+
+    Built once from the scraped products. Lookups go by ASIN, then
+    normalized URL, then normalized title, and finally a fuzzy match over an
+    inverted token index that only looks at products sharing a token with
+    the title, weighting rare tokens higher.
+    """
+
+    def __init__(self, products):
+        self.products = [p for p in products if p]
+        self.by_asin = {}
+        self.by_url = {}
+        self.by_title = {}
+        self.postings = {}  # token -> indexes of products whose title contains it
+        self.stats = Counter()
+
+        for i, product in enumerate(self.products):
+            asin = product.get("asin") or extract_asin(product.get("url"))
+            if asin:
+                self.by_asin.setdefault(asin, i)
+            url = normalize_url(product.get("url"))
+            if url:
+                self.by_url.setdefault(url, i)
+            key = title_key(product.get("title"))
+            if key:
+                self.by_title.setdefault(key, i)
+            for token in set(tokenize(product.get("title"))):
+                self.postings.setdefault(token, []).append(i)
+
+        total = len(self.products)
+        self.idf = {
+            token: math.log(1 + total / len(indexes)) for token, indexes in self.postings.items()
+        }
+        self.weights = [
+            sum(self.idf[token] for token in set(tokenize(product.get("title"))))
+            for product in self.products
+        ]
+
+    @staticmethod
+    def _title_tokens(title):
+        """Tokens of a ranked title, without the cut-off last word of a title ending in an ellipsis"""
+        title = str(title or "")
+        ellipsis = _ELLIPSIS_RE.search(title)
+        if ellipsis is None:
+            return set(tokenize(title))
+        title = title[:ellipsis.start()]
+        tokens = tokenize(title)
+        if tokens and title[-1:].isalnum():
+            tokens = tokens[:-1]
+        return set(tokens)
+
+    def _fuzzy(self, title):
+        tokens = self._title_tokens(title)
+        if len(tokens) < FUZZY_MIN_TOKENS:
+            return None
+        shared = Counter()
+        shared_count = Counter()
+        for token in tokens:
+            for i in self.postings.get(token, ()):
+                shared[i] += self.idf[token]
+                shared_count[i] += 1
+        if not shared:
+            return None
+
+        # Tokens the scraped titles never use still count against the match
+        title_weight = sum(self.idf.get(token, math.log(1 + len(self.products))) for token in tokens)
+        # Ranked by (similarity accepted, containment accepted, similarity): a full
+        # match beats a product that merely contains a truncated title
+        best, best_rank = None, None
+        for i, overlap in shared.items():
+            if shared_count[i] < FUZZY_MIN_TOKENS:
+                continue
+            similarity = 2 * overlap / (title_weight + self.weights[i])
+            contained = (
+                len(tokens) >= CONTAINMENT_MIN_TOKENS
+                and overlap / title_weight >= CONTAINMENT_MIN_SIMILARITY
+            )
+            if similarity < FUZZY_MIN_SIMILARITY and not contained:
+                continue
+            rank = (similarity >= FUZZY_MIN_SIMILARITY, contained, similarity)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = i, rank
+        return best
+
+    def lookup(self, result):
+        """Scraped product for a ranked result, or None"""
+        url = result.get("url")
+        asin = extract_asin(url)
+        match = self.by_asin.get(asin) if asin else None
+        how = "asin"
+        if match is None:
+            match, how = self.by_url.get(normalize_url(url)), "url"
+        if match is None:
+            match, how = self.by_title.get(title_key(result.get("title"))), "title"
+        if match is None:
+            match, how = self._fuzzy(result.get("title")), "fuzzy"
+        self.stats[how if match is not None else "unmatched"] += 1
+        return self.products[match] if match is not None else None
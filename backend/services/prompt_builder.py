@@ -1,12 +1,33 @@
+import logging
 import requests
 import os
-
-
-def construct_prompt(user_input, user_location, profile_details):
-    prompt = (
-        "You are a helpful shopping assistant. Given the user's input below, along with their location and profile details, "
-        "analyze their interests, preferences, and needs. Consider all these details carefully to identify up to 10 distinct product categories "
-        "that would be most relevant and appealing for them to shop for. Respond ONLY with a bullet point list of the product categories, no introduction or explanation.\n\n"
+from services.gemini_client import get_gemini_client
+
+logger = logging.getLogger(__name__)
+
+
+# Static part of the category prompt, registered with Gemini once and reused by every call
+CATEGORY_INSTRUCTIONS = (
+    "You are a helpful shopping assistant. Given the user's input, along with their location and profile details, "
+    "analyze their interests, preferences, and needs. Consider all these details carefully to identify up to 10 distinct product categories "
+    "that would be most relevant and appealing for them to shop for. Respond ONLY with a bullet point list of the product categories, no introduction or explanation.\n\n"
+    "Keep the product categories relevant to the user's input and profile details. "
+    "Make sure to include a variety of categories that reflect the user's interests and preferences. "
+    "The categories should be distinct and not overlap with each other. "
+    "Additionally, ensure that the categories are suitable for the user's location and budget range. "
+    "Additionally, keep the categories sufficiently detailed without being too specific. "
+    "Avoid using vague terms like 'clothes' or 'electronics'. "
+    "IMPORTANT: If the user's input mentions specific brands (e.g., Nike, Dell, Gucci, Kindle), you MUST include those brand names explicitly in the relevant categories (e.g., 'Nike trainers', 'Gucci clothing', 'Kindle e-readers'). "
+    "Also, try to identify other brands the user might like based on their interests and preferences, and include those brand names in the categories where applicable. "
+    "Make sure to mention brand names clearly and explicitly in the categories when applicable. "
+    "However, maintain a balance between specific brand mentions and diverse categories, so as not to overemphasize brands. "
+    "Adhere to these guidelines\n\n"
+)
+
+
+def construct_prompt_suffix(user_input, user_location, profile_details):
+    """Per-request part of the category prompt, sent after CATEGORY_INSTRUCTIONS"""
+    return (
         f'User input: "{user_input}"\n\n'
         f"User location: {user_location}\n\n"
         "User profile details:\n"
@@ -17,55 +38,102 @@ def construct_prompt(user_input, user_location, profile_details):
         f"Interests or hobbies: {profile_details.get('interests_or_hobbies', '')}\n"
         f"Preferred shopping method: {profile_details.get('preferred_shopping_method', '')}\n"
         "Generate a list of product categories based on the above information:\n\n"
-        "Keep the product categories relevant to the user's input and profile details. "
-        "Make sure to include a variety of categories that reflect the user's interests and preferences. "
-        "The categories should be distinct and not overlap with each other. "
-        "Additionally, ensure that the categories are suitable for the user's location and budget range. "
-        "Additionally, keep the categories sufficiently detailed without being too specific. "
-        "Avoid using vague terms like 'clothes' or 'electronics'. "
-        "IMPORTANT: If the user's input mentions specific brands (e.g., Nike, Dell, Gucci, Kindle), you MUST include those brand names explicitly in the relevant categories (e.g., 'Nike trainers', 'Gucci clothing', 'Kindle e-readers'). "
-        "Also, try to identify other brands the user might like based on their interests and preferences, and include those brand names in the categories where applicable. "
-        "Make sure to mention brand names clearly and explicitly in the categories when applicable. "
-        "However, maintain a balance between specific brand mentions and diverse categories, so as not to overemphasize brands. "
-        "Adhere to these guidelines\n\n"
     )
-    return prompt
-
-
-def get_gemini_categories(api_key, prompt):
-    print("Constructed prompt:\n")
-    print(prompt)
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-    headers = {"Content-Type": "application/json"}
-
-    data = {"contents": [{"parts": [{"text": prompt}]}]}
-
-    response = requests.post(url, headers=headers, json=data)
-    response.raise_for_status()
-    response_json = response.json()
-    candidates = response_json.get("candidates", [])
-    if candidates and "content" in candidates[0]:
-        parts = candidates[0]["content"].get("parts", [])
-        if parts:
-            text = parts[0].get("text", "")
-            categories = [
-                line.strip("0123456789. \t-")
-                for line in text.splitlines()
-                if line.strip()
-            ]
-            print("Generated categories:")
-            for category in categories:
-                print(category)
-            return categories
+
+
+def construct_prompt(user_input, user_location, profile_details):
+    """Full category prompt as a single text"""
+    return CATEGORY_INSTRUCTIONS + construct_prompt_suffix(user_input, user_location, profile_details)
+
+
+def get_gemini_categories(
+    api_key, prompt, session_id=None, deadline=None, system_instruction=None, cancel_token=None
+):
+    logger.debug("Constructed prompt:\n%s", prompt)
+    text = get_gemini_client(api_key).generate_text(
+        prompt,
+        session_id=session_id,
+        deadline=deadline,
+        system_instruction=system_instruction,
+        cancel_token=cancel_token,
+    )
+    if text:
+        categories = [
+            parse_category_line(line)
+            for line in text.splitlines()
+            if line.strip()
+        ]
+        logger.info("Generated categories: %s", categories)
+        return categories
     return []
 
 
-def build_and_get_categories(api_key, user_input, user_location, profile_details):
-    prompt = construct_prompt(user_input, user_location, profile_details)
-    categories = get_gemini_categories(api_key, prompt)
+def parse_category_line(line):
+    """Strip list numbering and bullets from one line of the category response"""
+    return line.strip().strip("0123456789. \t-")
+
+
+def stream_gemini_categories(
+    api_key, prompt, session_id=None, deadline=None, system_instruction=None, cancel_token=None
+):
+    """Yield categories one by one while Gemini is still generating the response.
+
+    Uses streamGenerateContent with server-sent events, so callers can start
+    working on the first categories before the full list has arrived.
+    """
+    buffer = ""
+    client = get_gemini_client(api_key)
+    for text in client.stream_text(
+        prompt,
+        session_id=session_id,
+        deadline=deadline,
+        system_instruction=system_instruction,
+        cancel_token=cancel_token,
+    ):
+        buffer += text
+
+        # Only complete lines are categories, the tail may still be growing
+        *complete_lines, buffer = buffer.split("\n")
+        for line in complete_lines:
+            category = parse_category_line(line)
+            if category:
+                yield category
+
+    category = parse_category_line(buffer)
+    if category:
+        yield category
+
+
+def build_and_get_categories(
+    api_key, user_input, user_location, profile_details, session_id=None, deadline=None, cancel_token=None
+):
+    prompt = construct_prompt_suffix(user_input, user_location, profile_details)
+    categories = get_gemini_categories(
+        api_key,
+        prompt,
+        session_id=session_id,
+        deadline=deadline,
+        system_instruction=CATEGORY_INSTRUCTIONS,
+        cancel_token=cancel_token,
+    )
     return categories
 
 
+def stream_and_get_categories(
+    api_key, user_input, user_location, profile_details, session_id=None, deadline=None, cancel_token=None
+):
+    """Streaming variant of build_and_get_categories, yields categories as they arrive"""
+    prompt = construct_prompt_suffix(user_input, user_location, profile_details)
+    yield from stream_gemini_categories(
+        api_key,
+        prompt,
+        session_id=session_id,
+        deadline=deadline,
+        system_instruction=CATEGORY_INSTRUCTIONS,
+        cancel_token=cancel_token,
+    )
+
+
 def fetch_user_profile(api_url, username=None, email=None):
     params = {}
     if username:
@@ -80,12 +148,10 @@ def fetch_user_profile(api_url, username=None, email=None):
         if response.status_code == 200:
             return response.json()
         else:
-            print(
-                f"Error fetching user profile: {response.status_code} - {response.text}"
-            )
+            logger.warning("Error fetching user profile: %s - %s", response.status_code, response.text)
             return {}
     except Exception as e:
-        print(f"Exception during API call: {e}")
+        logger.warning("Exception during API call: %s", e)
         return {}
 
 
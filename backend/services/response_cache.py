@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import re
+
+from utils.state_store import make_cache
+
+# Whole recommendation responses, reused for identical profile + shopping form submissions
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "900"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+response_cache = make_cache("responses", max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+
+def _canonical(value):
+    """Normalize a request value so cosmetic differences hash the same"""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip().casefold()
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items() if item not in (None, "", [])}
+    if isinstance(value, (list, tuple)):
+        items = [_canonical(item) for item in value]
+        # Favorite categories and the like are sets, their order doesn't change the result
+        return sorted(items) if all(isinstance(item, str) for item in items) else items
+    return value
+
+
+def response_cache_key(user_data, shopping_input, ranking_mode=None):
+    canonical = {
+        "user_data": _canonical(user_data or {}),
+        "shopping_input": _canonical(shopping_input or {}),
+        "ranking_mode": _canonical(ranking_mode),
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+
+def cacheable(response):
+    """Only complete, successful responses are reused; sample products and
+    partial results cut short by the request deadline are not"""
+    return (
+        isinstance(response, dict)
+        and response.get("status") == "success"
+        and "note" not in response
+        and not response.get("partial")
+    )
+
+
+def get_cached_response(key):
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    cached = response_cache.get(key)
+    if cached is None:
+        return None
+    response = dict(cached)
+    response["cached"] = True
+    return response
+
+
+def store_response(key, response):
+    if RESPONSE_CACHE_ENABLED and cacheable(response):
+        response_cache.set(key, response)
+
+
+def get_stats():
+    stats = response_cache.get_stats()
+    stats["enabled"] = RESPONSE_CACHE_ENABLED
+    return stats
@@ -0,0 +1,345 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from services.amazon_scraper import amazon_category_top_products, scrape_amazon_product
+from utils.cancellation import Cancelled, record_reclaimed
+from utils.metrics import QUEUE_WAIT_SECONDS
+from utils.tracing import profiled, span
+
+logger = logging.getLogger(__name__)
+
+# Outbound scraping concurrency for the whole process, and per Amazon domain
+SCRAPE_MAX_CONCURRENCY = int(os.getenv("SCRAPE_MAX_CONCURRENCY", "8"))
+SCRAPE_PER_DOMAIN_CONCURRENCY = int(os.getenv("SCRAPE_PER_DOMAIN_CONCURRENCY", "4"))
+# Background work (cache warm-up) runs only when no request work is waiting, on at most this many workers
+SCRAPE_BACKGROUND_CONCURRENCY = int(os.getenv("SCRAPE_BACKGROUND_CONCURRENCY", "1"))
+# Queue waits kept for the percentile in get_stats
+WAIT_SAMPLES = 512
+
+
+class _Task:
+    def __init__(
+        self, fn, args, kwargs, session_id, domain, cancel_token, deadline, context, span_name, span_attrs,
+        background=False,
+    ):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.session_id = session_id
+        self.domain = domain
+        self.cancel_token = cancel_token
+        self.deadline = deadline
+        # Each task runs in its own copy: a Context can't be entered by two threads at once
+        self.context = context.copy() if context is not None else contextvars.copy_context()
+        self.span_name = span_name
+        self.span_attrs = span_attrs or {}
+        self.background = background
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class ScrapeScheduler:
+    """Long-lived worker threads running scrape calls for every request.
+
+    Work is queued per domain and, inside a domain, per session. Workers take
+    domains and sessions round-robin, so a session with many queued pages
+    can't starve the others, and no domain gets more than per_domain
+    concurrent requests. Background tasks wait in their own queues and only
+    start when no request task can, on at most background_limit workers.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=SCRAPE_MAX_CONCURRENCY,
+        per_domain=SCRAPE_PER_DOMAIN_CONCURRENCY,
+        background_limit=SCRAPE_BACKGROUND_CONCURRENCY,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_domain = per_domain
+        self.background_limit = background_limit
+        self._condition = threading.Condition()
+        self._queues = OrderedDict()  # domain -> OrderedDict(session_id -> deque of _Task)
+        self._background = OrderedDict()  # same layout, for background tasks
+        self._background_running = 0
+        self._running = {}  # domain -> running task count
+        self._queued = 0
+        self._workers = []
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "dropped": 0, "expired": 0, "max_queue_depth": 0
+        }
+
+    def _ensure_workers(self):
+        # Started lazily so importing the module doesn't spawn threads
+        while len(self._workers) < self.max_concurrency:
+            worker = threading.Thread(
+                target=self._work, name=f"scrape-{len(self._workers)}", daemon=True
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def submit(
+        self,
+        fn,
+        args=(),
+        kwargs=None,
+        session_id=None,
+        domain=None,
+        cancel_token=None,
+        deadline=None,
+        context=None,
+        span_name=None,
+        span_attrs=None,
+        background=False,
+    ):
+        """Queue fn(*args, **kwargs) and return a Future for its result.
+
+        Tasks whose cancel_token is cancelled, or whose monotonic deadline
+        has passed, before they start are dropped and their Future cancelled.
+        fn runs in context (by default the caller's), so it belongs to the
+        caller's trace, inside a span_name span when one is given.
+        background tasks yield to every request task.
+        """
+        task = _Task(
+            fn, args, kwargs or {}, session_id, domain, cancel_token, deadline, context, span_name, span_attrs,
+            background,
+        )
+        with self._condition:
+            self._ensure_workers()
+            queues = self._background if background else self._queues
+            sessions = queues.setdefault(domain, OrderedDict())
+            sessions.setdefault(session_id, deque()).append(task)
+            self._queued += 1
+            self._stats["submitted"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queued)
+            self._condition.notify()
+        return task.future
+
+    def _next_task(self):
+        """Pop the next request task, or background task when none can start, or None"""
+        task = self._pop(self._queues)
+        if task is None and self._background_running < self.background_limit:
+            task = self._pop(self._background)
+        return task
+
+    def _pop(self, queues):
+        """Pop the next task of queues round-robin over domains then sessions, or None"""
+        for domain in list(queues):
+            if self._running.get(domain, 0) >= self.per_domain:
+                continue
+            sessions = queues[domain]
+            session_id, tasks = next(iter(sessions.items()))
+            task = tasks.popleft()
+            # Served domain and session go to the back of their queues
+            if tasks:
+                sessions.move_to_end(session_id)
+            else:
+                del sessions[session_id]
+            if sessions:
+                queues.move_to_end(domain)
+            else:
+                del queues[domain]
+            self._queued -= 1
+            return task
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                task = self._next_task()
+                while task is None:
+                    self._condition.wait()
+                    task = self._next_task()
+                self._running[task.domain] = self._running.get(task.domain, 0) + 1
+                if task.background:
+                    self._background_running += 1
+                wait = time.monotonic() - task.enqueued_at
+                self._waits.append(wait)
+            QUEUE_WAIT_SECONDS.observe(wait, queue="scrape")
+            task.span_attrs["queued_ms"] = round(wait * 1000, 1)
+
+            try:
+                self._run(task)
+            finally:
+                with self._condition:
+                    self._running[task.domain] -= 1
+                    if not self._running[task.domain]:
+                        del self._running[task.domain]
+                    if task.background:
+                        self._background_running -= 1
+                    # A slot for this domain opened up
+                    self._condition.notify()
+
+    def _run(self, task):
+        cancelled = task.cancel_token is not None and task.cancel_token.cancelled
+        expired = task.deadline is not None and time.monotonic() >= task.deadline
+        if cancelled or expired or not task.future.set_running_or_notify_cancel():
+            if cancelled or expired:
+                task.future.cancel()
+                task.future.set_running_or_notify_cancel()
+            record_reclaimed("futures_dropped")
+            with self._condition:
+                self._stats["expired" if expired and not cancelled else "dropped"] += 1
+            return
+        try:
+            result = task.context.run(self._call, task)
+        except BaseException as e:
+            task.future.set_exception(e)
+            with self._condition:
+                self._stats["failed"] += 1
+        else:
+            task.future.set_result(result)
+            with self._condition:
+                self._stats["completed"] += 1
+
+    @staticmethod
+    def _call(task):
+        if task.span_name is None:
+            with profiled():
+                return task.fn(*task.args, **task.kwargs)
+        with span(task.span_name, **task.span_attrs), profiled():
+            return task.fn(*task.args, **task.kwargs)
+
+    def get_stats(self):
+        with self._condition:
+            waits = sorted(self._waits)
+            stats = dict(self._stats)
+            stats.update({
+                "max_concurrency": self.max_concurrency,
+                "per_domain_concurrency": self.per_domain,
+                "queue_depth": self._queued,
+                "running": sum(self._running.values()),
+                "background_limit": self.background_limit,
+                "background_running": self._background_running,
+                "background_queue_depth": sum(
+                    len(tasks) for sessions in self._background.values() for tasks in sessions.values()
+                ),
+                "domains": {
+                    domain: {
+                        "running": self._running.get(domain, 0),
+                        "queued": sum(
+                            len(t) for queues in (self._queues, self._background)
+                            for t in queues.get(domain, {}).values()
+                        ),
+                    }
+                    for domain in set(self._running) | set(self._queues) | set(self._background)
+                },
+            })
+        stats["avg_queue_wait_seconds"] = round(sum(waits) / len(waits), 3) if waits else 0.0
+        stats["p95_queue_wait_seconds"] = round(waits[int(len(waits) * 0.95) - 1], 3) if waits else 0.0
+        stats["max_queue_wait_seconds"] = round(waits[-1], 3) if waits else 0.0
+        return stats
+
+
+def scrape_category(
+    scheduler,
+    category,
+    amazon_domain,
+    num_results=3,
+    budget_range=None,
+    session_id=None,
+    cancel_token=None,
+    deadline=None,
+    on_product=None,
+    background=False,
+):
+    """Search a category and scrape its products on the scheduler.
+
+    Returns a Future for (category, products). The product scrapes are
+    queued from the search's completion callback instead of a worker
+    blocking on them, so nested work can never deadlock the shared pool.
+    The Future always resolves; it raises Cancelled if the request was
+    cancelled before the search ran, and has no products if the search
+    didn't start before the monotonic deadline. Products scraped so far
+    are readable from its scraped_so_far list while it is still pending,
+    and on_product(category, product) is called from the worker as each
+    one is scraped. background queues every scrape behind request work.
+    """
+    result = Future()
+    products = []
+    lock = threading.Lock()
+    result.scraped_so_far = products
+    # Product scrapes are queued from a worker thread, they keep the caller's trace
+    context = contextvars.copy_context()
+    # Running from the start: callers wait on it, only the callbacks below complete it
+    result.set_running_or_notify_cancel()
+
+    def on_search_done(search):
+        if search.cancelled():
+            if cancel_token is not None and cancel_token.cancelled:
+                result.set_exception(Cancelled(cancel_token.reason))
+            else:
+                # Expired in the queue
+                result.set_result((category, []))
+            return
+        if search.exception() is not None:
+            result.set_exception(search.exception())
+            return
+        urls = search.result()
+        if not urls:
+            result.set_result((category, []))
+            return
+
+        pending = [len(urls)]
+
+        def on_product_done(future):
+            if not future.cancelled():
+                if isinstance(future.exception(), Cancelled):
+                    # Stopped by the request's cancel token (quorum or deadline), not a failed scrape
+                    logger.debug("Product scrape for %s cancelled: %s", category, future.exception())
+                elif future.exception() is not None:
+                    logger.warning("Exception occurred while scraping a product for %s: %s", category, future.exception())
+                elif future.result():
+                    with lock:
+                        products.append(future.result())
+                    if on_product is not None:
+                        on_product(category, future.result())
+            with lock:
+                pending[0] -= 1
+                done = pending[0] == 0
+            if done:
+                result.set_result((category, products))
+
+        for url in urls:
+            scheduler.submit(
+                scrape_amazon_product,
+                args=(url,),
+                kwargs={"cancel_token": cancel_token, "deadline": deadline},
+                session_id=session_id,
+                domain=amazon_domain,
+                cancel_token=cancel_token,
+                deadline=deadline,
+                context=context,
+                span_name="product_scrape",
+                span_attrs={"category": category},
+                background=background,
+            ).add_done_callback(on_product_done)
+
+    scheduler.submit(
+        amazon_category_top_products,
+        args=(category, amazon_domain),
+        kwargs={
+            "num_results": num_results,
+            "budget_range": budget_range,
+            "cancel_token": cancel_token,
+            "deadline": deadline,
+        },
+        session_id=session_id,
+        domain=amazon_domain,
+        cancel_token=cancel_token,
+        deadline=deadline,
+        context=context,
+        span_name="category_search",
+        span_attrs={"category": category},
+        background=background,
+    ).add_done_callback(on_search_done)
+    return result
+
+
+# Shared by the API and run.py
+scrape_scheduler = ScrapeScheduler()
@@ -0,0 +1,365 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.state_store import shared_store
+
+logger = logging.getLogger(__name__)
+
+# Sessions idle longer than this are dropped, even without /api/cleanup-session
+SESSION_IDLE_TTL_SECONDS = int(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_LOCK_STRIPES = 16
+
+
+def estimate_size(session):
+    """Approximate memory held by a session, measured as its JSON size"""
+    try:
+        return len(json.dumps(session, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Stripe:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # session_id -> [last_access, size, session], oldest first
+        self.bytes = 0
+
+
+class _BaseSessionStore:
+    """Limits, counters and eviction callbacks shared by the session store backends"""
+
+    def __init__(self, idle_ttl, max_entries, max_bytes):
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._evict_callbacks = []
+        self._stats_lock = threading.Lock()
+        self._stats = {"created": 0, "deleted": 0, "expired": 0, "evicted_lru": 0}
+
+    def on_evict(self, callback):
+        """Call callback(session_id) for every session dropped by expiry or eviction"""
+        self._evict_callbacks.append(callback)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _notify(self, dropped):
+        for session_id, reason in dropped:
+            self._count(reason)
+            for callback in self._evict_callbacks:
+                try:
+                    callback(session_id)
+                except Exception:
+                    logger.exception("Session eviction callback failed for %s", session_id)
+
+    def __contains__(self, session_id):
+        return session_id is not None and self.get(session_id) is not None
+
+
+class SessionStore(_BaseSessionStore):
+    """In-memory session store with idle expiry and LRU eviction.
+
+    Sessions are spread over lock stripes by id so Flask and worker threads
+    rarely contend. Each stripe holds an equal share of the entry and byte
+    caps and evicts its least recently used sessions when over them.
+    Sessions are copied in and out, so callers never share a dict with
+    another thread.
+    """
+
+    def __init__(
+        self,
+        idle_ttl=SESSION_IDLE_TTL_SECONDS,
+        max_entries=SESSION_MAX_ENTRIES,
+        max_bytes=SESSION_MAX_BYTES,
+        stripes=SESSION_LOCK_STRIPES,
+    ):
+        super().__init__(idle_ttl, max_entries, max_bytes)
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self._stripe_entries = max(1, max_entries // stripes)
+        self._stripe_bytes = max(1, max_bytes // stripes)
+
+    def _stripe(self, session_id):
+        return self._stripes[hash(session_id) % len(self._stripes)]
+
+    def _expired(self, entry, now):
+        return self.idle_ttl and now - entry[0] > self.idle_ttl
+
+    def _trim(self, stripe, now):
+        """Drop expired then least recently used sessions, returns the dropped ids"""
+        dropped = []
+        while stripe.entries:
+            session_id, entry = next(iter(stripe.entries.items()))
+            if self._expired(entry, now):
+                reason = "expired"
+            elif len(stripe.entries) > self._stripe_entries or stripe.bytes > self._stripe_bytes:
+                reason = "evicted_lru"
+            else:
+                break
+            del stripe.entries[session_id]
+            stripe.bytes -= entry[1]
+            dropped.append((session_id, reason))
+        return dropped
+
+    def _write_locked(self, stripe, session_id, session, now):
+        """Store the session in its stripe, the caller holds stripe.lock; returns the dropped ids"""
+        size = estimate_size(session)
+        old = stripe.entries.pop(session_id, None)
+        if old is not None:
+            stripe.bytes -= old[1]
+        stripe.entries[session_id] = [now, size, session]
+        stripe.bytes += size
+        return self._trim(stripe, now)
+
+    def _write(self, session_id, session, created=False):
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            dropped = self._write_locked(stripe, session_id, session, time.monotonic())
+        if created:
+            self._count("created")
+        self._notify(dropped)
+
+    def create(self, session_id, user_data=None):
+        """Start a new session, replacing any existing one with the same id"""
+        self._write(session_id, {"user_data": dict(user_data or {})}, created=True)
+
+    def get(self, session_id):
+        """Copy of the session, or None if it doesn't exist or expired"""
+        stripe = self._stripe(session_id)
+        now = time.monotonic()
+        with stripe.lock:
+            entry = stripe.entries.get(session_id)
+            if entry is None:
+                return None
+            if self._expired(entry, now):
+                del stripe.entries[session_id]
+                stripe.bytes -= entry[1]
+                dropped = [(session_id, "expired")]
+                entry = None
+            else:
+                entry[0] = now
+                stripe.entries.move_to_end(session_id)
+                return dict(entry[2])
+        self._notify(dropped)
+        return None
+
+    def update(self, session_id, **fields):
+        """Set top-level fields (user_data, results) of a session, returns False if it is gone"""
+        stripe = self._stripe(session_id)
+        now = time.monotonic()
+        # Read, merge and write under one lock hold, so concurrent updates
+        # don't overwrite each other and a deleted session stays deleted
+        with stripe.lock:
+            entry = stripe.entries.get(session_id)
+            if entry is None:
+                return False
+            if self._expired(entry, now):
+                del stripe.entries[session_id]
+                stripe.bytes -= entry[1]
+                dropped = [(session_id, "expired")]
+                updated = False
+            else:
+                session = dict(entry[2])
+                session.update(fields)
+                dropped = self._write_locked(stripe, session_id, session, now)
+                updated = True
+        self._notify(dropped)
+        return updated
+
+    def delete(self, session_id):
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            entry = stripe.entries.pop(session_id, None)
+            if entry is not None:
+                stripe.bytes -= entry[1]
+        if entry is not None:
+            self._count("deleted")
+        return entry is not None
+
+    def __len__(self):
+        total = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                total += len(stripe.entries)
+        return total
+
+    def sweep(self):
+        """Drop every expired session now, instead of waiting for the next write to its stripe"""
+        now = time.monotonic()
+        for stripe in self._stripes:
+            with stripe.lock:
+                dropped = self._trim(stripe, now)
+            self._notify(dropped)
+
+    def get_stats(self):
+        self.sweep()
+        entries = 0
+        total_bytes = 0
+        with_results = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                entries += len(stripe.entries)
+                total_bytes += stripe.bytes
+                with_results += sum(1 for entry in stripe.entries.values() if "results" in entry[2])
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            "sessions": entries,
+            "sessions_with_results": with_results,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+            "lock_stripes": len(self._stripes),
+            "backend": "memory",
+        })
+        return stats
+
+
+class SQLiteSessionStore(_BaseSessionStore):
+    """SessionStore kept in a SQLiteStore, so every worker process sees the same sessions.
+
+    Expiry and eviction follow the same rules across the shared table; eviction
+    callbacks run in the process whose write dropped the session.
+    """
+
+    def __init__(
+        self,
+        store,
+        idle_ttl=SESSION_IDLE_TTL_SECONDS,
+        max_entries=SESSION_MAX_ENTRIES,
+        max_bytes=SESSION_MAX_BYTES,
+    ):
+        super().__init__(idle_ttl, max_entries, max_bytes)
+        self.store = store
+
+    def _trim(self, conn, now):
+        dropped = []
+        if self.idle_ttl:
+            expired = conn.execute(
+                "SELECT id FROM sessions WHERE last_access < ?", (now - self.idle_ttl,)
+            ).fetchall()
+            conn.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.idle_ttl,))
+            dropped += [(session_id, "expired") for (session_id,) in expired]
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        if count > self.max_entries or total_bytes > self.max_bytes:
+            for session_id, size in conn.execute(
+                "SELECT id, size FROM sessions ORDER BY last_access"
+            ).fetchall():
+                if count <= self.max_entries and total_bytes <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                count -= 1
+                total_bytes -= size
+                dropped.append((session_id, "evicted_lru"))
+        return dropped
+
+    def _write(self, session_id, session, created=False):
+        data = json.dumps(session, default=str)
+        now = time.time()
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, size, last_access) VALUES (?, ?, ?, ?)",
+                (session_id, data, len(data), now),
+            )
+            dropped = self._trim(conn, now)
+        if created:
+            self._count("created")
+        self._notify(dropped)
+
+    def create(self, session_id, user_data=None):
+        self._write(session_id, {"user_data": dict(user_data or {})}, created=True)
+
+    def get(self, session_id):
+        now = time.time()
+        rows = self.store.query("SELECT data, last_access FROM sessions WHERE id = ?", (session_id,))
+        if not rows:
+            return None
+        data, last_access = rows[0]
+        with self.store.transaction() as conn:
+            if self.idle_ttl and now - last_access > self.idle_ttl:
+                deleted = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+            else:
+                conn.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (now, session_id))
+                return json.loads(data)
+        if deleted:
+            self._notify([(session_id, "expired")])
+        return None
+
+    def update(self, session_id, **fields):
+        now = time.time()
+        # The read and the write share one BEGIN IMMEDIATE transaction, so no
+        # other process can change or delete the session in between
+        with self.store.transaction() as conn:
+            row = conn.execute("SELECT data, last_access FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return False
+            if self.idle_ttl and now - row[1] > self.idle_ttl:
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                dropped = [(session_id, "expired")]
+                updated = False
+            else:
+                session = json.loads(row[0])
+                session.update(fields)
+                data = json.dumps(session, default=str)
+                conn.execute(
+                    "UPDATE sessions SET data = ?, size = ?, last_access = ? WHERE id = ?",
+                    (data, len(data), now, session_id),
+                )
+                dropped = self._trim(conn, now)
+                updated = True
+        self._notify(dropped)
+        return updated
+
+    def delete(self, session_id):
+        with self.store.transaction() as conn:
+            deleted = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+        if deleted:
+            self._count("deleted")
+        return bool(deleted)
+
+    def __len__(self):
+        return self.store.query("SELECT COUNT(*) FROM sessions")[0][0]
+
+    def sweep(self):
+        with self.store.transaction() as conn:
+            dropped = self._trim(conn, time.time())
+        self._notify(dropped)
+
+    def get_stats(self):
+        self.sweep()
+        # Result payloads are stored under the "results" key of the session JSON
+        entries, total_bytes, with_results = self.store.query(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), "
+            "COALESCE(SUM(json_extract(data, '$.results') IS NOT NULL), 0) FROM sessions"
+        )[0]
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            "sessions": entries,
+            "sessions_with_results": with_results,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+            "backend": "sqlite",
+        })
+        return stats
+
+
+def create_session_store():
+    """SessionStore, or SQLiteSessionStore when STATE_BACKEND is sqlite"""
+    store = shared_store()
+    if store is None:
+        return SessionStore()
+    return SQLiteSessionStore(store)
+
+
+# Shared by every request handler in the process
+session_store = create_session_store()
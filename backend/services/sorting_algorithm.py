@@ -1,70 +1,163 @@
-import requests
 import json
+import logging
 import os
+import threading
+import time
 from services.prompt_builder import build_and_get_categories, fetch_user_profile
 from services.amazon_scraper import amazon_category_top_products, scrape_amazon_product
+from services.local_ranker import shortlist_candidates
+from services.gemini_client import get_gemini_client
+
+logger = logging.getLogger(__name__)
+
+# Exponentially weighted average of recent Gemini ranking latency, shared by all requests
+_latency_lock = threading.Lock()
+_recent_ranking_latency = None
+_last_ranking_sample_at = None
+LATENCY_SMOOTHING = 0.3
+
+
+def record_ranking_latency(seconds):
+    """Fold one Gemini ranking call duration into the shared latency average"""
+    global _recent_ranking_latency, _last_ranking_sample_at
+    with _latency_lock:
+        _last_ranking_sample_at = time.monotonic()
+        if _recent_ranking_latency is None:
+            _recent_ranking_latency = seconds
+        else:
+            _recent_ranking_latency = (
+                LATENCY_SMOOTHING * seconds
+                + (1 - LATENCY_SMOOTHING) * _recent_ranking_latency
+            )
+
+
+def recent_ranking_latency(max_age=None):
+    """Average latency in seconds of recent Gemini ranking calls.
+
+    Returns None if no call was made yet, or if the last one is older than
+    max_age seconds so callers can probe Gemini again.
+    """
+    with _latency_lock:
+        if _last_ranking_sample_at is None:
+            return None
+        if max_age is not None and time.monotonic() - _last_ranking_sample_at > max_age:
+            return None
+        return _recent_ranking_latency
+
+
+# Maximum number of candidates sent to Gemini for ranking
+SHORTLIST_K = int(os.getenv("RANKING_SHORTLIST_K", "10"))
+SHORTLIST_MIN_RATING = float(os.getenv("RANKING_SHORTLIST_MIN_RATING", "3.5"))
+
+# Candidates received versus candidates sent to Gemini, across all requests
+_shortlist_lock = threading.Lock()
+_shortlist_stats = {"ranking_calls": 0, "candidates_in": 0, "candidates_sent": 0}
+
+
+def get_shortlist_stats():
+    """Snapshot of the pre-filter counters"""
+    with _shortlist_lock:
+        stats = dict(_shortlist_stats)
+    stats["shortlist_k"] = SHORTLIST_K
+    stats["sent_ratio"] = (
+        round(stats["candidates_sent"] / stats["candidates_in"], 3)
+        if stats["candidates_in"]
+        else None
+    )
+    return stats
+
+
+# Static part of the ranking prompt, registered with Gemini once and reused by every call
+RANKING_INSTRUCTIONS = (
+    "You are a recommendation engine. You will be given the user input, the user profile details "
+    "and a list of Amazon scraper results.\n\n"
+    "Each Amazon scraper result includes the product title, URL, price, rating, and image URL.\n\n"
+    "Your task is to:\n\n"
+    "Analyze the user input and profile details to infer the user's preferences, interests, budget, and needs.\n"
+    "Evaluate and rank the Amazon scraper results accordingly.\n"
+    "Return an ordered list of the products starting with the most relevant match.\n\n"
+    "Output Format (for each recommended product):\n\n"
+    "Product: [Product Title]  \n"
+    "URL: [Product URL]  \n"
+    "Price: [Product Price]  \n"
+    "Rating: [Product Rating]  \n"
+    "Image URL: [Image URL]  \n"
+    "Reasoning: [Provide a detailed, varied, and specific explanation for why this product suits the user. Highlight unique features, benefits, or aspects that match the user's preferences and needs. Do not reveal the user's name or personal details; refer to the user simply as 'the user'. Avoid generic, repetitive, or vague phrases. Ensure the reasoning reflects the user's gender, location, and stated interests accurately.]\n\n"
+    "Only include products in the ranked list. Ensure that your recommendations are concise, relevant, and justified.\n\n"
+)
 
 
 class SortingAlgorithm:
-    def __init__(self, gemini_api_url, gemini_api_key):
-        self.api_url = gemini_api_url
+    def __init__(self, gemini_api_key, shortlist_k=None):
         self.api_key = gemini_api_key
+        self.shortlist_k = SHORTLIST_K if shortlist_k is None else shortlist_k
 
-    def build_prompt(self, user_input, user_profile_details, amazon_scraper_results):
-        prompt = (
-            "You are a recommendation engine. Based on the following data:\n\n"
+    def shortlist(self, user_input, user_profile_details, amazon_scraper_results):
+        """Trim the candidates to the top shortlist_k before they go into the prompt"""
+        shortlisted = shortlist_candidates(
+            amazon_scraper_results,
+            user_input,
+            budget_range=(user_profile_details or {}).get("budget_range"),
+            k=self.shortlist_k,
+            min_rating=SHORTLIST_MIN_RATING,
+        )
+        with _shortlist_lock:
+            _shortlist_stats["ranking_calls"] += 1
+            _shortlist_stats["candidates_in"] += len(amazon_scraper_results)
+            _shortlist_stats["candidates_sent"] += len(shortlisted)
+        if len(shortlisted) < len(amazon_scraper_results):
+            logger.info(
+                "Shortlisted %d of %d candidates for Gemini ranking", len(shortlisted), len(amazon_scraper_results)
+            )
+        return shortlisted
+
+    def build_prompt_suffix(self, user_input, user_profile_details, amazon_scraper_results):
+        """Per-request part of the ranking prompt, sent after RANKING_INSTRUCTIONS"""
+        return (
             "User Input: {}\n\n"
             "User Profile Details: {}\n\n"
             "Amazon Scraper Results: {}\n\n"
-            "Each Amazon scraper result includes the product title, URL, price, rating, and image URL.\n\n"
-            "Your task is to:\n\n"
-            "Analyze the user input and profile details to infer the user's preferences, interests, budget, and needs.\n"
-            "Evaluate and rank the Amazon scraper results accordingly.\n"
-            "Return an ordered list of the products starting with the most relevant match.\n\n"
-            "Output Format (for each recommended product):\n\n"
-            "Product: [Product Title]  \n"
-            "URL: [Product URL]  \n"
-            "Price: [Product Price]  \n"
-            "Rating: [Product Rating]  \n"
-            "Image URL: [Image URL]  \n"
-            "Reasoning: [Provide a detailed, varied, and specific explanation for why this product suits the user. Highlight unique features, benefits, or aspects that match the user's preferences and needs. Do not reveal the user's name or personal details; refer to the user simply as 'the user'. Avoid generic, repetitive, or vague phrases. Ensure the reasoning reflects the user's gender, location, and stated interests accurately.]\n\n"
-            "Only include products in the ranked list. Ensure that your recommendations are concise, relevant, and justified."
         ).format(
             user_input,
             json.dumps(user_profile_details),
             json.dumps(amazon_scraper_results),
         )
-        return prompt
+
+    def build_prompt(self, user_input, user_profile_details, amazon_scraper_results):
+        """Full ranking prompt as a single text"""
+        return RANKING_INSTRUCTIONS + self.build_prompt_suffix(
+            user_input, user_profile_details, amazon_scraper_results
+        )
 
     def get_sorted_products(
-        self, user_input, user_profile_details, amazon_scraper_results
+        self,
+        user_input,
+        user_profile_details,
+        amazon_scraper_results,
+        session_id=None,
+        deadline=None,
+        cancel_token=None,
     ):
-        prompt = self.build_prompt(
+        amazon_scraper_results = self.shortlist(
             user_input, user_profile_details, amazon_scraper_results
         )
-        api_key = self.api_key
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-        headers = {"Content-Type": "application/json"}
-        data = {"contents": [{"parts": [{"text": prompt}]}]}
-
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code == 200:
-            result = response.json()
-            output_text = ""
-            candidates = result.get("candidates", [])
-            if candidates and "content" in candidates[0]:
-                parts = candidates[0]["content"].get("parts", [])
-                if parts:
-                    output_text = parts[0].get("text", "")
-            return output_text
-        else:
-            raise Exception(
-                f"Gemini API request failed with status code {response.status_code}: {response.text}"
+        prompt = self.build_prompt_suffix(
+            user_input, user_profile_details, amazon_scraper_results
+        )
+        started = time.perf_counter()
+        try:
+            return get_gemini_client(self.api_key).generate_text(
+                prompt,
+                session_id=session_id,
+                deadline=deadline,
+                system_instruction=RANKING_INSTRUCTIONS,
+                cancel_token=cancel_token,
             )
+        finally:
+            record_ranking_latency(time.perf_counter() - started)
 
 
 if __name__ == "__main__":
-    gemini_api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
     gemini_api_key = os.getenv('GEMINI_API_KEY')
 
     if not gemini_api_key:
@@ -92,7 +185,7 @@ if __name__ == "__main__":
         user_profile_details,
     )
 
-    amazon_domain = "amazon.com"
+    amazon_domain = "https://www.amazon.com"
     amazon_results = []
     for category in categories[:7]:
         urls = amazon_category_top_products(
@@ -106,7 +199,7 @@ if __name__ == "__main__":
             if product_info:
                 amazon_results.append(product_info)
 
-    sorting_algo = SortingAlgorithm(gemini_api_url, gemini_api_key)
+    sorting_algo = SortingAlgorithm(gemini_api_key)
     try:
         sorted_products_text = sorting_algo.get_sorted_products(
             user_input, user_profile_details, amazon_results
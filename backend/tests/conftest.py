@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# The backend modules import each other as top-level packages (services, utils, api)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# No background warm-up or real Gemini key in tests; read when the modules are imported
+os.environ.setdefault("PRECOMPUTE_ENABLED", "false")
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+
+@pytest.fixture(scope="session")
+def mock_amazon():
+    """Base URL of tools/mock_amazon_server.py running without latency on a free port"""
+    from tools.mock_amazon_server import make_server
+
+    server = make_server(port=0, latency=0.0, page_kb=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fast_scraper(monkeypatch):
+    """Skip the scraper's politeness delays and start from empty scrape caches"""
+    from services import amazon_scraper
+
+    monkeypatch.setattr(amazon_scraper, "cancellable_sleep", lambda *args, **kwargs: None)
+    amazon_scraper.search_cache.clear()
+    amazon_scraper.product_cache.clear()
+    return amazon_scraper
+
+
+@pytest.fixture(scope="session")
+def mock_gemini():
+    """v1beta base URL of tools/mock_gemini_server.py on a free port, slow enough to notice blocking"""
+    from tools.mock_gemini_server import make_server
+
+    server = make_server(port=0, latency=0.5)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1beta"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def scripted_gemini():
+    """A mock Gemini server of its own without latency; tests script failures and replies on server.config"""
+    from tools.mock_gemini_server import make_server
+
+    server = make_server(port=0, latency=0.0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1beta"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def quota_scheduler(monkeypatch):
+    """A private Gemini quota scheduler without limits, so cooldowns don't leak into other tests"""
+    from services import gemini_client
+    from services.gemini_scheduler import GeminiScheduler
+
+    scheduler = GeminiScheduler(rpm_limit=0, tpm_limit=0)
+    monkeypatch.setattr(gemini_client, "gemini_scheduler", scheduler)
+    return scheduler
+
+
+@pytest.fixture
+def api():
+    """The Flask backend module, with the response cache off so every request runs the pipeline"""
+    from api import backend_api
+
+    enabled = backend_api.response_cache.RESPONSE_CACHE_ENABLED
+    backend_api.response_cache.RESPONSE_CACHE_ENABLED = False
+    yield backend_api
+    backend_api.response_cache.RESPONSE_CACHE_ENABLED = enabled
+
+
+@pytest.fixture
+def slow_categories():
+    """Categories whose search takes 5s, tests may change the set"""
+    return {"Musical Instruments"}
+
+
+@pytest.fixture
+def stub_scrapes(api, fast_scraper, slow_categories, monkeypatch):
+    """Amazon searches answer at once with one product each, except slow_categories"""
+    from services import scrape_scheduler
+
+    def search(category, amazon_domain, num_results=3, budget_range=None, cancel_token=None, deadline=None):
+        if category in slow_categories and cancel_token is not None:
+            cancel_token.sleep(5)
+        return [f"{amazon_domain}/{category.replace(' ', '-')}/dp/1"]
+
+    def product(url, cancel_token=None, deadline=None):
+        name = url.split("/")[-3].replace("-", " ")
+        return {"title": f"{name} deluxe", "url": url, "price_value": 50.0, "average_rating": "4.5"}
+
+    monkeypatch.setattr(scrape_scheduler, "amazon_category_top_products", search)
+    monkeypatch.setattr(scrape_scheduler, "scrape_amazon_product", product)
+    return api
+
+
+@pytest.fixture
+def session_id(api):
+    """A session with a completed profile"""
+    client = api.app.test_client()
+    session_id = f"test-{os.urandom(6).hex()}"
+    client.post("/api/init-session", json={"session_id": session_id})
+    client.post("/api/user-info", json={
+        "session_id": session_id,
+        "age": 30,
+        "gender": "female",
+        "location": "United States",
+        "interests": "hiking",
+        "categories": ["sports-fitness"],
+        "budgetMin": 10,
+        "budgetMax": 200,
+    })
+    yield session_id
+    client.post("/api/cleanup-session", json={"session_id": session_id})
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+
+@pytest.fixture
+def asgi(stub_scrapes, slow_categories):
+    """TestClient of the ASGI app, with every scrape answering at once"""
+    from api import asgi_app
+
+    slow_categories.clear()
+    with TestClient(asgi_app.app) as client:
+        yield client
+
+
+def request_body(session_id):
+    return {"session_id": session_id, "shopping_input": {"shoppingInput": "headphones"}, "ranking_mode": "local"}
+
+
+def event_names(body):
+    return [
+        line[len("event: "):] for line in body.splitlines() if line.startswith("event: ")
+    ]
+
+
+def test_mounted_flask_routes_keep_the_request_id(asgi):
+    response = asgi.get("/api/health", headers={"X-Request-ID": "abc-123"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+    assert response.headers["X-Request-ID"] == "abc-123"
+    # One id per request, never duplicated by the mounted app
+    assert response.headers.get_list("X-Request-ID") == ["abc-123"]
+
+
+def test_recommendations(asgi, session_id):
+    response = asgi.post("/api/shopping-recommendations", json=request_body(session_id))
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["status"] == "success"
+    assert result["products"]
+    assert "Server-Timing" in response.headers
+
+
+def test_recommendations_for_an_unknown_session(asgi):
+    response = asgi.post("/api/shopping-recommendations", json=request_body("no-such-session"))
+    assert response.status_code == 400
+
+
+def test_job_is_polled_to_its_result(asgi, session_id):
+    created = asgi.post("/api/shopping-recommendations/jobs", json=request_body(session_id))
+    assert created.status_code == 202
+
+    done = asgi.get(f"{created.headers['Location']}?wait=3")
+
+    assert done.status_code == 200
+    assert done.json()["status"] == "completed"
+    assert done.json()["job"]["result"]["products"]
+    assert asgi.get(f"/api/shopping-recommendations/jobs/{'0' * 32}").status_code == 404
+
+
+def test_events_stream(asgi, session_id):
+    job_id = asgi.post("/api/shopping-recommendations/jobs", json=request_body(session_id)).json()["job_id"]
+    url = f"/api/shopping-recommendations/jobs/{job_id}/events"
+
+    with asgi.stream("GET", url) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+    names = [name for name in event_names(body) if name != "progress"]
+    assert names[0] == "category"
+    assert names[-1] == "result"
+    assert names.index("categories") < names.index("products")
+
+    # Resumes after Last-Event-ID like the Flask route
+    last_id = max(int(line[len("id: "):]) for line in body.splitlines() if line.startswith("id: "))
+    with asgi.stream("GET", url, headers={"Last-Event-ID": str(last_id - 1)}) as response:
+        resumed = "".join(response.iter_text())
+    assert event_names(resumed) == ["result"]
+
+
+def test_store_calls_run_off_the_event_loop(asgi, session_id, monkeypatch):
+    from api import asgi_app
+
+    on_loop = []
+
+    def record(method):
+        def call(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(method.__name__)
+            except RuntimeError:
+                pass
+            return method(*args, **kwargs)
+        return call
+
+    monkeypatch.setattr(asgi_app.job_store, "get", record(asgi_app.job_store.get))
+    monkeypatch.setattr(asgi_app, "submit_recommendation_job", record(asgi_app.submit_recommendation_job))
+    asgi.post("/api/shopping-recommendations", json=request_body(session_id))
+    job_id = asgi.post("/api/shopping-recommendations/jobs", json=request_body(session_id)).json()["job_id"]
+    asgi.get(f"/api/shopping-recommendations/jobs/{job_id}?wait=3")
+    with asgi.stream("GET", f"/api/shopping-recommendations/jobs/{job_id}/events") as response:
+        "".join(response.iter_text())
+
+    assert on_loop == []
+
+
+def test_etag_and_304_match_flask(asgi, api, session_id):
+    job_id = asgi.post("/api/shopping-recommendations/jobs", json=request_body(session_id)).json()["job_id"]
+    url = f"/api/shopping-recommendations/jobs/{job_id}"
+    done = asgi.get(f"{url}?wait=3")
+    assert done.status_code == 200
+    flask = api.app.test_client()
+
+    asgi_response = asgi.get(url)
+    flask_response = flask.get(url)
+
+    assert asgi_response.headers["ETag"] == flask_response.headers["ETag"]
+    assert asgi_response.headers["ETag"].startswith('W/"')
+    assert asgi_response.json() == json.loads(flask_response.get_data())
+    etag = asgi_response.headers["ETag"]
+    assert asgi.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert flask.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert asgi.get(url, headers={"If-None-Match": 'W/"other"'}).status_code == 200
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from utils.cancellation import (
+    MIN_STAGE_SECONDS,
+    CancellationToken,
+    Cancelled,
+    DeadlineExceeded,
+    cancellable_sleep,
+    stage_timeout,
+    time_left,
+)
+
+
+def test_cancel_runs_callbacks_once():
+    token = CancellationToken()
+    calls = []
+    token.on_cancel(lambda: calls.append("closed"))
+    assert token.cancel("timeout")
+    assert not token.cancel("again")
+    assert calls == ["closed"]
+    assert token.reason == "timeout"
+
+
+def test_callback_registered_after_cancel_runs_at_once():
+    token = CancellationToken()
+    token.cancel()
+    calls = []
+    token.on_cancel(lambda: calls.append("closed"))
+    assert calls == ["closed"]
+
+
+def test_unregistered_callback_does_not_run():
+    token = CancellationToken()
+    calls = []
+    unregister = token.on_cancel(lambda: calls.append("closed"))
+    unregister()
+    token.cancel()
+    assert calls == []
+
+
+def test_child_is_cancelled_with_its_parent():
+    parent = CancellationToken()
+    child = parent.child()
+    parent.cancel("cancelled by user")
+    assert child.cancelled
+    assert child.reason == "cancelled by user"
+
+
+def test_child_can_be_cancelled_alone():
+    parent = CancellationToken()
+    child = parent.child()
+    child.cancel("product quorum reached")
+    assert not parent.cancelled
+    # The parent no longer holds a callback for the cancelled child
+    assert parent._callbacks == []
+
+
+def test_cancellable_sleep_raises_when_cancelled():
+    token = CancellationToken()
+    token.cancel("timeout")
+    started = time.monotonic()
+    with pytest.raises(Cancelled):
+        cancellable_sleep(5, token)
+    assert time.monotonic() - started < 1
+
+
+def test_cancellable_sleep_stops_at_the_deadline():
+    started = time.monotonic()
+    cancellable_sleep(5, CancellationToken(), deadline=started + 0.05)
+    assert time.monotonic() - started < 1
+
+
+def test_time_left():
+    assert time_left(None) is None
+    assert 9 < time_left(time.monotonic() + 10) <= 10
+
+
+def test_stage_timeout_is_capped_to_the_deadline():
+    assert stage_timeout(15, None) == 15
+    assert stage_timeout(15, time.monotonic() + 5) <= 5
+    assert stage_timeout(2, time.monotonic() + 5) == 2
+
+
+def test_stage_without_enough_time_is_skipped():
+    with pytest.raises(DeadlineExceeded):
+        stage_timeout(15, time.monotonic() + MIN_STAGE_SECONDS / 2)
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from services import gemini_client
+from services.gemini_client import GeminiClient
+
+USER_DATA = {
+    "user_location": "United States",
+    "age": 30,
+    "gender": "female",
+    "budget_range": "10-200",
+    "favorite_categories": [],
+    "interests": "",
+}
+
+
+@pytest.fixture
+def stream_gemini(api, scripted_gemini, quota_scheduler, monkeypatch):
+    """The backend's Gemini client pointed at scripted_gemini"""
+    client = GeminiClient(api.GEMINI_API_KEY, base_url=scripted_gemini.base_url, backoff=0.01)
+    monkeypatch.setattr(gemini_client, "_clients", {api.GEMINI_API_KEY: client})
+    return scripted_gemini
+
+
+def stream(api, primary_keywords=()):
+    """Run stream_and_dispatch_categories, returns (dispatched, [(category, seconds since start)])"""
+    started = time.perf_counter()
+    calls = []
+    dispatched = api.stream_and_dispatch_categories(
+        "headphones",
+        USER_DATA,
+        list(primary_keywords),
+        lambda category: calls.append((category, time.perf_counter() - started)),
+        started,
+    )
+    return dispatched, calls
+
+
+def test_category_split_across_events_is_joined(api, stream_gemini):
+    stream_gemini.config.stream_chunk_chars = 5
+    stream_gemini.config.replies.append("1. Wireless headphones\n2. Running shoes\n- Yoga mats")
+
+    dispatched, calls = stream(api)
+
+    assert dispatched == ["Wireless headphones", "Running shoes", "Yoga mats"]
+    assert [category for category, _ in calls] == dispatched
+
+
+def test_duplicate_categories_are_dispatched_once(api, stream_gemini):
+    stream_gemini.config.replies.append(
+        "* Running shoes\n* Yoga mats\n* Running shoes\n* Yoga mats (e.g. Manduka)\n* Foam rollers"
+    )
+
+    dispatched, calls = stream(api)
+
+    assert dispatched == ["Running shoes", "Yoga mats", "Foam rollers"]
+    assert len(calls) == 3
+
+
+def test_deferred_duplicates_fill_once(api, stream_gemini):
+    stream_gemini.config.replies.append("Gift cards\nRunning shoes\nGift cards\nTrail running shoes")
+
+    dispatched, _ = stream(api, primary_keywords=["running"])
+
+    # Matching categories first, the deferred one fills a slot at the end
+    assert dispatched == ["Running shoes", "Trail running shoes", "Gift cards"]
+
+
+def test_stream_closed_early_keeps_what_arrived(api, stream_gemini):
+    stream_gemini.config.stream_chunk_chars = 16
+    stream_gemini.config.stream_close_after = 2
+    stream_gemini.config.replies.append("Running shoes\nYoga mats\nFoam rollers\nGym bags\n")
+
+    dispatched, _ = stream(api)
+
+    # Two events carry the first 32 characters: two whole lines, the third is cut off and never used
+    assert dispatched == ["Running shoes", "Yoga mats"]
+
+
+def test_scrapes_are_dispatched_before_the_stream_ends(api, stream_gemini):
+    stream_gemini.config.latency = 1.0
+    stream_gemini.config.stream_chunks = 5
+    stream_gemini.config.replies.append("Running shoes\nYoga mats\nFoam rollers\nGym bags\nWater bottles\n")
+    started = time.perf_counter()
+
+    dispatched, calls = stream(api)
+
+    elapsed = time.perf_counter() - started
+    assert len(dispatched) == 5
+    first_category, first_dispatch = calls[0]
+    assert first_category == "Running shoes"
+    # One event arrives every 0.2s, the first scrape doesn't wait for the other four
+    assert first_dispatch < elapsed - 0.5
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from services.gemini_client import GeminiClient, GeminiError
+
+
+def generate(server, **kwargs):
+    client = GeminiClient("test-key", base_url=server.base_url, backoff=0.01)
+    payload, _ = client.build_payload("hello")
+    return client.post(client.model_url("generateContent"), payload, **kwargs)
+
+
+def test_429_and_503_are_retried(scripted_gemini, quota_scheduler):
+    scripted_gemini.config.failures.extend([429, 503])
+
+    response, _ = generate(scripted_gemini)
+
+    assert response.status_code == 200
+    assert not scripted_gemini.config.failures
+    assert quota_scheduler.get_stats()["granted"] == 3
+
+
+def test_retry_after_is_honoured(scripted_gemini, quota_scheduler, monkeypatch):
+    cooldowns = []
+    monkeypatch.setattr(quota_scheduler, "cooldown", cooldowns.append)
+    scripted_gemini.config.retry_after = 1
+    scripted_gemini.config.failures.append(429)
+    started = time.monotonic()
+
+    response, _ = generate(scripted_gemini)
+
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 1
+    # A 429 holds back every caller, not just this one
+    assert cooldowns == [1.0]
+
+
+def test_retries_give_up_at_the_deadline(scripted_gemini, quota_scheduler):
+    scripted_gemini.config.retry_after = 5
+    scripted_gemini.config.failures.extend([503] * 3)
+    started = time.monotonic()
+
+    with pytest.raises(GeminiError) as error:
+        generate(scripted_gemini, timeout=1)
+
+    # The Retry-After wait doesn't fit the deadline, so it fails at once instead of sleeping
+    assert time.monotonic() - started < 1
+    assert error.value.status_code == 503
+    assert len(scripted_gemini.config.failures) == 2
+
+
+def test_quota_wait_past_the_deadline_is_not_sent(scripted_gemini, quota_scheduler, monkeypatch):
+    acquire = quota_scheduler.acquire
+
+    def slow_acquire(*args, **kwargs):
+        time.sleep(0.3)
+        return acquire(*args, **kwargs)
+
+    monkeypatch.setattr(quota_scheduler, "acquire", slow_acquire)
+    scripted_gemini.config.failures.append(503)
+
+    with pytest.raises(GeminiError, match="waiting .* for quota"):
+        generate(scripted_gemini, timeout=0.2)
+
+    # Nothing reached the server
+    assert list(scripted_gemini.config.failures) == [503]
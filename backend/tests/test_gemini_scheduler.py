@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from services.gemini_scheduler import GeminiScheduler, QuotaWaitTimeout
+from utils.state_store import SQLiteStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStore(str(tmp_path / "state.db"))
+
+
+def test_rpm_limit_blocks_until_timeout():
+    scheduler = GeminiScheduler(rpm_limit=2, tpm_limit=10**6)
+    scheduler.acquire("a", tokens=10)
+    scheduler.acquire("a", tokens=10)
+    with pytest.raises(QuotaWaitTimeout):
+        scheduler.acquire("a", tokens=10, timeout=0.1)
+    assert scheduler.get_stats()["requests_last_minute"] == 2
+    assert scheduler.get_stats()["timed_out"] == 1
+
+
+def test_tpm_limit_uses_reported_usage():
+    scheduler = GeminiScheduler(rpm_limit=100, tpm_limit=1000)
+    ticket = scheduler.acquire("a", tokens=100)
+    scheduler.record_usage(ticket, 950)
+    with pytest.raises(QuotaWaitTimeout):
+        scheduler.acquire("a", tokens=100, timeout=0.1)
+    assert scheduler.get_stats()["tokens_last_minute"] == 950
+
+
+def test_cooldown_pauses_grants():
+    scheduler = GeminiScheduler(rpm_limit=100, tpm_limit=10**6)
+    scheduler.cooldown(5)
+    with pytest.raises(QuotaWaitTimeout):
+        scheduler.acquire("a", timeout=0.1)
+    assert scheduler.get_stats()["cooldown_remaining_seconds"] > 4
+
+
+def test_shared_window_caps_every_process_together(store):
+    # Two schedulers on one database stand in for two worker processes
+    workers = [GeminiScheduler(rpm_limit=3, tpm_limit=10**6, state=store) for _ in range(2)]
+    granted = []
+    errors = []
+
+    def call(scheduler):
+        try:
+            granted.append(scheduler.acquire("s", tokens=10, timeout=0.3))
+        except QuotaWaitTimeout as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call, args=(workers[i % 2],)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(granted) == 3
+    assert len(errors) == 3
+    assert workers[0].get_stats()["requests_last_minute"] == 3
+    assert workers[1].get_stats()["shared"] is True
+
+
+def test_shared_cooldown_and_usage(store):
+    first = GeminiScheduler(rpm_limit=10, tpm_limit=1000, state=store)
+    second = GeminiScheduler(rpm_limit=10, tpm_limit=1000, state=store)
+    ticket = first.acquire("a", tokens=100)
+    first.record_usage(ticket, 990)
+    with pytest.raises(QuotaWaitTimeout):
+        second.acquire("b", tokens=100, timeout=0.1)
+    assert second.get_stats()["tokens_last_minute"] == 990
+    second.cooldown(5)
+    assert first.get_stats()["cooldown_remaining_seconds"] > 4
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_zero_limits_are_off(shared, store):
+    scheduler = GeminiScheduler(rpm_limit=0, tpm_limit=0, state=store if shared else None)
+    for _ in range(50):
+        scheduler.acquire("a", tokens=10**6, timeout=0.1)
+    assert scheduler.get_stats()["requests_last_minute"] == 50
+
+
+def test_shared_transaction_does_not_hold_the_lock(store):
+    scheduler = GeminiScheduler(rpm_limit=10, tpm_limit=10**6, state=store)
+    other_process = SQLiteStore(store.path)
+    granted = threading.Event()
+    with other_process.transaction():
+        # The grant's write transaction waits for the other process to commit
+        thread = threading.Thread(target=lambda: scheduler.acquire("a", timeout=5) and granted.set())
+        thread.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        assert scheduler.get_stats()["queue_depth"] == 1
+        scheduler.forget_session("b")
+        assert time.monotonic() - started < 0.1
+        assert not granted.is_set()
+    thread.join(5)
+    assert granted.is_set()
@@ -0,0 +1,62 @@
+import pytest
+
+from services.intent_classifier import KeywordAutomaton, intent_classifier
+
+# Threshold above which backend_api skips the Gemini category call
+CONFIDENT = 0.75
+UNRELATED_FAVORITES = ["Books & E-readers"]
+
+
+@pytest.mark.parametrize(
+    "request_text, favorites, first_category, confident",
+    [
+        ("cat food", [], "Cat Supplies", False),
+        ("cat food", ["Gourmet Foods"], "Cat Supplies", False),
+        ("dog toys", UNRELATED_FAVORITES, "Dog Supplies", False),
+        ("laptop", UNRELATED_FAVORITES, "Laptops & Computing", True),
+        ("gift for my brother who loves gaming", UNRELATED_FAVORITES, "Gaming & Consoles", True),
+        ("wireless headphones", [], "Audio & Headphones", False),
+        ("laptop bag", [], "Laptops & Computing", False),
+    ],
+)
+def test_request_evidence_decides_ranking_and_confidence(request_text, favorites, first_category, confident):
+    result = intent_classifier.classify(request_text, favorite_categories=favorites)
+    # The request's own words come first, then the ranked PRODUCT_CATEGORIES
+    assert result.categories[1] == first_category
+    assert (result.confidence >= CONFIDENT) is confident
+
+
+@pytest.mark.parametrize("request_text", ["dog toys", "laptop", "cat food"])
+def test_unrelated_favorite_never_outranks_a_request_match(request_text):
+    ranked = intent_classifier.classify(request_text, favorite_categories=UNRELATED_FAVORITES).categories
+    plain = intent_classifier.classify(request_text).categories
+    assert "Books & E-readers" not in ranked[: len(plain)]
+
+
+def test_favorites_break_ties_and_fill_the_list():
+    result = intent_classifier.classify("something nice", favorite_categories=UNRELATED_FAVORITES)
+    assert result.categories == ["Books & E-readers"]
+    assert result.confidence == 0.0
+
+
+def test_unknown_product_words_lower_confidence():
+    assert intent_classifier.classify("yoga mat").confidence == 0.0
+
+
+def test_brand_prefixes_first_category():
+    result = intent_classifier.classify("laptop", brands="Lenovo, Dell")
+    assert result.categories[0] == "Lenovo laptop"
+
+
+def test_automaton_matches_whole_words_only():
+    automaton = KeywordAutomaton({"cat": 1, "cat food": 2})
+    assert sorted(payload for _, payload in automaton.search("Cat food for my cats")) == [1, 2]
+    assert list(automaton.search("concatenate")) == []
+
+
+def test_confident_request_is_not_filled_with_unrelated_favorites():
+    result = intent_classifier.classify(
+        "coffee", favorite_categories=["music-instruments", "sports-fitness"], interests="hiking"
+    )
+    assert result.confidence >= CONFIDENT
+    assert result.categories == ["coffee", "Coffee & Tea"]
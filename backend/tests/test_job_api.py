@@ -0,0 +1,164 @@
+import json
+import time
+
+
+def parse_sse(body):
+    """(id, event, data) of every event in a server-sent events body, comments skipped"""
+    events = []
+    for block in body.split("\n\n"):
+        fields = {}
+        for line in block.splitlines():
+            if line.startswith(":"):
+                continue
+            name, _, value = line.partition(": ")
+            fields[name] = value
+        if "event" in fields:
+            events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def start_job(api, session_id, text="headphones"):
+    response = api.app.test_client().post("/api/shopping-recommendations/jobs", json={
+        "session_id": session_id,
+        "shopping_input": {"shoppingInput": text},
+        "ranking_mode": "local",
+    })
+    assert response.status_code == 202
+    return response.get_json()["job_id"]
+
+
+def read_events(api, job_id, last_event_id=None):
+    headers = {"Last-Event-ID": str(last_event_id)} if last_event_id is not None else {}
+    response = api.app.test_client().get(f"/api/shopping-recommendations/jobs/{job_id}/events", headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    # The body ends once the job has finished and every event was sent
+    return parse_sse(response.get_data(as_text=True))
+
+
+def test_events_arrive_in_pipeline_order(stub_scrapes, slow_categories, session_id):
+    api = stub_scrapes
+    slow_categories.clear()
+
+    events = read_events(api, start_job(api, session_id))
+
+    assert [event_id for event_id, _, _ in events] == list(range(len(events)))
+    names = [event for _, event, _ in events if event != "progress"]
+    categories = next(data for _, event, data in events if event == "categories")["categories"]
+    assert categories
+    # Each category as it is dispatched, the list, products per category, then the result
+    assert names == (
+        ["category"] * len(categories) + ["categories"] + ["products"] * len(categories) + ["result"]
+    )
+    assert [data["category"] for _, event, data in events if event == "category"] == categories
+    assert {data["category"] for _, event, data in events if event == "products"} == set(categories)
+    assert events[-1][2]["status"] == "completed"
+    assert events[-1][2]["result"]["status"] == "success"
+
+
+def test_reconnect_resumes_after_last_event_id(stub_scrapes, slow_categories, session_id):
+    api = stub_scrapes
+    slow_categories.clear()
+    job_id = start_job(api, session_id)
+    events = read_events(api, job_id)
+
+    resumed = read_events(api, job_id, last_event_id=3)
+
+    assert resumed == events[4:]
+    assert read_events(api, job_id, last_event_id=events[-1][0]) == []
+
+
+def test_stream_ends_with_the_failure(stub_scrapes, session_id, monkeypatch):
+    api = stub_scrapes
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("pipeline broke")
+
+    monkeypatch.setattr(api, "process_recommendation_request", fail)
+
+    events = read_events(api, start_job(api, session_id))
+
+    assert [event for _, event, _ in events] == ["result"]
+    assert events[0][2]["status"] == "failed"
+    assert events[0][2]["http_status"] == 500
+    assert "pipeline broke" not in json.dumps(events)
+
+
+def test_stream_ends_when_the_job_is_cancelled(stub_scrapes, slow_categories, session_id):
+    api = stub_scrapes
+    job_id = start_job(api, session_id)
+    job = api.job_store.get(job_id)
+    # Wait for the scrapes, the slow category holds the job for 5s
+    give_up = time.monotonic() + 2
+    while job.stage != "scraping" and time.monotonic() < give_up:
+        time.sleep(0.01)
+    assert job.stage == "scraping"
+
+    api.app.test_client().post(f"/api/cancel-request/{session_id}")
+    started = time.monotonic()
+    events = read_events(api, job_id)
+
+    assert time.monotonic() - started < 2
+    assert events[-1][1] == "result"
+    assert events[-1][2]["status"] == "cancelled"
+    assert not [data for _, event, data in events if event == "products" and data["category"] in slow_categories]
+
+
+def test_job_reports_progress_then_its_result(stub_scrapes, session_id, monkeypatch):
+    api = stub_scrapes
+    # The slow category is cut off at the scrape deadline, after about a second
+    monkeypatch.setattr(api, "REQUEST_TIMEOUT_SECONDS", 3)
+    monkeypatch.setattr(api, "DEADLINE_RANKING_RESERVE_SECONDS", 2)
+    client = api.app.test_client()
+    created = client.post("/api/shopping-recommendations/jobs", json={
+        "session_id": session_id,
+        "shopping_input": {"shoppingInput": "headphones"},
+        "ranking_mode": "local",
+    })
+    assert created.status_code == 202
+    status_url = created.headers["Location"]
+    assert status_url == created.get_json()["status_url"]
+
+    give_up = time.monotonic() + 2
+    while True:
+        running = client.get(status_url)
+        if running.get_json()["job"]["stage"] == "scraping" or time.monotonic() > give_up:
+            break
+        time.sleep(0.01)
+    assert running.status_code == 202
+    job = running.get_json()["job"]
+    assert running.get_json()["status"] == "processing"
+    assert job["stage_index"] == job["stages"].index("scraping")
+    assert job["progress"]["categories_dispatched"] >= 1
+    assert "result" not in job
+
+    done = client.get(f"{status_url}?wait=3")
+    assert done.status_code == 200
+    assert done.get_json()["status"] == "completed"
+    result = done.get_json()["job"]["result"]
+    assert result["status"] == "success"
+    assert result["products"]
+
+
+def test_unknown_job_is_not_found(api):
+    client = api.app.test_client()
+    for suffix in ("", "/events", "/trace"):
+        response = client.get(f"/api/shopping-recommendations/jobs/{'0' * 32}{suffix}")
+        assert response.status_code == 404
+        assert response.get_json()["status"] == "error"
+
+
+def test_expired_job_is_not_found(stub_scrapes, slow_categories, session_id, monkeypatch):
+    api = stub_scrapes
+    slow_categories.clear()
+    client = api.app.test_client()
+    job_id = start_job(api, session_id)
+    assert client.get(f"/api/shopping-recommendations/jobs/{job_id}?wait=3").status_code == 200
+
+    # Finished longer ago than the TTL, dropped when the next job is created
+    monkeypatch.setattr(api.job_store, "ttl", 60)
+    api.job_store.get(job_id).finished_at -= 61
+    start_job(api, session_id)
+
+    assert client.get(f"/api/shopping-recommendations/jobs/{job_id}").status_code == 404
+    assert client.get(f"/api/shopping-recommendations/jobs/{job_id}/events").status_code == 404
@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected
+from services.jobs import Job
+
+
+def make_job():
+    return Job("session", {})
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=1)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def blocker():
+    """A runner that holds its worker until released"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        release.wait(5)
+        job.finish({"status": "success"})
+
+    return run, started, release
+
+
+def wait_idle(admission, timeout=2):
+    """Wait until the admission queue is drained and every worker is free"""
+    stop = time.monotonic() + timeout
+    while time.monotonic() < stop:
+        stats = admission.get_stats()
+        if not stats["queue_depth"] and not stats["running"]:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_cancelled_job_does_not_start():
+    job = make_job()
+    assert job.cancel("timeout")
+    assert not job.start()
+    assert job.status == "cancelled"
+
+
+def test_job_with_cancelled_token_does_not_start():
+    job = make_job()
+    job.cancel_token.cancel("session released")
+    assert not job.start()
+    assert job.status == "queued"
+
+
+def test_job_cancelled_while_queued_never_runs(executor):
+    admission = AdmissionController(executor)
+    run, started, release = blocker()
+    admission.submit(make_job(), run)
+    assert started.wait(2)
+
+    ran = []
+    queued = make_job()
+    admission.submit(queued, lambda job: ran.append(job))
+    assert queued.cancel("timeout")
+    release.set()
+
+    assert wait_idle(admission)
+    assert ran == []
+    assert queued.status == "cancelled"
+
+
+def test_job_with_cancelled_token_is_skipped_and_finished(executor):
+    admission = AdmissionController(executor)
+    run, started, release = blocker()
+    admission.submit(make_job(), run)
+    assert started.wait(2)
+
+    ran = []
+    queued = make_job()
+    admission.submit(queued, lambda job: ran.append(job))
+    # Cancelled without finishing, as another process flagging it would
+    queued.cancel_token.cancel("cancelled elsewhere")
+    release.set()
+
+    assert queued.wait(2)
+    assert wait_idle(admission)
+    assert ran == []
+    assert queued.status == "cancelled"
+
+
+def test_queued_jobs_run_in_priority_order(executor):
+    admission = AdmissionController(executor)
+    run, started, release = blocker()
+    admission.submit(make_job(), run)
+    assert started.wait(2)
+
+    order = []
+    for priority in ("background", "interactive", "fast", "interactive"):
+        admission.submit(make_job(), lambda job, priority=priority: order.append(priority), priority=priority)
+    release.set()
+
+    assert wait_idle(admission)
+    assert order == ["fast", "interactive", "interactive", "background"]
+
+
+def test_full_queue_is_rejected(executor):
+    admission = AdmissionController(executor, max_queue=1)
+    run, started, release = blocker()
+    admission.submit(make_job(), run)
+    assert started.wait(2)
+    admission.submit(make_job(), lambda job: None)
+    with pytest.raises(AdmissionRejected) as rejection:
+        admission.submit(make_job(), lambda job: None)
+    assert rejection.value.reason == "queue full"
+    release.set()
+
+
+def test_timed_out_request_is_cancelled(api, session_id, monkeypatch):
+    jobs = []
+
+    def process(request_data, deadline=None, job=None):
+        jobs.append(job)
+        # A pipeline that only stops when told to
+        while not job.cancel_token.cancelled:
+            time.sleep(0.01)
+        job.cancel_token.raise_if_cancelled()
+
+    monkeypatch.setattr(api, "process_recommendation_request", process)
+    monkeypatch.setattr(api, "REQUEST_TIMEOUT_SECONDS", 0.2)
+
+    response = api.app.test_client().post("/api/shopping-recommendations", json={
+        "session_id": session_id,
+        "shopping_input": {"shoppingInput": "trail running shoes"},
+    })
+
+    assert response.status_code == 500
+    assert jobs[0].wait(2)
+    assert jobs[0].status == "cancelled"
+    assert session_id not in api.active_requests
@@ -0,0 +1,54 @@
+import pytest
+
+from services.local_ranker import LocalRanker, budget_fit, parse_budget_range, shortlist_candidates, tokenize
+
+PROFILE = {"interests": "", "budget_range": "20-100"}
+
+PRODUCTS = [
+    {"title": "Acme Trail Running Shoes", "url": "u1", "price_value": 60.0, "rating": "4.6 out of 5"},
+    {"title": "Ceramic Coffee Mug", "url": "u2", "price_value": 25.0, "rating": "3.1 out of 5"},
+    {"title": "Lightweight Running Shoes for Women", "url": "u3", "price_value": 250.0, "rating": "4.2"},
+]
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("I need the best Running shoes for a trail") == ["running", "shoes", "trail"]
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("20-100", (20.0, 100.0)), ("$100 - $20", (20.0, 100.0)), ("€5-€10", (5.0, 10.0)), ("cheap", None), (None, None)],
+)
+def test_parse_budget_range(value, expected):
+    assert parse_budget_range(value) == expected
+
+
+def test_budget_fit_decays_outside_range():
+    assert budget_fit(50, (20, 100)) == 1.0
+    assert budget_fit(None, (20, 100)) == 0.5
+    assert 0 < budget_fit(150, (20, 100)) < budget_fit(110, (20, 100)) < 1.0
+
+
+def test_rank_orders_relevant_products_first():
+    ranked = LocalRanker().rank("trail running shoes", PROFILE, PRODUCTS)
+    assert [r["url"] for r in ranked][0] == "u1"
+    assert ranked[-1]["url"] == "u2"
+    assert LocalRanker().rank("trail running shoes", PROFILE, PRODUCTS, limit=2)[1]["url"] != "u2"
+
+
+def test_reasoning_only_claims_a_match_when_the_title_is_relevant():
+    by_url = {r["url"]: r["reasoning"] for r in LocalRanker().rank("trail running shoes", PROFILE, PRODUCTS)}
+    assert by_url["u1"].startswith("Strong match for your request")
+    assert "match" not in by_url["u2"] and "related" not in by_url["u2"].lower()
+    assert by_url["u2"] == "Within your budget."
+
+
+def test_explain_without_any_signal():
+    assert LocalRanker().explain({"title": "x"}, None) == "From a category you searched."
+    assert LocalRanker().explain({"title": "x"}, None, relevance=0.3) == "Related to your request."
+
+
+def test_shortlist_keeps_original_order():
+    products = [{"title": f"Item {i}", "url": str(i)} for i in range(5)] + PRODUCTS
+    kept = shortlist_candidates(products, "running shoes", budget_range="20-100", k=2)
+    assert [p["url"] for p in kept] == ["u1", "u3"]
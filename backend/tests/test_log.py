@@ -0,0 +1,134 @@
+import contextvars
+import json
+import logging
+import queue
+import threading
+
+import pytest
+
+from services.scrape_scheduler import ScrapeScheduler
+from utils import log
+from utils.log import ContextFilter, JsonFormatter, NonBlockingQueueHandler, bind_request_id, resolve_request_id
+
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def capture():
+    """A logger whose records pass through a ContextFilter sampling every 3rd, collected in a list"""
+    handler = Collect()
+    handler.addFilter(ContextFilter(every=3))
+    logger = logging.getLogger("tests.log")
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    yield logger, handler.records
+    logger.removeHandler(handler)
+
+
+@pytest.mark.parametrize("sent", ["abc-123", "trace.ID_9", "x" * 64])
+def test_usable_request_ids_are_kept(sent):
+    assert resolve_request_id(sent) == sent
+
+
+@pytest.mark.parametrize("sent", [None, "", "x" * 65, "has space", "bad\nLOG injected", "id;drop"])
+def test_unusable_request_ids_are_replaced(sent):
+    request_id = resolve_request_id(sent)
+    assert request_id != sent
+    assert len(request_id) == 16
+    assert resolve_request_id(sent) != request_id
+
+
+def test_records_carry_the_bound_request_id(capture):
+    logger, records = capture
+    logger.info("outside")
+    with bind_request_id("req-1"):
+        logger.info("inside")
+        with bind_request_id("req-2"):
+            logger.info("nested")
+        logger.info("inside again")
+    assert [r.request_id for r in records] == ["-", "req-1", "req-2", "req-1"]
+
+
+def test_request_id_follows_work_to_other_threads(capture):
+    logger, records = capture
+    scheduler = ScrapeScheduler(max_concurrency=1)
+    with bind_request_id("req-3"):
+        # Scheduled scrapes run in the submitter's context
+        scheduler.submit(logger.info, args=("scrape",), domain="amazon.com").result(timeout=2)
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(logger.info, "copied"))
+        thread.start()
+        thread.join()
+    # A bare thread starts from an empty context
+    thread = threading.Thread(target=logger.info, args=("bare",))
+    thread.start()
+    thread.join()
+    assert {r.getMessage(): r.request_id for r in records} == {"scrape": "req-3", "copied": "req-3", "bare": "-"}
+
+
+def test_flask_requests_log_and_echo_their_request_id(api, capture, monkeypatch):
+    logger, records = capture
+
+    def health():
+        logger.info("health checked")
+        return {"status": "healthy"}
+
+    monkeypatch.setitem(api.app.view_functions, "health_check", health)
+    client = api.app.test_client()
+
+    response = client.get("/api/health", headers={"X-Request-ID": "client-id"})
+    assert response.headers["X-Request-ID"] == "client-id"
+    assert records[-1].request_id == "client-id"
+
+    response = client.get("/api/health", headers={"X-Request-ID": "not a valid id"})
+    assert response.headers["X-Request-ID"] != "not a valid id"
+    assert records[-1].request_id == response.headers["X-Request-ID"]
+
+
+def test_sampled_messages_keep_one_in_every(capture):
+    logger, records = capture
+    sampled_out = log.get_logging_stats()["sampled_out"]
+    for i in range(7):
+        logger.info("retry %d", i, extra={"sample": "retry"})
+        logger.info("other %d", i, extra={"sample": "other"})
+    logger.info("not sampled")
+
+    kept = [r.getMessage() for r in records]
+    assert kept == ["retry 0", "other 0", "retry 3", "other 3", "retry 6", "other 6", "not sampled"]
+    assert all(r.sample_rate == 3 for r in records[:-1])
+    assert not hasattr(records[-1], "sample_rate")
+    assert log.get_logging_stats()["sampled_out"] - sampled_out == 8
+
+
+def test_full_queue_drops_records_without_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    logger = logging.getLogger("tests.log.queue")
+    logger.addHandler(handler)
+    logger.propagate = False
+    dropped = log.get_logging_stats()["dropped"]
+    try:
+        for i in range(3):
+            logger.warning("record %d", i)
+    finally:
+        logger.removeHandler(handler)
+    assert handler.queue.qsize() == 1
+    assert handler.queue.get_nowait().getMessage() == "record 0"
+    assert log.get_logging_stats()["dropped"] - dropped == 2
+
+
+def test_json_lines_carry_id_and_sample_rate(capture):
+    logger, records = capture
+    with bind_request_id("req-4"):
+        logger.warning("slow scrape", extra={"sample": "slow"})
+    entry = json.loads(JsonFormatter().format(records[-1]))
+    assert entry["request_id"] == "req-4"
+    assert entry["sample_rate"] == 3
+    assert entry["message"] == "slow scrape"
+    assert entry["level"] == "WARNING"
@@ -0,0 +1,22 @@
+from services import gemini_client
+
+
+def test_prefix_cache_stats_are_zeroed_without_clients(monkeypatch):
+    monkeypatch.setattr(gemini_client, "_clients", {})
+    stats = gemini_client.get_prefix_cache_stats()
+    assert stats["hits"] == stats["lookups"] == 0
+    assert stats["hit_ratio"] is None
+
+
+def test_metrics_on_a_fresh_process_include_every_family(api, monkeypatch):
+    # No Gemini client has been created yet
+    monkeypatch.setattr(gemini_client, "_clients", {})
+
+    response = api.app.test_client().get("/metrics")
+
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'cache_hits_total{cache="gemini_prefix"} 0' in body
+    assert 'cache_misses_total{cache="gemini_prefix"} 0' in body
+    assert "active_sessions " in body
+    assert 'executor_queue_depth{queue="admission"}' in body
@@ -0,0 +1,70 @@
+import json
+import time
+
+def recommend(api, session_id):
+    started = time.monotonic()
+    response = api.app.test_client().post("/api/shopping-recommendations", json={
+        "session_id": session_id,
+        "shopping_input": {"shoppingInput": "headphones"},
+        "ranking_mode": "local",
+    })
+    return response.get_json(), time.monotonic() - started
+
+
+def test_quorum_is_off_by_default(api):
+    assert api.QUORUM_PRODUCTS == 0
+
+
+def test_quorum_ranks_without_the_slow_category(stub_scrapes, slow_categories, session_id, monkeypatch):
+    api = stub_scrapes
+    [slow_category] = slow_categories
+    assert slow_category in api.local_categories(api.classify_request(
+        {"shoppingInput": "headphones"}, api.user_sessions.get(session_id)["user_data"]
+    ))
+    monkeypatch.setattr(api, "QUORUM_PRODUCTS", 2)
+
+    result, elapsed = recommend(api, session_id)
+
+    assert result["status"] == "success"
+    assert elapsed < 3
+    assert len(result["products"]) >= 2
+    assert slow_category.lower() not in " ".join(p["name"].lower() for p in result["products"])
+
+
+def test_scrape_deadline_returns_a_partial_response(stub_scrapes, slow_categories, session_id, monkeypatch):
+    api = stub_scrapes
+    monkeypatch.setattr(api, "REQUEST_TIMEOUT_SECONDS", 3)
+    monkeypatch.setattr(api, "DEADLINE_RANKING_RESERVE_SECONDS", 2)
+
+    result, elapsed = recommend(api, session_id)
+
+    assert result["status"] == "success"
+    assert result["partial"] is True
+    assert result["pending_categories"] == sorted(slow_categories)
+    assert len(result["products"]) == 3
+    assert elapsed < 2.5
+    # Never served to a later request as if it were complete
+    assert not api.response_cache.cacheable(result)
+
+
+def test_gemini_category_failure_falls_back_to_local_categories(stub_scrapes, slow_categories, session_id, monkeypatch):
+    api = stub_scrapes
+
+    def fail(*args, **kwargs):
+        raise api.GeminiError("Gemini API request failed with status code 503: overloaded", status_code=503)
+
+    monkeypatch.setattr(api, "build_and_get_categories", fail)
+    slow_categories.clear()
+    monkeypatch.setattr(api, "STREAM_CATEGORIES", False)
+    response = api.app.test_client().post("/api/shopping-recommendations", json={
+        "session_id": session_id,
+        # Too vague for the classifier to skip Gemini, but it still has a guess
+        "shopping_input": {"shoppingInput": "running shoes"},
+        "ranking_mode": "local",
+    })
+
+    result = response.get_json()
+    assert response.status_code == 200
+    assert result["category_source"] == "local_fallback"
+    assert result["products"]
+    assert "overloaded" not in json.dumps(result)
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from services import precompute
+from services.improved_categories import FAVORITE_CATEGORY_IDS, PRODUCT_CATEGORIES, clean_category_name
+from services.intent_classifier import intent_classifier
+
+# backend_api skips Gemini and searches the classifier's categories above this confidence
+LOCAL_CATEGORY_CONFIDENCE = 0.75
+
+
+def test_favorite_ids_map_to_product_categories():
+    for categories in FAVORITE_CATEGORY_IDS.values():
+        assert set(categories) <= set(PRODUCT_CATEGORIES)
+
+
+@pytest.mark.parametrize(
+    "favorites, interests, expected",
+    [
+        (["music-instruments", "tech-accessories", "art-decor"], "", ["Music & Instruments", "Smartphones & Accessories", "Home Decor"]),
+        (["electronics"], "", ["Smartphones & Accessories", "Laptops & Computing", "Audio & Headphones"]),
+        (["baby-maternity"], "coffee", ["Coffee & Tea"]),
+        (["Books & E-readers"], "", ["Books & E-readers"]),
+    ],
+)
+def test_candidate_categories_are_searchable_names(favorites, interests, expected):
+    user_data = {"favorite_categories": favorites, "interests": interests}
+    assert precompute.candidate_categories(user_data) == expected
+
+
+def wait_for_warm_up(session_id, timeout=10):
+    give_up = time.monotonic() + timeout
+    while precompute.get_stats()["running"] and time.monotonic() < give_up:
+        time.sleep(0.02)
+    return precompute.get_precomputed(session_id)
+
+
+def test_warmed_session_hits_search_cache_on_first_request(monkeypatch, mock_amazon, fast_scraper):
+    monkeypatch.setattr(precompute, "PRECOMPUTE_ENABLED", True)
+    monkeypatch.setattr(precompute, "get_amazon_domain", lambda location: mock_amazon)
+    user_data = {
+        "favorite_categories": ["electronics"],
+        "interests": "",
+        "budget_range": "1-1000",
+        "user_location": "United States",
+    }
+    precompute.start_precompute("warm-session", user_data)
+    warmed = wait_for_warm_up("warm-session")["warmed_categories"]
+    precompute.cancel_precompute("warm-session")
+    assert warmed == precompute.candidate_categories(user_data)
+
+    # The categories a clear request searches when it is classified locally
+    intent = intent_classifier.classify("laptop", favorite_categories=user_data["favorite_categories"])
+    assert intent.confidence >= LOCAL_CATEGORY_CONFIDENCE
+    live = [c for c in map(clean_category_name, intent.categories) if c]
+    assert set(live) & set(warmed)
+
+    hits = fast_scraper.search_cache.get_stats()["hits"]
+    for category in live:
+        fast_scraper.amazon_category_top_products(
+            category, mock_amazon, num_results=1, budget_range=user_data["budget_range"]
+        )
+    assert fast_scraper.search_cache.get_stats()["hits"] - hits == len(set(live) & set(warmed))
+
+
+def test_cancelled_warm_up_stops(monkeypatch, fast_scraper):
+    from services import scrape_scheduler
+
+    monkeypatch.setattr(precompute, "PRECOMPUTE_ENABLED", True)
+    searched = []
+
+    def search(category, amazon_domain, num_results=3, budget_range=None, cancel_token=None, deadline=None):
+        searched.append(category)
+        cancel_token.sleep(5)
+        return []
+
+    monkeypatch.setattr(scrape_scheduler, "amazon_category_top_products", search)
+    user_data = {"favorite_categories": ["electronics"], "interests": "", "user_location": "United States"}
+    cancelled = precompute.get_stats()["cancelled"]
+    precompute.start_precompute("cancel-session", user_data)
+    give_up = time.monotonic() + 2
+    while not searched and time.monotonic() < give_up:
+        time.sleep(0.01)
+    precompute.cancel_precompute("cancel-session")
+
+    assert precompute.get_precomputed("cancel-session") == {}
+    # Counted once the running search notices
+    while precompute.get_stats()["cancelled"] == cancelled and time.monotonic() < give_up:
+        time.sleep(0.01)
+    assert precompute.get_stats()["cancelled"] == cancelled + 1
+    assert len(searched) == 1
@@ -0,0 +1,66 @@
+import time
+
+from services.gemini_client import GeminiClient, PrefixCache
+from services.gemini_scheduler import gemini_scheduler
+
+LARGE_PREFIX = "Rank the products for the user. " * 200
+
+
+def wait_for(predicate, timeout=5.0):
+    give_up = time.monotonic() + timeout
+    while time.monotonic() < give_up:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_prefix_below_minimum_is_sent_inline_without_a_call(mock_gemini):
+    cache = PrefixCache(GeminiClient("test-key", base_url=mock_gemini), enabled=True, min_tokens=4096)
+    assert cache.resolve("short instructions") is None
+    stats = cache.get_stats()
+    assert stats["below_minimum"] == 1
+    assert stats["registrations"] == stats["registration_failures"] == 0
+
+
+def test_registration_runs_in_the_background_under_the_scheduler(mock_gemini):
+    cache = PrefixCache(GeminiClient("test-key", base_url=mock_gemini), enabled=True, min_tokens=100)
+    granted = gemini_scheduler.get_stats()["granted"]
+
+    started = time.monotonic()
+    assert cache.resolve(LARGE_PREFIX) is None
+    # The mock answers after 0.5s, the request doesn't wait for it
+    assert time.monotonic() - started < 0.3
+
+    assert wait_for(lambda: cache.get_stats()["registrations"] == 1)
+    assert cache.resolve(LARGE_PREFIX).startswith("cachedContents/")
+    assert gemini_scheduler.get_stats()["granted"] > granted
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_refused_prefix_is_not_retried_right_away(mock_gemini, monkeypatch):
+    cache = PrefixCache(GeminiClient("test-key", base_url=mock_gemini), enabled=True, min_tokens=100)
+    attempts = []
+    monkeypatch.setattr(cache, "_register", lambda prefix: attempts.append(prefix))
+
+    assert cache.resolve(LARGE_PREFIX) is None
+    assert wait_for(lambda: cache.get_stats()["registration_failures"] == 1)
+    assert cache.resolve(LARGE_PREFIX) is None
+    assert len(attempts) == 1
+
+
+def test_default_minimum_admits_the_pipeline_prompts(mock_gemini):
+    from services.prompt_builder import CATEGORY_INSTRUCTIONS
+    from services.sorting_algorithm import RANKING_INSTRUCTIONS
+
+    cache = PrefixCache(GeminiClient("test-key", base_url=mock_gemini), enabled=True)
+    for prefix in (CATEGORY_INSTRUCTIONS, RANKING_INSTRUCTIONS):
+        assert cache.resolve(prefix) is None
+    assert wait_for(lambda: cache.get_stats()["registrations"] == 2)
+
+    assert cache.resolve(CATEGORY_INSTRUCTIONS).startswith("cachedContents/")
+    assert cache.resolve(RANKING_INSTRUCTIONS).startswith("cachedContents/")
+    stats = cache.get_stats()
+    assert stats["below_minimum"] == 0
+    assert stats["hits"] == 2
+    assert stats["prefix_chars_saved"] == len(CATEGORY_INSTRUCTIONS) + len(RANKING_INSTRUCTIONS)
@@ -0,0 +1,57 @@
+from services.product_index import ProductJoinIndex, extract_asin, normalize_url
+
+PRODUCTS = [
+    {
+        "title": "Acme Pro Wireless Noise Cancelling Headphones with 40h Battery, Black",
+        "url": "https://www.amazon.com/Acme-Pro-Wireless/dp/B0ACME0001/ref=sr_1_1",
+    },
+    {
+        "title": "Nimbus Trail Running Shoes for Men, Lightweight",
+        "url": "https://www.amazon.com/Nimbus-Trail/dp/B0NIMB0002",
+    },
+    {
+        "title": "Orbit Stainless Steel Insulated Water Bottle 32oz",
+        "url": "https://www.amazon.com/gp/product/B0ORBT0003?th=1",
+    },
+]
+
+
+def lookup(result):
+    index = ProductJoinIndex(PRODUCTS)
+    return index.lookup(result), index.stats
+
+
+def test_exact_title_matches():
+    product, stats = lookup({"title": PRODUCTS[1]["title"].upper(), "url": ""})
+    assert product is PRODUCTS[1]
+    assert stats["title"] == 1
+
+
+def test_url_matches_through_its_asin_or_path():
+    product, stats = lookup({"title": "", "url": "https://amazon.com/dp/B0ORBT0003"})
+    assert product is PRODUCTS[2]
+    assert stats["asin"] == 1
+    assert extract_asin(PRODUCTS[2]["url"]) == "B0ORBT0003"
+    assert normalize_url("HTTPS://WWW.Amazon.com/a/b/?x=1#y") == "www.amazon.com/a/b"
+
+
+def test_truncated_title_matches_the_product_containing_it():
+    product, stats = lookup({"title": "Acme Pro Wireless Noise Cancelling Headphones", "url": ""})
+    assert product is PRODUCTS[0]
+    product, _ = lookup({"title": "Nimbus Trail Running Sho...", "url": ""})
+    assert product is PRODUCTS[1]
+    assert stats["fuzzy"] == 1
+
+
+def test_malformed_url_falls_back_to_the_title():
+    assert normalize_url("http://[Product URL]") is None
+    product, _ = lookup({"title": PRODUCTS[0]["title"], "url": "http://[Product URL]"})
+    assert product is PRODUCTS[0]
+
+
+def test_unrelated_or_short_titles_do_not_match():
+    product, stats = lookup({"title": "Kestrel Bluetooth Speaker", "url": "[Product URL]"})
+    assert product is None
+    assert stats["unmatched"] == 1
+    # Two shared words are not enough to claim a product
+    assert lookup({"title": "Wireless Headphones for Kids", "url": ""})[0] is None
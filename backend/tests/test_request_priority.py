@@ -0,0 +1,53 @@
+from services import precompute
+
+
+def warm(api, session_id, categories):
+    user_data = api.user_sessions.get(session_id)["user_data"]
+    domain = api.request_amazon_domain(session_id, user_data)
+    for category in categories:
+        key = api.search_cache_key(category, domain, api.RESULTS_PER_CATEGORY, user_data["budget_range"])
+        api.search_cache.set(key, [])
+
+
+def request(session_id, text):
+    return {"session_id": session_id, "shopping_input": {"shoppingInput": text}}
+
+
+def local_categories(api, session_id, text):
+    user_data = api.user_sessions.get(session_id)["user_data"]
+    return api.local_categories(api.classify_request({"shoppingInput": text}, user_data))
+
+
+def test_request_with_every_category_cached_is_fast(api, session_id, fast_scraper):
+    categories = local_categories(api, session_id, "headphones")
+    assert categories
+    warm(api, session_id, categories)
+    assert api.request_priority(request(session_id, "headphones")) == "fast"
+
+
+def test_warmed_session_asking_for_other_categories_is_not_fast(api, session_id, fast_scraper, monkeypatch):
+    # The warm-up covered the profile's categories, not what this request searches
+    monkeypatch.setattr(
+        precompute, "get_precomputed",
+        lambda session_id: {"warmed_categories": ["Hiking Gear"], "amazon_domain": None},
+    )
+    warm(api, session_id, ["Hiking Gear"])
+    assert api.request_priority(request(session_id, "headphones")) == "interactive"
+
+
+def test_partly_cached_request_is_not_fast(api, session_id, fast_scraper):
+    categories = local_categories(api, session_id, "headphones")
+    warm(api, session_id, categories[:-1])
+    assert api.request_priority(request(session_id, "headphones")) == "interactive"
+
+
+def test_request_needing_gemini_categories_is_not_fast(api, session_id, fast_scraper):
+    # Too vague for local categories, Gemini picks them
+    assert local_categories(api, session_id, "something nice") == []
+    assert api.request_priority(request(session_id, "something nice")) == "interactive"
+
+
+def test_client_can_lower_but_not_raise_priority(api, session_id, fast_scraper):
+    warm(api, session_id, local_categories(api, session_id, "headphones"))
+    assert api.request_priority({**request(session_id, "headphones"), "priority": "background"}) == "background"
+    assert api.request_priority({**request(session_id, "something"), "priority": "fast"}) == "interactive"
@@ -0,0 +1,47 @@
+from services import response_cache
+
+USER_DATA = {
+    "age": 30,
+    "favorite_categories": ["sports-fitness", "books-media"],
+    "interests": "hiking",
+    "budget_range": "10-200",
+}
+
+
+def key(user_data=USER_DATA, shopping_input=None, ranking_mode=None):
+    return response_cache.response_cache_key(
+        user_data, shopping_input or {"shoppingInput": "trail running shoes"}, ranking_mode
+    )
+
+
+def test_cosmetic_differences_share_a_key():
+    reordered = dict(USER_DATA, favorite_categories=["books-media", "sports-fitness"], interests="  Hiking ")
+    assert key(reordered, {"shoppingInput": "Trail  running shoes ", "occasion": ""}) == key()
+
+
+def test_differences_that_change_the_result_change_the_key():
+    assert key(dict(USER_DATA, budget_range="10-50")) != key()
+    assert key(shopping_input={"shoppingInput": "road running shoes"}) != key()
+    assert key(ranking_mode="local") != key()
+
+
+def test_only_complete_successful_responses_are_cacheable():
+    assert response_cache.cacheable({"status": "success", "products": []})
+    assert not response_cache.cacheable({"status": "error"})
+    assert not response_cache.cacheable({"status": "success", "note": "Sample products"})
+    assert not response_cache.cacheable({"status": "success", "partial": True})
+
+
+def test_stored_response_is_served_marked_cached(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    cache_key = key(shopping_input={"shoppingInput": "cached test request"})
+    response_cache.store_response(cache_key, {"status": "success", "products": [{"id": "1"}]})
+    cached = response_cache.get_cached_response(cache_key)
+    assert cached == {"status": "success", "products": [{"id": "1"}], "cached": True}
+
+
+def test_partial_response_is_not_stored(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    cache_key = key(shopping_input={"shoppingInput": "partial test request"})
+    response_cache.store_response(cache_key, {"status": "success", "partial": True, "products": []})
+    assert response_cache.get_cached_response(cache_key) is None
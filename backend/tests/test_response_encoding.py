@@ -0,0 +1,77 @@
+import gzip
+import json
+
+from utils import response_encoding
+from utils.response_encoding import compress, negotiate_encoding, requested_fields, to_v2
+
+RESPONSE = {
+    "status": "success",
+    "products": [
+        {"id": "1", "name": "Trail shoes", "price": 80, "currency": "$", "rating": 4.5, "reasoning": "Grippy"},
+        {"id": "2", "name": "Socks", "price": 12, "currency": "$", "rating": 4.1, "reasoning": "Warm"},
+    ],
+    "ai_recommendations": '[{"name": "Trail shoes"}]',
+    "ranking": "local",
+}
+
+
+def test_v2_lists_products_once_with_a_shared_currency():
+    compact = to_v2(RESPONSE)
+    assert compact["format"] == "v2"
+    assert "ai_recommendations" not in compact
+    assert compact["currency"] == "$"
+    assert all("currency" not in product for product in compact["products"])
+    assert compact["ranking"] == "local"
+
+
+def test_v2_keeps_per_product_currency_when_they_differ():
+    mixed = dict(RESPONSE, products=[dict(RESPONSE["products"][0]), dict(RESPONSE["products"][1], currency="€")])
+    compact = to_v2(mixed)
+    assert "currency" not in compact
+    assert [product["currency"] for product in compact["products"]] == ["$", "€"]
+
+
+def test_v2_field_selection_always_keeps_the_id():
+    fields = requested_fields({"fields": "price,name,unknown"})
+    assert fields == ["id", "name", "price"]
+    assert to_v2(RESPONSE, fields)["products"][0] == {"id": "1", "name": "Trail shoes", "price": 80}
+
+
+def test_error_responses_are_unchanged():
+    error = {"status": "error", "message": "Invalid session"}
+    assert to_v2(error) is error
+
+
+def test_small_bodies_are_not_compressed():
+    assert compress(b"{}", "gzip") == (b"{}", None)
+
+
+def test_large_bodies_are_compressed_when_accepted(monkeypatch):
+    monkeypatch.setattr(response_encoding, "brotli", None)
+    body = json.dumps(RESPONSE).encode() * 50
+    compressed, encoding = compress(body, "gzip, deflate")
+    assert encoding == "gzip"
+    assert gzip.decompress(compressed) == body
+    assert compress(body, "identity") == (body, None)
+
+
+def test_refused_codings_are_not_chosen(monkeypatch):
+    monkeypatch.setattr(response_encoding, "brotli", None)
+    assert negotiate_encoding("gzip;q=0, br") is None
+    assert negotiate_encoding("*") == "gzip"
+
+
+def test_job_result_answers_if_none_match_with_304(api):
+    job = api.job_store.create("etag-session", {})
+    job.finish(RESPONSE)
+    client = api.app.test_client()
+    url = f"/api/shopping-recommendations/jobs/{job.id}?format=v2"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.get_json()["job"]["result"]["format"] == "v2"
+    etag = first.headers["ETag"]
+
+    second = client.get(url, headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.get_data() == b""
@@ -0,0 +1,145 @@
+import threading
+import time
+
+from services.scrape_scheduler import ScrapeScheduler, scrape_category
+from utils.cancellation import CancellationToken
+
+
+def hold_worker(scheduler, domain="amazon.com"):
+    """Occupy a worker until the returned event is set"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit(hold, session_id="holder", domain=domain)
+    assert started.wait(2)
+    return release
+
+
+def test_sessions_are_served_round_robin():
+    scheduler = ScrapeScheduler(max_concurrency=1)
+    release = hold_worker(scheduler)
+    order = []
+    futures = [
+        scheduler.submit(order.append, args=(session,), session_id=session, domain="amazon.com")
+        for session in ["a", "a", "a", "a", "b", "b"]
+    ]
+    release.set()
+    for future in futures:
+        future.result(timeout=2)
+    # The session with a long queue doesn't hold back the other one
+    assert order == ["a", "b", "a", "b", "a", "a"]
+
+
+def test_domain_concurrency_is_capped():
+    scheduler = ScrapeScheduler(max_concurrency=4, per_domain=2)
+    lock = threading.Lock()
+    running = [0, 0]  # current, peak
+
+    def fetch():
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    futures = [scheduler.submit(fetch, session_id=str(i), domain="amazon.com") for i in range(6)]
+    for future in futures:
+        future.result(timeout=2)
+    assert running[1] == 2
+
+
+def test_background_tasks_wait_for_request_tasks():
+    scheduler = ScrapeScheduler(max_concurrency=1)
+    release = hold_worker(scheduler)
+    order = []
+    futures = [
+        scheduler.submit(order.append, args=("warm",), session_id="w", domain="amazon.com", background=True),
+        scheduler.submit(order.append, args=("live1",), session_id="a", domain="amazon.com"),
+        scheduler.submit(order.append, args=("live2",), session_id="b", domain="amazon.com"),
+    ]
+    assert scheduler.get_stats()["background_queue_depth"] == 1
+    release.set()
+    for future in futures:
+        future.result(timeout=2)
+    assert order == ["live1", "live2", "warm"]
+
+
+def test_background_concurrency_is_capped():
+    scheduler = ScrapeScheduler(max_concurrency=4, background_limit=1)
+    lock = threading.Lock()
+    running = [0, 0]  # current, peak
+
+    def fetch():
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    futures = [
+        scheduler.submit(fetch, session_id=str(i), domain="amazon.com", background=True) for i in range(3)
+    ]
+    for future in futures:
+        future.result(timeout=2)
+    assert running[1] == 1
+    assert scheduler.get_stats()["background_running"] == 0
+
+
+def test_expired_and_cancelled_tasks_are_dropped():
+    scheduler = ScrapeScheduler(max_concurrency=1)
+    release = hold_worker(scheduler)
+    ran = []
+    token = CancellationToken()
+    expired = scheduler.submit(ran.append, args=("expired",), domain="amazon.com", deadline=time.monotonic() + 0.01)
+    cancelled = scheduler.submit(ran.append, args=("cancelled",), domain="amazon.com", cancel_token=token)
+    token.cancel()
+    time.sleep(0.05)
+    release.set()
+
+    give_up = time.monotonic() + 2
+    # Counted once the task has been dropped
+    while scheduler.get_stats()["expired"] + scheduler.get_stats()["dropped"] < 2 and time.monotonic() < give_up:
+        time.sleep(0.01)
+    assert expired.cancelled() and cancelled.cancelled()
+    assert ran == []
+    stats = scheduler.get_stats()
+    assert stats["expired"] == 1
+    assert stats["dropped"] == 1
+
+
+def test_category_past_its_deadline_resolves_empty(monkeypatch):
+    from services import scrape_scheduler
+
+    monkeypatch.setattr(scrape_scheduler, "amazon_category_top_products", lambda *a, **k: ["url"])
+    scheduler = ScrapeScheduler(max_concurrency=1)
+    release = hold_worker(scheduler)
+    future = scrape_category(scheduler, "Headphones", "amazon.com", deadline=time.monotonic() + 0.01)
+    time.sleep(0.05)
+    release.set()
+    assert future.result(timeout=2) == ("Headphones", [])
+
+
+def test_cancelled_product_scrapes_are_not_logged_as_failures(monkeypatch, caplog):
+    from services import scrape_scheduler
+    from utils.cancellation import Cancelled
+
+    def scrape(url, cancel_token=None, deadline=None):
+        if url == "broken":
+            raise ValueError("page changed")
+        raise Cancelled("quorum reached")
+
+    monkeypatch.setattr(scrape_scheduler, "amazon_category_top_products", lambda *a, **k: ["stopped", "broken"])
+    monkeypatch.setattr(scrape_scheduler, "scrape_amazon_product", scrape)
+    scheduler = ScrapeScheduler(max_concurrency=1)
+    with caplog.at_level("DEBUG", logger=scrape_scheduler.logger.name):
+        assert scrape_category(scheduler, "Headphones", "amazon.com").result(timeout=2) == ("Headphones", [])
+
+    warnings = [r.getMessage() for r in caplog.records if r.levelname == "WARNING"]
+    assert len(warnings) == 1 and "page changed" in warnings[0]
+    assert any("quorum reached" in r.getMessage() for r in caplog.records if r.levelname == "DEBUG")
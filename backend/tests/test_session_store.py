@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from services import session_store as session_store_module
+from services.session_store import SessionStore, SQLiteSessionStore
+from utils.state_store import SQLiteStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return SessionStore(stripes=4)
+    return SQLiteSessionStore(SQLiteStore(str(tmp_path / "state.db")))
+
+
+def test_update_merges_fields(store):
+    store.create("s1", {"age": 30})
+    assert store.update("s1", results={"status": "success"})
+    assert store.get("s1") == {"user_data": {"age": 30}, "results": {"status": "success"}}
+
+
+def test_update_of_missing_session_does_not_create_it(store):
+    assert not store.update("missing", results={})
+    assert store.get("missing") is None
+
+
+def test_concurrent_updates_keep_every_field(store):
+    store.create("s1")
+
+    def worker(i):
+        for n in range(20):
+            store.update("s1", **{f"field_{i}": n})
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    session = store.get("s1")
+    assert all(session[f"field_{i}"] == 19 for i in range(8))
+
+
+def test_update_racing_delete_does_not_resurrect_the_session(monkeypatch):
+    store = SessionStore(stripes=1)
+    store.create("s1")
+    estimate_size = session_store_module.estimate_size
+    deleter = threading.Thread(target=store.delete, args=("s1",))
+
+    def delete_during_write(session):
+        # Runs while update is writing the merged session
+        deleter.start()
+        deleter.join(0.1)
+        return estimate_size(session)
+
+    monkeypatch.setattr(session_store_module, "estimate_size", delete_during_write)
+    assert store.update("s1", results={})
+    monkeypatch.setattr(session_store_module, "estimate_size", estimate_size)
+
+    # The delete waited for the update and then removed the session
+    deleter.join(2)
+    assert store.get("s1") is None
+
+
+def test_update_of_expired_session_fails_and_notifies(store):
+    store.idle_ttl = 60
+    evicted = []
+    store.on_evict(evicted.append)
+    store.create("s1")
+    # Age the session past the idle TTL
+    if isinstance(store, SessionStore):
+        store._stripe("s1").entries["s1"][0] -= 120
+    else:
+        with store.store.transaction() as conn:
+            conn.execute("UPDATE sessions SET last_access = last_access - 120 WHERE id = 's1'")
+
+    assert not store.update("s1", results={})
+    assert store.get("s1") is None
+    assert evicted == ["s1"]
@@ -0,0 +1,197 @@
+import time
+
+import pytest
+
+from services import jobs
+from services.jobs import JobStore, RemoteJob
+from services.session_store import SQLiteSessionStore
+from utils.state_store import SQLiteCache, SQLiteStore
+
+
+@pytest.fixture
+def stores(tmp_path):
+    """Two SQLiteStores on one database file, standing in for two worker processes"""
+    path = str(tmp_path / "state.db")
+    return SQLiteStore(path), SQLiteStore(path)
+
+
+def test_committed_writes_are_visible_to_the_other_store(stores):
+    first, second = stores
+    with first.transaction() as conn:
+        conn.execute("INSERT INTO cache (namespace, key, value, expires_at, accessed_at) VALUES ('n', 'k', '1', 0, 0)")
+    with pytest.raises(RuntimeError):
+        with first.transaction() as conn:
+            conn.execute("DELETE FROM cache")
+            raise RuntimeError("rolled back")
+    assert second.query("SELECT key FROM cache") == [("k",)]
+
+
+def test_cache_entries_are_shared(stores):
+    first, second = (SQLiteCache(store, "search") for store in stores)
+    first.set("headphones", ["url"])
+    assert second.get("headphones") == ["url"]
+    assert "headphones" in second
+    assert second.pop("headphones") == ["url"]
+    assert first.get("headphones") is None
+    # Namespaces don't see each other's keys
+    SQLiteCache(stores[0], "product").set("headphones", 1)
+    assert second.get("headphones") is None
+
+
+def test_cache_ttl_applies_across_stores(stores):
+    first, second = (SQLiteCache(store, "search", ttl=60) for store in stores)
+    first.set("short", 1, ttl=0.05)
+    first.set("long", 2)
+    time.sleep(0.1)
+    assert second.get("short") is None
+    assert second.get("long") == 2
+    assert len(second) == 1
+
+
+def test_cache_evicts_the_least_recently_used_entry_of_both(stores):
+    first, second = (SQLiteCache(store, "search", max_entries=2) for store in stores)
+    first.set("a", 1)
+    second.set("b", 2)
+    time.sleep(0.01)
+    # Read through the other store, so "b" is now the least recently used
+    first.get("a")
+    second.set("c", 3)
+    assert first.get("b") is None
+    assert first.get("a") == 1 and first.get("c") == 3
+    assert second.get_stats()["evictions"] == 1
+
+
+def test_sessions_are_shared(stores):
+    first, second = (SQLiteSessionStore(store) for store in stores)
+    first.create("s1", {"age": 30})
+    assert second.update("s1", results={"status": "success"})
+    assert first.get("s1") == {"user_data": {"age": 30}, "results": {"status": "success"}}
+    assert second.delete("s1")
+    assert first.get("s1") is None
+    assert "s1" not in first
+
+
+def test_session_expired_in_one_store_is_gone_for_both(stores):
+    first, second = (SQLiteSessionStore(store, idle_ttl=60) for store in stores)
+    evicted = []
+    second.on_evict(evicted.append)
+    first.create("s1")
+    with stores[0].transaction() as conn:
+        conn.execute("UPDATE sessions SET last_access = last_access - 120 WHERE id = 's1'")
+
+    assert second.get("s1") is None
+    assert first.get("s1") is None
+    # The process that dropped it is notified
+    assert evicted == ["s1"]
+
+
+def test_session_eviction_counts_every_store_s_sessions(stores):
+    first, second = (SQLiteSessionStore(store, max_entries=2) for store in stores)
+    evicted = []
+    second.on_evict(evicted.append)
+    first.create("s1")
+    time.sleep(0.01)
+    first.create("s2")
+    time.sleep(0.01)
+    second.create("s3")
+
+    assert evicted == ["s1"]
+    assert first.get("s1") is None
+    assert len(first) == 2
+
+
+def test_job_is_visible_as_remote_job(stores):
+    owner, other = (JobStore(state=store) for store in stores)
+    job = owner.create("s1", {"shopping_input": {}})
+    job.start()
+    job.update("scraping", categories_dispatched=2)
+
+    remote = other.get(job.id)
+    assert isinstance(remote, RemoteJob)
+    assert remote.status == "running"
+    assert remote.stage == "scraping"
+    assert remote.to_dict()["progress"] == {"categories_dispatched": 2}
+    assert other.latest_for_session("s1").id == job.id
+    assert other.running_elsewhere("s1").id == job.id
+    assert owner.running_elsewhere("s1") is None
+
+    job.finish({"status": "success"})
+    assert not remote.finished
+    remote.refresh()
+    assert remote.finished
+    assert remote.result == {"status": "success"}
+    assert remote.http_status == 200
+
+
+def test_remote_job_streams_events(stores):
+    owner, other = (JobStore(state=store) for store in stores)
+    job = owner.create("s1", {})
+    remote = other.get(job.id)
+    job.publish("category", {"category": "Running shoes"})
+
+    events = remote.events_since(-1, timeout=1)
+    assert events == [(0, "category", {"category": "Running shoes"})]
+    started = time.monotonic()
+    assert remote.events_since(0, timeout=0.3) == []
+    assert time.monotonic() - started >= 0.3
+
+    job.finish({"status": "success"})
+    events = remote.events_since(0, timeout=1)
+    assert [event for _, event, _ in events] == ["result"]
+    assert remote.last_event_id == 1
+    # A finished job returns at once instead of waiting for more
+    remote.refresh()
+    started = time.monotonic()
+    assert remote.events_since(1, timeout=5) == []
+    assert time.monotonic() - started < 1
+
+
+def test_remote_cancel_stops_the_owner_s_job(stores):
+    owner, other = (JobStore(state=store) for store in stores)
+    job = owner.create("s1", {})
+    job.start()
+
+    assert other.get(job.id).cancel("cancelled elsewhere")
+    # Picked up at the owner's next progress update
+    job.update("scraping")
+    assert job.cancel_token.cancelled
+
+
+def test_expired_jobs_are_pruned_from_the_shared_store(stores):
+    owner, other = (JobStore(state=store, ttl=60) for store in stores)
+    job = owner.create("s1", {})
+    job.finish({"status": "success"})
+    assert other.get(job.id) is not None
+    with stores[0].transaction() as conn:
+        conn.execute("UPDATE jobs SET finished_at = finished_at - 120 WHERE id = ?", (job.id,))
+
+    # Pruned by whichever process creates the next job
+    other.create("s2", {})
+    assert other.get(job.id) is None
+    assert stores[0].query("SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job.id,)) == [(0,)]
+
+
+def test_job_evicted_locally_is_still_served_from_the_store(stores):
+    owner = JobStore(state=stores[0], max_jobs=1)
+    first = owner.create("s1", {})
+    first.finish({"status": "success"})
+    # The cap is enforced before each new job is added: s3 finds two jobs and drops the finished one
+    owner.create("s2", {})
+    owner.create("s3", {})
+
+    evicted = owner.get(first.id)
+    assert isinstance(evicted, RemoteJob)
+    assert evicted.result == {"status": "success"}
+
+
+def test_job_of_a_dead_worker_turns_failed(stores, monkeypatch):
+    owner, other = (JobStore(state=store) for store in stores)
+    job = owner.create("s1", {})
+    job.start()
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0)
+    time.sleep(0.01)
+
+    remote = other.get(job.id)
+    assert remote.finished
+    assert remote.status == "failed"
+    assert remote.http_status == 500
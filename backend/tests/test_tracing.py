@@ -0,0 +1,116 @@
+import contextvars
+import os
+import re
+import threading
+import time
+
+from utils import tracing
+from utils.tracing import Trace, profiled, span, use_trace
+
+SERVER_TIMING_ENTRY = re.compile(r'^[a-z_]+;dur=\d+\.\d;desc="\d+x"$')
+
+
+def test_server_timing_sums_spans_per_name_slowest_first():
+    trace = Trace("t1")
+    with use_trace(trace):
+        for _ in range(2):
+            with span("product_scrape"):
+                time.sleep(0.02)
+        with span("gemini_call"):
+            time.sleep(0.01)
+        with span("ranking"):
+            pass
+
+    total, *entries = trace.server_timing().split(", ")
+
+    assert re.fullmatch(r"total;dur=\d+\.\d", total)
+    assert all(SERVER_TIMING_ENTRY.match(entry) for entry in entries)
+    assert [entry.split(";")[0] for entry in entries] == ["product_scrape", "gemini_call", "ranking"]
+    assert entries[0].endswith('desc="2x"')
+    assert float(entries[0].split(";")[1][len("dur="):]) >= 40
+    assert len(trace.server_timing(limit=1).split(", ")) == 2
+
+
+def test_spans_nest_across_threads():
+    trace = Trace("t2")
+
+    def scrape():
+        with span("product_scrape", category="Headphones"):
+            pass
+
+    with use_trace(trace):
+        with span("request") as request:
+            with span("category_llm"):
+                pass
+            # Work queued from the request keeps its context in the worker thread
+            worker = threading.Thread(target=contextvars.copy_context().run, args=(scrape,))
+            worker.start()
+            worker.join()
+            running = {s["name"]: s for s in trace.to_dict()["spans"]}
+
+    spans = {s["name"]: s for s in trace.to_dict()["spans"]}
+    assert spans["request"]["parent_id"] is None
+    assert spans["category_llm"]["parent_id"] == request.id
+    assert spans["product_scrape"]["parent_id"] == request.id
+    assert spans["product_scrape"]["thread"] != spans["request"]["thread"]
+    assert spans["product_scrape"]["attrs"] == {"category": "Headphones"}
+    # Open spans are reported as unfinished
+    assert not running["request"]["finished"]
+    assert running["category_llm"]["finished"]
+    assert all(s["finished"] for s in spans.values())
+
+
+def test_spans_outside_a_trace_are_no_ops():
+    with span("orphan") as orphan:
+        assert orphan is None
+    trace = Trace("t3")
+    with use_trace(trace):
+        with span("outer"):
+            # A new trace on the same thread starts without a parent span
+            with use_trace(Trace("t4")) as inner:
+                with span("inner") as first:
+                    pass
+    assert first.parent_id is None
+    assert [s["name"] for s in inner.to_dict()["spans"]] == ["inner"]
+
+
+def test_spans_past_the_cap_are_counted_not_kept(monkeypatch):
+    monkeypatch.setattr(tracing, "MAX_SPANS", 3)
+    trace = Trace("t5")
+    with use_trace(trace):
+        for _ in range(5):
+            with span("product_scrape"):
+                pass
+    assert len(trace.spans) == 3
+    assert trace.to_dict()["dropped_spans"] == 2
+
+
+def test_profiling_is_off_unless_enabled(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(tracing, "PROFILING_ENABLED", False)
+    trace = Trace("off", profile=True)
+    with use_trace(trace), profiled():
+        sum(range(1000))
+    assert not trace.profile
+    assert trace.save_profile() is None
+
+    monkeypatch.setattr(tracing, "PROFILING_ENABLED", True)
+    # Enabled, but only requests that ask for a profile get one
+    unasked = Trace("unasked")
+    with use_trace(unasked), profiled():
+        sum(range(1000))
+    assert unasked.save_profile() is None
+
+    trace = Trace("on", profile=True)
+    with use_trace(trace), profiled():
+        sum(range(1000))
+    path = trace.save_profile()
+    assert path == os.path.join(str(tmp_path), "on.prof")
+    assert os.path.getsize(path) > 0
+
+
+def test_profile_download_is_disabled_by_default(api):
+    assert not api.PROFILING_ENABLED
+    response = api.app.test_client().get(f"/api/shopping-recommendations/jobs/{'0' * 32}/profile")
+    assert response.status_code == 404
+    assert response.get_json()["message"] == "Profiling is disabled"
@@ -0,0 +1,205 @@
+"""
+Local stand-in for Amazon search and product pages so the scraper can be load-tested offline.
+
+Search pages list result links for any query, product pages carry the
+title, price, image and rating markup the scraper parses. Both are padded
+with filler markup to a realistic size, since parsing is a large part of
+the cost of a scrape. Latency, jitter and the share of 503 robot-check
+answers are configurable.
+
+Usage (from the backend directory):
+    python tools/mock_amazon_server.py --port 8082 --latency 0.3 --jitter 0.1 --error-rate 0.05
+    AMAZON_BASE_URL=http://127.0.0.1:8082 python main.py
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RESULTS_PER_PAGE = 16
+
+ADJECTIVES = ["Pro", "Lite", "Max", "Plus", "Classic", "Sport", "Travel", "Studio", "Mini", "Ultra"]
+BRANDS = ["Acme", "Nimbus", "Orbit", "Vertex", "Lumen", "Kestrel", "Quartz", "Harbor"]
+
+SEARCH_RESULT = """
+<div data-component-type="s-search-result" data-asin="{asin}" class="s-result-item">
+  <h2><a class="a-link-normal" href="/{slug}/dp/{asin}/ref=sr_1_{position}">
+    <span class="a-size-medium">{title}</span></a></h2>
+  <span class="a-price"><span class="a-offscreen">{price}</span></span>
+</div>"""
+
+PRODUCT_PAGE = """<!doctype html>
+<html><head><title>{title}</title></head><body>
+<div id="dp-container">
+  <h1 id="title"><span id="productTitle" class="a-size-large product-title-word-break">{title}</span></h1>
+  <div id="averageCustomerReviews"><i class="a-icon a-icon-star a-star-4-5"><span class="a-icon-alt">{rating} out of 5 stars</span></i></div>
+  <div id="corePrice"><span class="a-price"><span class="a-offscreen">{price}</span><span class="a-price-whole">{price_whole}</span></span></div>
+  <div id="imgTagWrapperId"><img id="landingImage" src="{image}" data-old-hires="{image}"></div>
+  {filler}
+</div></body></html>"""
+
+ROBOT_CHECK = """<!doctype html>
+<html><head><title>Sorry! Something went wrong!</title></head>
+<body><p>To discuss automated access to Amazon data please contact api-services-support@amazon.com.</p></body></html>"""
+
+stats = {"requests": 0, "search": 0, "product": 0, "errors": 0, "not_found": 0}
+stats_lock = threading.Lock()
+
+
+def count(key):
+    with stats_lock:
+        stats[key] += 1
+
+
+def asin_for(query, position):
+    digest = hashlib.sha1(f"{query.lower()}|{position}".encode("utf-8")).hexdigest().upper()
+    return "B0" + digest[:8]
+
+
+def product_for(asin):
+    """Title, price and rating of a product, derived from its ASIN so every page agrees"""
+    rng = random.Random(asin)
+    return {
+        "title": f"{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {asin[-4:]}",
+        "price": round(rng.uniform(5, 400), 2),
+        "rating": round(rng.uniform(3.0, 5.0), 1),
+    }
+
+
+def filler_markup(size_bytes, seed):
+    """Nested divs and spans of about size_bytes, shaped like product detail sections"""
+    rng = random.Random(seed)
+    parts = []
+    written = 0
+    row = 0
+    while written < size_bytes:
+        words = " ".join(rng.choice(BRANDS + ADJECTIVES).lower() for _ in range(8))
+        part = (
+            f'<div class="a-section a-spacing-small" id="feature-{row}">'
+            f'<span class="a-list-item">{words}</span><a href="/gp/help/{row}">details</a></div>\n'
+        )
+        parts.append(part)
+        written += len(part)
+        row += 1
+    return "".join(parts)
+
+
+class MockAmazonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    def send_body(self, status, body, content_type="text/html; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def simulated_latency(self):
+        return max(0.0, self.config.latency + random.uniform(-1, 1) * self.config.jitter)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") == "/stats":
+            with stats_lock:
+                self.send_body(200, json.dumps(stats), "application/json")
+            return
+
+        count("requests")
+        time.sleep(self.simulated_latency())
+        if random.random() < self.config.error_rate:
+            count("errors")
+            self.send_body(503, ROBOT_CHECK)
+            return
+
+        product_match = re.search(r"/dp/([A-Z0-9]{10})", url.path)
+        if url.path == "/s":
+            count("search")
+            self.send_body(200, self.search_page(parse_qs(url.query).get("k", [""])[0]))
+        elif product_match:
+            count("product")
+            self.send_body(200, self.product_page(product_match.group(1)))
+        else:
+            count("not_found")
+            self.send_body(404, "<html><body>Page not found</body></html>")
+
+    def search_page(self, query):
+        results = []
+        for position in range(1, RESULTS_PER_PAGE + 1):
+            asin = asin_for(query, position)
+            product = product_for(asin)
+            title = f"{product['title']} {query.title()}"
+            results.append(SEARCH_RESULT.format(
+                asin=asin,
+                slug=re.sub(r"[^A-Za-z0-9]+", "-", title).strip("-"),
+                position=position,
+                title=html.escape(title),
+                price=f"${product['price']:,.2f}",
+            ))
+        filler = filler_markup(self.config.page_kb * 1024, query)
+        return f"<!doctype html><html><body><div class=\"s-search-results\">{''.join(results)}</div>{filler}</body></html>"
+
+    def product_page(self, asin):
+        product = product_for(asin)
+        return PRODUCT_PAGE.format(
+            title=html.escape(product["title"]),
+            rating=product["rating"],
+            price=f"${product['price']:,.2f}",
+            price_whole=f"{int(product['price']):,}",
+            image=f"https://m.media-amazon.com/images/I/{asin}._AC_SL1500_.jpg",
+            filler=filler_markup(self.config.page_kb * 1024, asin),
+        )
+
+
+def make_server(host="127.0.0.1", port=8082, latency=0.3, jitter=0.0, error_rate=0.0, page_kb=150, verbose=False):
+    """Build a mock Amazon server, call serve_forever() on it or run it in a thread"""
+    config = argparse.Namespace(
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        page_kb=max(0, page_kb),
+        verbose=verbose,
+    )
+    handler = type("ConfiguredMockAmazonHandler", (MockAmazonHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of Amazon search and product pages")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.3, help="mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of pages answered with 503")
+    parser.add_argument("--page-kb", type=int, default=150, help="filler markup added to every page")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host, args.port, args.latency, args.jitter, args.error_rate, args.page_kb, args.verbose
+    )
+    print(f"Mock Amazon listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Local stand-in for the Gemini API so the pipeline can be load-tested offline.
+
+Serves generateContent and streamGenerateContent with canned category
+lists and ranking responses built from the products in the ranking prompt,
+and a cachedContents endpoint so prompt prefix caching can be exercised.
+
+Usage (from the backend directory):
+    python tools/mock_gemini_server.py --port 8081 --latency 0.8 --jitter 0.3 --error-rate 0.05
+    GEMINI_API_BASE=http://127.0.0.1:8081/v1beta python main.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_CATEGORIES = {
+    "music": [
+        "Wireless noise cancelling headphones",
+        "Portable Bluetooth speakers",
+        "Vinyl record players",
+        "Studio monitor headphones",
+        "Acoustic guitar starter kits",
+        "Music streaming gift cards",
+        "Guitar accessories",
+    ],
+    "gaming": [
+        "Mechanical gaming keyboards",
+        "Wireless gaming mice",
+        "Gaming headsets with microphone",
+        "Nintendo Switch accessories",
+        "PlayStation controllers",
+        "Ergonomic gaming chairs",
+        "RGB mouse pads",
+    ],
+    "sports": [
+        "Running shoes",
+        "Fitness tracker watches",
+        "Non-slip yoga mats",
+        "Adjustable dumbbells",
+        "Insulated sports water bottles",
+        "Resistance band sets",
+        "Gym duffel bags",
+    ],
+    "default": [
+        "Wireless earbuds",
+        "Smart home speakers",
+        "Portable power banks",
+        "Kindle e-readers",
+        "Travel backpacks",
+        "Insulated coffee tumblers",
+        "LED desk lamps",
+    ],
+}
+
+RANKING_MARKER = "Amazon Scraper Results:"
+
+stats = {
+    "requests": 0,
+    "generate": 0,
+    "stream": 0,
+    "errors": 0,
+    "cache_created": 0,
+    "cache_rejected": 0,
+    "cache_hits": 0,
+    "cache_misses": 0,
+}
+stats_lock = threading.Lock()
+
+# cachedContents/<id> -> (expires_at, instruction text)
+cached_contents = {}
+
+
+def count(key):
+    with stats_lock:
+        stats[key] += 1
+
+
+def parts_text(content):
+    return "".join(part.get("text", "") for part in (content or {}).get("parts", []))
+
+
+def parse_ttl(ttl):
+    try:
+        return float(str(ttl or "3600s").rstrip("s"))
+    except ValueError:
+        return 3600.0
+
+
+def prompt_text(body):
+    """All text parts of a generateContent request body, including the system instruction"""
+    texts = [parts_text(body.get("systemInstruction"))]
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            texts.append(part.get("text", ""))
+    return "\n".join(texts)
+
+
+def category_response(prompt):
+    lowered = prompt.lower()
+    for theme in ("music", "gaming", "sports"):
+        if theme in lowered:
+            categories = CANNED_CATEGORIES[theme]
+            break
+    else:
+        categories = CANNED_CATEGORIES["default"]
+    return "\n".join(f"* {category}" for category in categories)
+
+
+def ranking_response(prompt):
+    """Echo the products from the ranking prompt back in the expected output format"""
+    products = []
+    start = prompt.find(RANKING_MARKER)
+    if start != -1:
+        payload = prompt[start + len(RANKING_MARKER):].lstrip()
+        try:
+            products, _ = json.JSONDecoder().raw_decode(payload)
+        except ValueError:
+            products = []
+
+    blocks = []
+    for product in products:
+        blocks.append(
+            f"Product: {product.get('title', 'Unknown product')}\n"
+            f"URL: {product.get('url', '')}\n"
+            f"Price: {product.get('price_value') or 0}\n"
+            f"Rating: {product.get('average_rating') or 4.0}\n"
+            f"Image URL: {product.get('image_url', '')}\n"
+            "Reasoning: Matches the user's stated interests and fits the budget."
+        )
+    return "\n\n".join(blocks)
+
+
+def response_text(prompt):
+    if RANKING_MARKER in prompt:
+        return ranking_response(prompt)
+    return category_response(prompt)
+
+
+def candidate_json(text, usage=None):
+    payload = {
+        "candidates": [
+            {"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}
+        ]
+    }
+    if usage:
+        payload["usageMetadata"] = usage
+    return payload
+
+
+def usage_metadata(prompt, cached_text, output):
+    """Token counts in the shape Gemini reports them, about 4 characters per token"""
+    prompt_tokens = len(prompt) // 4
+    cached_tokens = len(cached_text) // 4
+    output_tokens = len(output) // 4
+    usage = {
+        "promptTokenCount": prompt_tokens + cached_tokens,
+        "candidatesTokenCount": output_tokens,
+        "totalTokenCount": prompt_tokens + cached_tokens + output_tokens,
+    }
+    if cached_tokens:
+        usage["cachedContentTokenCount"] = cached_tokens
+    return usage
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulated_latency(self):
+        return max(0.0, self.config.latency + random.uniform(-1, 1) * self.config.jitter)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with stats_lock:
+                self.send_json(200, dict(stats))
+        else:
+            self.send_json(404, {"error": {"message": "Not found"}})
+
+    def create_cached_content(self, body):
+        instruction = parts_text(body.get("systemInstruction"))
+        # Gemini refuses contexts below a minimum size, --min-cache-chars emulates that
+        if len(instruction) < self.config.min_cache_chars:
+            count("cache_rejected")
+            self.send_json(400, {"error": {"message": "Cached content is too small"}})
+            return
+        name = "cachedContents/" + hashlib.sha256(instruction.encode("utf-8")).hexdigest()[:12]
+        with stats_lock:
+            cached_contents[name] = (time.monotonic() + parse_ttl(body.get("ttl")), instruction)
+        count("cache_created")
+        self.send_json(200, {"name": name, "model": body.get("model"), "ttl": body.get("ttl")})
+
+    def cached_text(self, name):
+        """Instruction text of a live cached content, or None"""
+        with stats_lock:
+            entry = cached_contents.get(name)
+            if entry and entry[0] < time.monotonic():
+                del cached_contents[name]
+                entry = None
+        count("cache_hits" if entry else "cache_misses")
+        return entry[1] if entry else None
+
+    def do_POST(self):
+        count("requests")
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.split("?")[0].rstrip("/") == "/v1beta/cachedContents":
+            self.create_cached_content(body)
+            return
+
+        match = re.match(r"^/v1beta/models/([^/:]+):(\w+)", self.path)
+        if not match:
+            self.send_json(404, {"error": {"message": "Unknown endpoint"}})
+            return
+
+        status = None
+        try:
+            status = self.config.failures.popleft()
+        except IndexError:
+            if random.random() < self.config.error_rate:
+                status = random.choice([429, 503])
+        if status is not None:
+            count("errors")
+            time.sleep(self.simulated_latency() / 4)
+            headers = {}
+            if self.config.retry_after is not None:
+                headers["Retry-After"] = f"{self.config.retry_after:g}"
+            self.send_json(status, {"error": {"message": "Simulated failure"}}, headers)
+            return
+
+        cached = ""
+        if body.get("cachedContent"):
+            cached = self.cached_text(body["cachedContent"])
+            if cached is None:
+                self.send_json(404, {"error": {"message": "Cached content not found"}})
+                return
+
+        method = match.group(2)
+        prompt = prompt_text(body)
+        try:
+            text = self.config.replies.popleft()
+        except IndexError:
+            text = response_text(cached + "\n" + prompt)
+        if method == "generateContent":
+            count("generate")
+            time.sleep(self.simulated_latency())
+            self.send_json(200, candidate_json(text, usage_metadata(prompt, cached, text)))
+        elif method == "streamGenerateContent":
+            count("stream")
+            self.stream(text)
+        else:
+            self.send_json(404, {"error": {"message": f"Unsupported method {method}"}})
+
+    def stream(self, text):
+        """Send the text as server-sent events spread over the simulated latency"""
+        if self.config.stream_chunk_chars:
+            # Event boundaries fall anywhere, also inside a line
+            size = self.config.stream_chunk_chars
+            chunks = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        else:
+            lines = text.splitlines(keepends=True)
+            chunk_size = max(1, len(lines) // self.config.stream_chunks)
+            chunks = ["".join(lines[i:i + chunk_size]) for i in range(0, len(lines), chunk_size)] or [""]
+        delay = self.simulated_latency() / len(chunks)
+
+        # Chunked transfer encoding like the real API, so clients see each event as it is sent
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for sent, chunk in enumerate(chunks):
+            if sent == self.config.stream_close_after:
+                # Drop the connection mid-response, without the terminating chunk
+                self.close_connection = True
+                return
+            time.sleep(delay)
+            event = f"data: {json.dumps(candidate_json(chunk))}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def make_server(
+    host="127.0.0.1",
+    port=8081,
+    latency=0.5,
+    jitter=0.0,
+    error_rate=0.0,
+    stream_chunks=4,
+    verbose=False,
+    min_cache_chars=0,
+    retry_after=None,
+):
+    """Build a mock Gemini server, call serve_forever() on it or run it in a thread.
+
+    Status codes appended to server.config.failures answer the next model
+    calls in order, before error_rate applies, and texts appended to
+    server.config.replies replace the canned response of the next calls.
+    server.config.stream_chunk_chars cuts streamed responses into events of
+    that many characters instead of whole lines, and
+    server.config.stream_close_after drops the connection after that many
+    events.
+    """
+    config = argparse.Namespace(
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        stream_chunks=max(1, stream_chunks),
+        verbose=verbose,
+        min_cache_chars=min_cache_chars,
+        retry_after=retry_after,
+        failures=deque(),
+        replies=deque(),
+        stream_chunk_chars=0,
+        stream_close_after=None,
+    )
+    handler = type("ConfiguredMockGeminiHandler", (MockGeminiHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.config = config
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Gemini generateContent API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.5, help="mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with 429/503")
+    parser.add_argument("--stream-chunks", type=int, default=4, help="events per streamed response")
+    parser.add_argument(
+        "--min-cache-chars", type=int, default=0, help="reject cachedContents smaller than this"
+    )
+    parser.add_argument(
+        "--retry-after", type=float, default=None, help="Retry-After seconds sent with simulated failures"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host,
+        args.port,
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.stream_chunks,
+        args.verbose,
+        args.min_cache_chars,
+        args.retry_after,
+    )
+    print(f"Mock Gemini API listening on http://{args.host}:{args.port}/v1beta")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
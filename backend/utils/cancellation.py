@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# A stage with less of the request's budget left than this is skipped, it couldn't finish
+MIN_STAGE_SECONDS = 0.5
+
+# Work given back when requests are cancelled, across all requests
+_stats_lock = threading.Lock()
+_stats = {
+    "cancelled_requests": 0,
+    "futures_dropped": 0,
+    "http_aborted": 0,
+    "retries_skipped": 0,
+    "gemini_calls_skipped": 0,
+    "stages_skipped_deadline": 0,
+    "budget_seconds_reclaimed": 0.0,
+}
+
+
+def record_reclaimed(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def get_cancellation_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["budget_seconds_reclaimed"] = round(stats["budget_seconds_reclaimed"], 3)
+    return stats
+
+
+class Cancelled(Exception):
+    """Raised inside a worker when the request it works for was cancelled"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when too little of the request's time budget is left to start a stage"""
+
+
+class CancellationToken:
+    """Shared flag that tells every stage of a request to stop.
+
+    Workers check it between steps, sleep on it instead of time.sleep so
+    backoff ends immediately, and register callbacks (e.g. closing an HTTP
+    response) that run the moment the request is cancelled.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Cancellation callback failed")
+        return True
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def sleep(self, seconds):
+        """Sleep unless cancelled first, returns True if the token was cancelled"""
+        return self._event.wait(seconds)
+
+    def on_cancel(self, callback):
+        """Run callback when the token is cancelled, returns a function that unregisters it"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                registered = True
+            else:
+                registered = False
+        if not registered:
+            callback()
+            return lambda: None
+
+        def unregister():
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+        return unregister
+
+    def child(self):
+        """A token cancelled with this one that can also be cancelled on its own.
+
+        Lets a request stop part of its work, e.g. the remaining scrapes,
+        without cancelling the request itself.
+        """
+        token = CancellationToken()
+        unregister = self.on_cancel(lambda: token.cancel(self.reason))
+        token.on_cancel(unregister)
+        return token
+
+
+def raise_if_cancelled(token):
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def time_left(deadline):
+    """Seconds until the monotonic deadline, None when there is no deadline"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def stage_timeout(timeout, deadline):
+    """timeout capped to the time left before deadline.
+
+    Raises DeadlineExceeded when less than MIN_STAGE_SECONDS is left.
+    """
+    remaining = time_left(deadline)
+    if remaining is None:
+        return timeout
+    if remaining < MIN_STAGE_SECONDS:
+        record_reclaimed("stages_skipped_deadline")
+        raise DeadlineExceeded(f"{max(remaining, 0):.2f}s left of the request budget")
+    return min(timeout, remaining)
+
+
+def cancellable_sleep(seconds, token=None, deadline=None):
+    """time.sleep that raises Cancelled as soon as token is cancelled, and never sleeps past deadline"""
+    remaining = time_left(deadline)
+    if remaining is not None:
+        seconds = max(0.0, min(seconds, remaining))
+    with span("sleep", seconds=round(seconds, 2)):
+        if token is None:
+            time.sleep(seconds)
+        elif token.sleep(seconds):
+            record_reclaimed("retries_skipped")
+            raise Cancelled(token.reason)
@@ -1,6 +1,9 @@
 import csv
 import os
 
+# Scrape this base URL for every location instead, e.g. tools/mock_amazon_server.py
+AMAZON_BASE_URL = os.getenv("AMAZON_BASE_URL", "").rstrip("/")
+
 
 def load_domain_mapping(csv_filepath="amazon_domain.csv"):
     domain_mapping = {}
@@ -36,19 +39,26 @@ def load_domain_mapping(csv_filepath="amazon_domain.csv"):
 _domain_mapping = load_domain_mapping()
 
 
+def base_url(domain):
+    """Scraper base URL for a mapped domain, the mapping stores bare host names"""
+    return domain.rstrip("/") if "://" in domain else f"https://{domain}"
+
+
 def get_amazon_domain(user_location):
     """
-    Returns the Amazon domain for the given user location (country name).
+    Returns the Amazon base URL (https://host) for the given user location (country name).
     If no exact match is found, tries partial match.
-    Returns None if no match found.
+    Falls back to amazon.com, AMAZON_BASE_URL overrides every location.
     """
+    if AMAZON_BASE_URL:
+        return AMAZON_BASE_URL
     user_location_lower = user_location.lower()
     # Exact match
     if user_location_lower in _domain_mapping:
-        return _domain_mapping[user_location_lower]
+        return base_url(_domain_mapping[user_location_lower])
     # Partial match
     for country, domain in _domain_mapping.items():
         if country in user_location_lower or user_location_lower in country:
-            return domain
+            return base_url(domain)
     # Return default domain if no match found
-    return "www.amazon.com"
+    return "https://www.amazon.com"
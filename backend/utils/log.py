@@ -0,0 +1,156 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" for people, "json" for one object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Records waiting for the writer thread, more are dropped rather than blocking a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Only 1 in this many records of each sampled message is written
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "20"))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+# Client supplied X-Request-ID values are only kept when they look like an id
+_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+_stats_lock = threading.Lock()
+_stats = {"dropped": 0, "sampled_out": 0}
+_configure_lock = threading.Lock()
+_listener = None
+_queue = None
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def resolve_request_id(header_value=None):
+    """The request's X-Request-ID when it is usable, otherwise a new id"""
+    if header_value and _REQUEST_ID_PATTERN.fullmatch(header_value):
+        return header_value
+    return uuid.uuid4().hex[:16]
+
+
+def set_request_id(request_id):
+    """Bind request_id to log records of this context, returns a token for reset_request_id"""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+@contextmanager
+def bind_request_id(request_id):
+    """Tag every record logged in the block, and in work queued from it, with request_id"""
+    token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the correlation id and samples high-volume messages.
+
+    Runs in the thread that logs, where the request's context is current.
+    Records logged with extra={"sample": key} are kept once every `every`
+    times per key and marked with the rate they were sampled at.
+    """
+
+    def __init__(self, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        record.request_id = _request_id.get() or "-"
+        key = getattr(record, "sample", None)
+        if key is None or self.every == 1:
+            return True
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % self.every:
+            with _stats_lock:
+                _stats["sampled_out"] += 1
+            return False
+        record.sample_rate = self.every
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of waiting when the queue is full"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _stats_lock:
+                _stats["dropped"] += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if getattr(record, "sample_rate", None):
+            entry["sample_rate"] = record.sample_rate
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """Route the root logger through a queue drained by one writer thread.
+
+    Request threads only format and enqueue; the listener thread does the
+    blocking writes to stdout. Safe to call more than once.
+    """
+    global _listener, _queue
+    with _configure_lock:
+        if _listener is not None:
+            return
+        _queue = queue.Queue(LOG_QUEUE_SIZE)
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+        handler = NonBlockingQueueHandler(_queue)
+        handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(handler)
+        _listener = QueueListener(_queue, output)
+        _listener.start()
+        # Flush what is still queued on shutdown
+        atexit.register(_listener.stop)
+
+
+def get_logging_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({
+        "level": LOG_LEVEL,
+        "format": LOG_FORMAT,
+        "queued": _queue.qsize() if _queue is not None else 0,
+        "queue_size": LOG_QUEUE_SIZE,
+        "sample_every": LOG_SAMPLE_EVERY,
+    })
+    return stats
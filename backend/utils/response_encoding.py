@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Product fields in the v2 format, "id" is always included
+V2_PRODUCT_FIELDS = ("id", "name", "price", "image", "buyUrl", "category", "rating", "reasoning")
+
+
+def wants_v2(*sources):
+    """True when a request asks for the v2 format via ?format=v2 or "format": "v2" in the body"""
+    return any(source and str(source.get("format", "")).lower() == "v2" for source in sources)
+
+
+def requested_fields(*sources):
+    """Product fields selected with ?fields=name,price or "fields": [...], None for all"""
+    for source in sources:
+        fields = source.get("fields") if source else None
+        if fields:
+            if isinstance(fields, str):
+                fields = fields.split(",")
+            selected = {field.strip() for field in fields} & set(V2_PRODUCT_FIELDS)
+            return ["id"] + [field for field in V2_PRODUCT_FIELDS if field in selected and field != "id"]
+    return None
+
+
+def to_v2(response, fields=None):
+    """Compact form of a recommendation response.
+
+    Products are listed once: the JSON-encoded ai_recommendations copy is
+    dropped, the currency shared by every product moves to the top level,
+    and fields optionally limits which product fields are sent. Error
+    responses are returned unchanged.
+    """
+    if not isinstance(response, dict) or response.get("status") != "success":
+        return response
+    products = response.get("products", [])
+    compact = {
+        key: value for key, value in response.items()
+        if key not in ("products", "ai_recommendations")
+    }
+    compact["format"] = "v2"
+    currencies = {product.get("currency") for product in products}
+    shared_currency = currencies.pop() if len(currencies) == 1 else None
+    if shared_currency is not None:
+        compact["currency"] = shared_currency
+    keep = fields or V2_PRODUCT_FIELDS
+    compact["products"] = [
+        {
+            key: value for key, value in product.items()
+            if key in keep or (key == "currency" and shared_currency is None)
+        }
+        for product in products
+    ]
+    return compact
+
+
+def etag_for(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def negotiate_encoding(accept_encoding):
+    """Best supported content coding in an Accept-Encoding header, or None"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    for coding in ("br", "gzip"):
+        if coding == "br" and brotli is None:
+            continue
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def compress(body, accept_encoding):
+    """Returns (body, encoding); the body is unchanged when it's small or nothing is accepted"""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), encoding
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), encoding
+    return body, None
+
+
+_stats_lock = threading.Lock()
+_payload_stats = {}  # "endpoint format" -> counters
+
+
+def record_payload(endpoint, response_format, raw_bytes, sent_bytes, encoding=None, not_modified=False):
+    key = f"{endpoint} {response_format}"
+    with _stats_lock:
+        stats = _payload_stats.setdefault(
+            key, {"responses": 0, "raw_bytes": 0, "sent_bytes": 0, "compressed": 0, "not_modified": 0}
+        )
+        stats["responses"] += 1
+        stats["raw_bytes"] += raw_bytes
+        stats["sent_bytes"] += sent_bytes
+        stats["compressed"] += 1 if encoding else 0
+        stats["not_modified"] += 1 if not_modified else 0
+
+
+def get_payload_stats():
+    with _stats_lock:
+        stats = {key: dict(value) for key, value in _payload_stats.items()}
+    for value in stats.values():
+        value["avg_raw_bytes"] = round(value["raw_bytes"] / value["responses"])
+        value["avg_sent_bytes"] = round(value["sent_bytes"] / value["responses"])
+        value["compression_ratio"] = (
+            round(value["sent_bytes"] / value["raw_bytes"], 3) if value["raw_bytes"] else None
+        )
+    return {"brotli_available": brotli is not None, "endpoints": stats}
@@ -0,0 +1,221 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.ttl_cache import TTLCache
+
+# "memory" keeps state in the process, "sqlite" shares it between processes on one host
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "backend_state.db")
+# How long a writer waits for another process' write lock
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_lru ON sessions (last_access);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    session_id TEXT,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, created_at);
+CREATE TABLE IF NOT EXISTS gemini_quota (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    granted_at REAL NOT NULL,
+    tokens INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS gemini_quota_window ON gemini_quota (granted_at);
+CREATE TABLE IF NOT EXISTS gemini_cooldown (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    event_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, event_id)
+);
+"""
+
+
+class SQLiteStore:
+    """SQLite database in WAL mode shared by every worker process on the host.
+
+    Each thread gets its own connection. WAL lets readers proceed while one
+    process writes, so a session created by one gunicorn worker is visible
+    to the others without sticky routing.
+    """
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.connection().executescript(_SCHEMA)
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        # Connections must not cross a fork, e.g. gunicorn --preload
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction, taking the database write lock up front to avoid upgrade deadlocks"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def query(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+
+class SQLiteCache:
+    """TTLCache with the entries kept in a SQLiteStore, values must be JSON serializable.
+
+    Hit and miss counters are per process; sizes are for the shared table.
+    """
+
+    def __init__(self, store, namespace, max_entries=1024, ttl=900):
+        self.store = store
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key)
+
+    def get(self, key, default=None):
+        now = time.time()
+        rows = self.store.query(
+            "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.namespace, self._key(key), now),
+        )
+        if not rows:
+            self._count("misses")
+            return default
+        with self.store.transaction() as conn:
+            conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, self._key(key)),
+            )
+        self._count("hits")
+        return json.loads(rows[0][0])
+
+    def __contains__(self, key):
+        return bool(self.store.query(
+            "SELECT 1 FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.namespace, self._key(key), time.time()),
+        ))
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, self._key(key), json.dumps(value), now + (ttl or self.ttl), now),
+            )
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+            (size,) = conn.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()
+            if size > self.max_entries:
+                conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                    (self.namespace, self.namespace, size - self.max_entries),
+                )
+                with self._lock:
+                    self.evictions += size - self.max_entries
+
+    def pop(self, key, default=None):
+        with self.store.transaction() as conn:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ?", (self.namespace, self._key(key))
+            ).fetchone()
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, self._key(key)))
+        return default if row is None else json.loads(row[0])
+
+    def clear(self):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def __len__(self):
+        return self.store.query(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ? AND expires_at > ?", (self.namespace, time.time())
+        )[0][0]
+
+    def get_stats(self):
+        size = len(self)
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "backend": "sqlite",
+            }
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def shared_store():
+    """The process' SQLiteStore when STATE_BACKEND is sqlite, otherwise None"""
+    global _shared_store
+    if STATE_BACKEND != "sqlite":
+        return None
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = SQLiteStore(STATE_DB_PATH)
+        return _shared_store
+
+
+def make_cache(namespace, max_entries=1024, ttl=900):
+    """TTLCache, or a SQLiteCache shared between processes when STATE_BACKEND is sqlite"""
+    store = shared_store()
+    if store is None:
+        return TTLCache(max_entries=max_entries, ttl=ttl)
+    return SQLiteCache(store, namespace, max_entries=max_entries, ttl=ttl)
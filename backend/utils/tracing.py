@@ -0,0 +1,171 @@
+import contextvars
+import cProfile
+import itertools
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-request profiles are only captured when this is on and the request asks for one
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Spans kept per trace, later ones are counted but dropped
+MAX_SPANS = 2000
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("id", "parent_id", "name", "attrs", "thread", "start", "end")
+
+    def __init__(self, span_id, parent_id, name, attrs):
+        self.id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Trace:
+    """Timed spans of one request, collected from every thread that works for it.
+
+    The trace and the enclosing span travel in contextvars, so a span opened
+    in a scrape worker becomes a child of the span that queued the work.
+    """
+
+    def __init__(self, trace_id, profile=False):
+        self.id = trace_id
+        self.started = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self.profile = profile and PROFILING_ENABLED
+        self._stats = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _add(self, name, parent, attrs):
+        with self._lock:
+            span = Span(next(self._ids), parent.id if parent else None, name, attrs)
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+        return span
+
+    def add_profile(self, profiler):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    def save_profile(self):
+        """Write the merged profile to PROFILE_DIR, returns its path or None"""
+        with self._lock:
+            if self._stats is None:
+                return None
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = profile_path(self.id)
+            self._stats.dump_stats(path)
+            return path
+
+    def server_timing(self, limit=8):
+        """Server-Timing header value: total time plus the slowest span names, summed per name"""
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            duration, count = totals.get(span.name, (0.0, 0))
+            totals[span.name] = (duration + span.duration, count + 1)
+        slowest = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        entries = [f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}"]
+        for name, (duration, count) in slowest:
+            entries.append(f'{name};dur={duration * 1000:.1f};desc="{count}x"')
+        return ", ".join(entries)
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+            dropped = self.dropped
+        return {
+            "trace_id": self.id,
+            "dropped_spans": dropped,
+            "spans": [
+                {
+                    "id": span.id,
+                    "parent_id": span.parent_id,
+                    "name": span.name,
+                    "thread": span.thread,
+                    "start_ms": round((span.start - self.started) * 1000, 2),
+                    "duration_ms": round(span.duration * 1000, 2),
+                    "finished": span.end is not None,
+                    **({"attrs": span.attrs} if span.attrs else {}),
+                }
+                for span in spans
+            ],
+        }
+
+
+def profile_path(trace_id):
+    return os.path.join(PROFILE_DIR, f"{trace_id}.prof")
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace):
+    """Make trace the current trace of this thread, e.g. in the worker running a job"""
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block as a child of the current span, a no-op outside a traced request"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace._add(name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+@contextmanager
+def profiled():
+    """cProfile the block into the current trace when it asked for a profile"""
+    trace = _current_trace.get()
+    if trace is None or not trace.profile:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active on this thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        trace.add_profile(profiler)